@@ -0,0 +1,255 @@
+import argparse
+import gc
+import io
+import json
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Dict, List
+
+from PIL import Image
+from rich.console import Console
+from rich.table import Table
+
+from jm_downloader.cbz_packer import CbzPacker
+from jm_downloader.db import JmDB
+from jm_downloader.utils import clean_title_for_filename, remove_all_bracketed
+
+console = Console()
+
+_TITLE_PARTS = [
+    '[{author}] ', '(C{n}) ', '【{tag}】', '（{tag}）', '{{DL版}}', '《{tag}》', ' 〈{tag}〉',
+]
+_WORDS = ['夏日', 'の', '約束', 'Summer', 'Days', '彼女', 'と', '秘密', '放課後', 'Memories', '第二話', '完全版']
+
+
+@dataclass
+class BenchResult:
+    name: str
+    ops: int
+    seconds: float
+    nbytes: int = 0
+    peak_kib: float = 0.0
+
+    @property
+    def ops_per_sec(self) -> float:
+        return self.ops / max(self.seconds, 1e-9)
+
+    @property
+    def mb_per_sec(self) -> float:
+        return self.nbytes / 1024 / 1024 / max(self.seconds, 1e-9)
+
+    def to_baseline(self) -> Dict[str, float]:
+        return {'ops_per_sec': self.ops_per_sec, 'mb_per_sec': self.mb_per_sec, 'peak_kib': self.peak_kib}
+
+
+@dataclass
+class FakeAlbum:
+    album_id: str
+    title: str
+    author: List[str]
+    tags: List[str]
+    description: str
+
+
+def synthetic_titles(n: int, rnd: random.Random) -> List[str]:
+    titles = []
+    for _ in range(n):
+        parts = [p.format(author=rnd.choice(_WORDS), n=rnd.randint(80, 104), tag=rnd.choice(_WORDS))
+                 for p in rnd.sample(_TITLE_PARTS, rnd.randint(1, len(_TITLE_PARTS)))]
+        parts.insert(rnd.randint(0, len(parts)), ' '.join(rnd.choices(_WORDS, k=rnd.randint(2, 8))))
+        titles.append(''.join(parts))
+    return titles
+
+
+def synthetic_album(aid: int, rnd: random.Random, n_authors: int) -> FakeAlbum:
+    return FakeAlbum(
+        album_id=str(aid),
+        title=' '.join(rnd.choices(_WORDS, k=6)),
+        author=[f'author_{rnd.randrange(n_authors)}' for _ in range(rnd.randint(1, 2))],
+        tags=[f'tag_{rnd.randrange(200)}' for _ in range(rnd.randint(3, 8))],
+        description='desc ' * rnd.randint(5, 40),
+    )
+
+
+def make_image_folder(folder: Path, pages: int, size: tuple, rnd: random.Random) -> int:
+    """
+    生成指定页数的 JPEG 章节目录（带噪点，避免被压缩得过小），返回总字节数
+    """
+    folder.mkdir(parents=True, exist_ok=True)
+    base = Image.effect_noise(size, 48).convert('RGB')
+    total = 0
+    for i in range(pages):
+        buf = io.BytesIO()
+        base.rotate(rnd.randint(0, 3) * 90, expand=False).save(buf, 'JPEG', quality=rnd.randint(70, 95))
+        data = buf.getvalue()
+        (folder / f'{i + 1:04d}.jpg').write_bytes(data)
+        total += len(data)
+    return total
+
+
+def make_db(path: Path, books: int, rnd: random.Random, batch: int = 5000) -> JmDB:
+    db = JmDB(path, batch_size=batch)
+    n_authors = max(1, books // 20)
+    for start in range(0, books, batch):
+        with db.transaction():
+            for aid in range(start, min(books, start + batch)):
+                db.save_book(synthetic_album(aid, rnd, n_authors))
+    db.flush()
+    return db
+
+
+def measure(name: str, fn: Callable[[], None], ops: int, nbytes: int = 0, repeat: int = 3) -> BenchResult:
+    """
+    取 repeat 次中最快的一次计时，另跑一次开启 tracemalloc 的用于统计 Python 内存峰值
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        gc.collect()
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    gc.collect()
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return BenchResult(name=name, ops=ops, seconds=best, nbytes=nbytes, peak_kib=peak / 1024)
+
+
+def bench_utils(rnd: random.Random, n: int) -> List[BenchResult]:
+    titles = synthetic_titles(n, rnd)
+    return [
+        measure('utils.remove_all_bracketed', lambda: [remove_all_bracketed(t) for t in titles], n),
+        measure('utils.clean_title_for_filename', lambda: [clean_title_for_filename(t) for t in titles], n),
+        measure('utils.clean_title_for_filename(keep)',
+                lambda: [clean_title_for_filename(t, extract_brackets=False) for t in titles], n),
+    ]
+
+
+def bench_pack(rnd: random.Random, workdir: Path, page_counts: List[int], size: tuple) -> List[BenchResult]:
+    results = []
+    for pages in page_counts:
+        folder = workdir / f'chapter_{pages}'
+        nbytes = make_image_folder(folder, pages, size, rnd)
+        target = workdir / f'chapter_{pages}.cbz'
+        results.append(measure(
+            f'CbzPacker.pack_images_to_cbz[{pages}p]',
+            lambda: CbzPacker.pack_images_to_cbz(folder, target, title='bench', series='bench', number=1,
+                                                 authors='a', tags='t', summary='s', album_id='1'),
+            ops=pages, nbytes=nbytes))
+    return results
+
+
+def bench_db(rnd: random.Random, workdir: Path, books: int, ops: int) -> List[BenchResult]:
+    console.log(f'[blue]生成 {books} 本书籍的数据库...[/blue]')
+    db = make_db(workdir / f'bench_{books}.sqlite', books, rnd)
+    n_authors = max(1, books // 20)
+    try:
+        new_albums = [synthetic_album(books + i, rnd, n_authors) for i in range(ops)]
+        packed = [(str(rnd.randrange(books)), str(rnd.randrange(10 ** 6))) for _ in range(ops)]
+        lookups = packed[: ops // 2] + [(str(rnd.randrange(books)), 'missing') for _ in range(ops - ops // 2)]
+        rnd.shuffle(lookups)
+
+        def save_books():
+            for album in new_albums:
+                db.save_book(album)
+            db.flush()
+
+        def mark_packed():
+            for aid, pid in packed:
+                db.mark_packed(aid, pid)
+            db.flush()
+
+        results = [
+            measure(f'JmDB.save_book[{books}]', save_books, ops),
+            measure(f'JmDB.mark_packed[{books}]', mark_packed, ops),
+            measure(f'JmDB.is_packed[{books}]', lambda: [db.is_packed(a, p) for a, p in lookups], ops),
+            measure(f'JmDB.get_all_authors[{books}]', db.get_all_authors, 1, repeat=3),
+        ]
+    finally:
+        db.close()
+    return results
+
+
+def compare(results: List[BenchResult], baseline: Dict[str, Dict[str, float]], threshold: float) -> List[str]:
+    """
+    吞吐下降或内存峰值上升超过 threshold 的项目视为回归；内存只在增长超过 64 KiB 时才计入，避免噪声
+    """
+    regressions = []
+    for r in results:
+        base = baseline.get(r.name)
+        if not base:
+            continue
+        if r.ops_per_sec < base['ops_per_sec'] * (1 - threshold):
+            regressions.append(f"{r.name}: ops/s {base['ops_per_sec']:.1f} -> {r.ops_per_sec:.1f}")
+        if r.peak_kib > base['peak_kib'] * (1 + threshold) and r.peak_kib - base['peak_kib'] > 64:
+            regressions.append(f"{r.name}: 内存峰值 {base['peak_kib']:.0f} KiB -> {r.peak_kib:.0f} KiB")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='JM Downloader 离线性能基准')
+    parser.add_argument('--only', nargs='*', choices=['utils', 'pack', 'db'], default=['utils', 'pack', 'db'],
+                        help='只运行指定分组')
+    parser.add_argument('--titles', type=int, default=20000, help='标题清洗基准的样本数')
+    parser.add_argument('--pages', type=int, nargs='*', default=[20, 100], help='打包基准的章节页数')
+    parser.add_argument('--page-size', type=int, nargs=2, default=[1000, 1400], metavar=('W', 'H'),
+                        help='打包基准的图片尺寸')
+    parser.add_argument('--books', type=int, nargs='*', default=[10000],
+                        help='数据库基准的书籍数量，可指定多个（如 10000 1000000）')
+    parser.add_argument('--db-ops', type=int, default=2000, help='每个数据库基准的操作次数')
+    parser.add_argument('--baseline', default='bench_baseline.json', help='基准结果文件')
+    parser.add_argument('--save-baseline', action='store_true', help='把本次结果写入基准文件')
+    parser.add_argument('--threshold', type=float, default=0.2, help='允许的退化比例，超过则以非零状态退出')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    rnd = random.Random(args.seed)
+    results: List[BenchResult] = []
+    with tempfile.TemporaryDirectory(prefix='jm-bench-') as tmp:
+        workdir = Path(tmp)
+        if 'utils' in args.only:
+            results += bench_utils(rnd, args.titles)
+        if 'pack' in args.only:
+            results += bench_pack(rnd, workdir, args.pages, tuple(args.page_size))
+        if 'db' in args.only:
+            for books in args.books:
+                results += bench_db(rnd, workdir, books, args.db_ops)
+
+    baseline_path = Path(args.baseline)
+    baseline = json.loads(baseline_path.read_text(encoding='utf-8')) if baseline_path.exists() else {}
+
+    table = Table('基准', 'ops/s', 'MB/s', '内存峰值 (KiB)', '基准 ops/s')
+    for r in results:
+        base = baseline.get(r.name)
+        table.add_row(r.name, f'{r.ops_per_sec:,.1f}', f'{r.mb_per_sec:,.1f}' if r.nbytes else '-',
+                      f'{r.peak_kib:,.0f}', f"{base['ops_per_sec']:,.1f}" if base else '-')
+    console.print(table)
+
+    if args.save_baseline:
+        baseline.update({r.name: r.to_baseline() for r in results})
+        baseline_path.write_text(json.dumps(baseline, indent=2, ensure_ascii=False), encoding='utf-8')
+        console.log(f'[green]基准结果已写入 {baseline_path}[/green]')
+        return
+
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+        console.log(f'[red]发现 {len(regressions)} 项性能退化（阈值 {args.threshold:.0%}）:[/red]')
+        for line in regressions:
+            console.log(f'[red]  {line}[/red]')
+        sys.exit(1)
+    if baseline:
+        console.log('[green]未发现超过阈值的性能退化[/green]')
+    else:
+        console.log(f'[yellow]没有基准文件 {baseline_path}，使用 --save-baseline 生成[/yellow]')
+
+
+if __name__ == '__main__':
+    main()
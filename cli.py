@@ -1,122 +1,345 @@
 import argparse
-from pathlib import Path
+import multiprocessing
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Optional
 
 from rich.console import Console
+from rich.progress import track
 from rich.table import Table
 
 from jm_downloader.config import DownloaderConfig, load_config_from_yaml
 from jm_downloader.db import JmDB
-from jm_downloader.downloader import JmFavDownloader
-from jm_downloader.utils import setup_logging
+from jm_downloader.metrics import RunReporter
+from jm_downloader.profiling import PROFILE_MODES, Profiler
+from jm_downloader.utils import setup_logging, RateLimiter
 
 console = Console()
 
 
+def search_author_updates(client, limiter: RateLimiter, author: str, watermark: Optional[int], max_pages: int):
+    """
+    按最新排序逐页搜索作者作品，直到遇到水位线（已见过的最大本子 id）为止。
+    没有水位线的作者只看第一页，用来建立水位线
+    """
+    new_ids = []
+    max_seen = watermark
+    for page_no in range(1, max_pages + 1):
+        limiter.acquire()
+        page = client.search_author(author, page=page_no)
+        ids = [int(aid) for aid, _ in page.iter_id_title()]
+        if not ids:
+            break
+        reached = False
+        for aid in ids:
+            max_seen = aid if max_seen is None else max(max_seen, aid)
+            if watermark is not None and aid <= watermark:
+                reached = True
+                break
+            new_ids.append(str(aid))
+        page_count = getattr(page, 'page_count', None) or 1
+        if reached or watermark is None or page_no >= page_count:
+            break
+    return new_ids, max_seen
+
+
 # Todo: 可能需要优化作者名(因为很多本子的作者名会出现 名称(名称2))
-def check_updates(cfg: DownloaderConfig):
+def check_updates(cfg: DownloaderConfig, force: bool = False, download_new: bool = False, profiler=None):
     db = JmDB(cfg.save_db)
+    try:
+        _check_updates(cfg, db, force, download_new, profiler)
+    finally:
+        db.close()
+
+
+def _check_updates(cfg: DownloaderConfig, db: JmDB, force: bool, download_new: bool, profiler=None,
+                   downloader=None) -> list:
+    """
+    返回发现的未入库新本子 id；downloader 为空时新建一个
+    """
     authors = db.get_all_authors()
 
     if not authors:
         console.print("[yellow]数据库中没有作者记录，请先下载一些本子积累缓存。[/yellow]")
-        return
+        return []
+
+    watermarks = db.get_author_watermarks()
+    now = time.time()
+    interval = cfg.check_interval_hours * 3600
+    if not force and interval > 0:
+        due = [a for a in authors
+               if now - (watermarks.get(a, {}).get('checked_at') or 0) >= interval]
+        skipped = len(authors) - len(due)
+        if skipped:
+            console.print(f"[blue]{skipped} 位作者在 {cfg.check_interval_hours} 小时内已检查过，跳过[/blue]")
+    else:
+        due = list(authors)
+
+    if not due:
+        console.print("[green]所有作者近期均已检查过[/green]")
+        return []
 
-    console.print(f"[blue]正在检查 {len(authors)} 位作者的更新...[/blue]")
+    console.print(f"[blue]正在检查 {len(due)} 位作者的更新...[/blue]")
 
-    downloader = JmFavDownloader(cfg)
+    if downloader is None:
+        from jm_downloader.downloader import JmFavDownloader
+        downloader = JmFavDownloader(cfg, profiler=profiler)
     client = downloader.client
+    limiter = RateLimiter(cfg.check_rate, burst=max(1, cfg.check_workers))
 
     updated_authors = []
 
-    for author in authors:
-        try:
-            search_gen = client.search_album(author, page=1)
-            found_new = False
-            latest_id_found = None
-
-            page = search_gen
-            first_page = None
-            if hasattr(search_gen, 'iter_id_title'):
-                first_page = search_gen
-            else:
-                try:
-                    first_page = next(search_gen)
-                except StopIteration:
-                    pass
-
-            if not first_page:
+    with ThreadPoolExecutor(max_workers=max(1, cfg.check_workers)) as pool:
+        futures = {
+            pool.submit(search_author_updates, client, limiter, author,
+                        (watermarks.get(author) or {}).get('max_album_id'), cfg.check_max_pages): author
+            for author in due
+        }
+        for fut in track(as_completed(futures), total=len(futures), description="检查作者更新...",
+                         console=console):
+            author = futures[fut]
+            try:
+                new_ids, max_seen = fut.result()
+            except Exception as e:
+                console.print(f"  [red]检查作者 {author} 失败: {e}[/red]")
                 continue
 
-            for aid, atitle in first_page.iter_id_title():
-                aid = str(aid)
-                if not db.get_book(aid):
-                    found_new = True
-                    latest_id_found = aid
-                    break
-                else:
-                    break
-
-            if found_new:
-                updated_authors.append((author, latest_id_found))
-                console.print(f"  [green]发现更新: {author} (最新ID: {latest_id_found})[/green]")
-        except Exception as e:
-            console.print(f"  [red]检查作者 {author} 失败: {e}[/red]")
+            known = db.get_books(new_ids)
+            new_ids = [aid for aid in new_ids if aid not in known]
+            db.set_author_watermark(author, max_seen, now)
+            if new_ids:
+                updated_authors.append((author, new_ids))
+                console.print(f"  [green]发现更新: {author} ({len(new_ids)} 本，最新ID: {new_ids[0]})[/green]")
 
+    album_ids = list(dict.fromkeys(aid for _, aids in updated_authors for aid in aids))
     if updated_authors:
         console.rule("[bold green]更新汇总[/bold green]")
-        table = Table("作者", "最新书籍ID (未入库)")
-        for auth, aid in updated_authors:
-            table.add_row(auth, aid)
+        table = Table("作者", "新书数量", "书籍ID (未入库)")
+        for auth, aids in updated_authors:
+            table.add_row(auth, str(len(aids)), ', '.join(aids))
         console.print(table)
+        if download_new:
+            downloader.download_album_list(album_ids)
     else:
         console.print("[green]所有作者均为最新状态 (或未发现新书)[/green]")
+    return album_ids
+
+
+def pending_album_ids(cfg: DownloaderConfig, album_ids) -> list:
+    """
+    只查数据库，返回尚未标记完成的本子
+    """
+    db = JmDB(cfg.save_db)
+    try:
+        books = db.get_books([str(a) for a in album_ids])
+    finally:
+        db.close()
+    return [a for a in album_ids if (books.get(str(a)) or {}).get('download_status') != 1]
+
+
+def download(cfg: DownloaderConfig, profiler=None):
+    console.log(f'[blue]配置载入：输出 {cfg.out_dir}，重试 {cfg.retries}，清洗标题 {cfg.extract_title}[/blue]')
+
+    # 指定的本子全部已完成时直接结束，不加载 jmcomic、不访问网络
+    if cfg.album_ids and not pending_album_ids(cfg, cfg.album_ids):
+        console.log(f'[green]指定的 {len(cfg.album_ids)} 个本子均已完成，无需下载[/green]')
+        return
+
+    from jm_downloader.downloader import JmFavDownloader
+    downloader = JmFavDownloader(cfg, profiler=profiler)
+    album_ids = []
+    if cfg.album_ids:
+        album_ids.extend(cfg.album_ids)
+    else:
+        # 上次中断或失败的本子排在最前面，先把它们补齐
+        album_ids.extend(downloader.db.get_unfinished_albums())
+        if album_ids:
+            console.log(f'[blue]继续处理 {len(album_ids)} 个未完成的本子[/blue]')
+        if cfg.download_favorites:
+            favs = downloader.get_favorites_album_ids()
+            album_ids.extend([a for a in favs if a not in album_ids])
+    if not album_ids:
+        console.print('[yellow]未找到要下载的本子（既没有指定 album 也未获取到收藏）[/yellow]')
+        return
+    downloader.download_album_list(album_ids)
+
+
+def retry_failed(cfg: DownloaderConfig, album_ids=None, profiler=None):
+    """
+    把任务表中失败的本子/章节/页面重新置为待处理并重新下载；已完成的页面不会重复下载
+    """
+    db = JmDB(cfg.save_db)
+    try:
+        failed = db.get_failed_tasks(album_ids or None)
+        if not failed:
+            console.print('[green]没有失败的任务[/green]')
+            return
+        table = Table('album_id', '章节', '页', '尝试次数', '最后错误')
+        for row in failed[:30]:
+            table.add_row(row['album_id'], row['photo_id'] or '-', str(row['page'] or '-'), str(row['attempts']),
+                          row['last_error'] or '')
+        console.print(table)
+        if len(failed) > 30:
+            console.print(f'[blue]... 共 {len(failed)} 个失败任务[/blue]')
+        retry_ids = db.reset_failed_tasks(album_ids or None)
+    finally:
+        db.close()
+
+    console.log(f'[blue]重新下载 {len(retry_ids)} 个本子中失败的部分[/blue]')
+    from jm_downloader.downloader import JmFavDownloader
+    JmFavDownloader(cfg, profiler=profiler).download_album_list(retry_ids)
+
+
+def run_worker(cfg: DownloaderConfig, profiler=None, downloader=None):
+    from jm_downloader.worker import Worker
+    if downloader is None:
+        from jm_downloader.downloader import JmFavDownloader
+        downloader = JmFavDownloader(cfg, profiler=profiler)
+    try:
+        Worker(downloader, lease_seconds=cfg.worker_lease, poll_interval=cfg.worker_poll).run()
+    finally:
+        downloader.close()
+
+
+def _worker_process(cfg: DownloaderConfig, profile_mode: Optional[str]):
+    # 子进程各自写运行报告和性能分析结果，文件名带上进程号
+    setup_logging()
+    reporter = RunReporter.from_config(cfg, f'worker-{os.getpid()}').start()
+    profiler = Profiler.create(profile_mode, cfg.out_dir / 'profiles', 'worker')
+    try:
+        run_worker(cfg, profiler)
+    finally:
+        reporter.close()
+        profiler.close()
+
+
+def worker(cfg: DownloaderConfig, processes: int = 1, profiler=None, profile_mode: Optional[str] = None):
+    """
+    把指定的本子（或收藏夹）加入任务队列，然后启动 processes 个 worker 进程共同处理队列。
+    队列在数据库中，也可以在同一台机器上另开终端运行 worker 加入处理
+    """
+    downloader = None
+    album_ids = list(cfg.album_ids)
+    if not album_ids and cfg.download_favorites:
+        from jm_downloader.downloader import JmFavDownloader
+        downloader = JmFavDownloader(cfg, profiler=profiler)
+        album_ids = downloader.get_favorites_album_ids()
+    if album_ids:
+        todo = pending_album_ids(cfg, album_ids)
+        db = JmDB(cfg.save_db)
+        try:
+            added = db.enqueue_albums([str(a) for a in todo])
+        finally:
+            db.close()
+        console.log(f'[blue]{len(todo)}/{len(album_ids)} 个本子未完成，其中 {added} 个加入任务队列'
+                    f'（已在队列中的不重复加入，已失败的任务请用 retry-failed 重置）[/blue]')
+
+    if processes <= 1:
+        run_worker(cfg, profiler, downloader)
+        return
+    if downloader is not None:
+        downloader.close()
+    console.log(f'[blue]启动 {processes} 个 worker 进程[/blue]')
+    ctx = multiprocessing.get_context('spawn')
+    procs = [ctx.Process(target=_worker_process, args=(cfg, profile_mode), name=f'jm-worker-{i}')
+             for i in range(processes)]
+    for proc in procs:
+        proc.start()
+    for proc in procs:
+        proc.join()
+    failed = [p.name for p in procs if p.exitcode]
+    if failed:
+        console.log(f'[red]{len(failed)} 个 worker 进程异常退出，它们持有的任务会在租约到期后被重新认领[/red]')
+
+
+def serve(cfg: DownloaderConfig, profiler=None):
+    """
+    常驻模式：定时增量同步收藏夹、检查作者更新，新本子自动下载；启动时先补齐指定的本子、任务表中未完成的本子和未完成的收藏
+    """
+    from jm_downloader.daemon import Daemon, Schedule
+    from jm_downloader.downloader import JmFavDownloader
+    downloader = JmFavDownloader(cfg, profiler=profiler)
+    known = None
+
+    def poll_favorites():
+        # 第一次返回全部收藏（已完成的会被跳过），之后只返回新出现的
+        nonlocal known
+        ids = downloader.get_favorites_album_ids()
+        new_ids = ids if known is None else [a for a in ids if a not in known]
+        known = set(ids)
+        return new_ids
+
+    def poll_authors():
+        return _check_updates(cfg, downloader.db, False, False, profiler, downloader)
+
+    daemon = Daemon(downloader, [
+        Schedule('favorites', cfg.serve_favorites_interval if cfg.download_favorites else 0, poll_favorites),
+        Schedule('check-update', cfg.serve_check_interval, poll_authors),
+    ], jitter=cfg.serve_jitter, retry_delay=cfg.serve_retry_delay,
+        status_host=cfg.serve_host, status_port=cfg.serve_port)
+    daemon.enqueue(list(cfg.album_ids) + downloader.db.get_unfinished_albums())
+    try:
+        daemon.run()
+    except KeyboardInterrupt:
+        console.log('[yellow]收到中断，退出常驻模式[/yellow]')
+    finally:
+        downloader.close()
 
 
 def main():
     parser = argparse.ArgumentParser(description='JM 收藏下载器 - modular')
-    parser.add_argument('command', nargs='?', choices=['download', 'check-update'], default='download',
-                        help='执行命令: download (默认) 或 check-update')
+    parser.add_argument('command', nargs='?',
+                        choices=['download', 'check-update', 'retry-failed', 'worker', 'serve'],
+                        default='download',
+                        help='执行命令: download (默认)、check-update、retry-failed (重试任务表中失败的页面/章节)、'
+                             'worker (多进程从任务队列认领本子/章节) 或 serve (常驻运行，定时同步收藏夹和检查作者更新)')
     parser.add_argument('--config', '-c', help='YAML 配置文件路径', default=None)
-    parser.add_argument('--album', '-a', nargs='*', help='指定 album id 列表', default=[])
+    parser.add_argument('--album', '-a', nargs='*', help='指定 album id 列表（retry-failed 时只重试这些本子）',
+                        default=[])
     parser.add_argument('--username', '-u', help='JM 登录用户名', default=None)
     parser.add_argument('--password', '-p', help='JM 登录密码', default=None)
     parser.add_argument('--no-fav', action='store_true', help='不要下载收藏夹')
+    parser.add_argument('--force', action='store_true', help='check-update: 忽略检查间隔，检查所有作者')
+    parser.add_argument('--download-new', action='store_true', help='check-update: 下载发现的新本子')
+    parser.add_argument('--processes', '-n', type=int, default=1,
+                        help='worker: 启动的 worker 进程数（共用数据库和输出目录）')
+    parser.add_argument('--profile', choices=PROFILE_MODES, default=None,
+                        help='按阶段进行性能分析: cpu (cProfile) 或 memory (tracemalloc)，结果写入 out_dir/profiles/')
     args = parser.parse_args()
 
     cfg_data = load_config_from_yaml(args.config)
-    cfg = DownloaderConfig(
-        out_dir=Path(cfg_data.get('out_dir', './downloads')),
-        retries=int(cfg_data.get('retries', 3)),
-        delete_after_pack=bool(cfg_data.get('delete_after_pack', False)),
-        extract_title=bool(cfg_data.get('extract_title', False)),
-        jm_option_file=Path(cfg_data['jm_option_file']) if cfg_data.get('jm_option_file') else None,
+    cfg = DownloaderConfig.from_dict(
+        cfg_data,
         username=args.username or cfg_data.get('username'),
         password=args.password or cfg_data.get('password'),
         download_favorites=not args.no_fav and cfg_data.get('download_favorites', True),
         album_ids=args.album or cfg_data.get('album_ids', []),
-        save_db=Path(cfg_data.get('save_db', './downloads_db.sqlite'))
     )
 
     cfg.ensure_dirs()
     setup_logging()
 
-    if args.command == 'check-update':
-        check_updates(cfg)
-        return
-
-    console.log(f'[blue]配置载入：输出 {cfg.out_dir}，重试 {cfg.retries}，清洗标题 {cfg.extract_title}[/blue]')
-
-    downloader = JmFavDownloader(cfg)
-    album_ids = []
-    if cfg.album_ids:
-        album_ids.extend(cfg.album_ids)
-    elif cfg.download_favorites:
-        favs = downloader.get_favorites_album_ids()
-        album_ids.extend([a for a in favs if a not in album_ids])
-    if not album_ids:
-        console.print('[yellow]未找到要下载的本子（既没有指定 album 也未获取到收藏）[/yellow]')
-        return
-    downloader.download_album_list(album_ids)
+    reporter = RunReporter.from_config(cfg, args.command).start()
+    profiler = Profiler.create(args.profile, cfg.out_dir / 'profiles', args.command)
+    try:
+        if args.command == 'check-update':
+            check_updates(cfg, force=args.force, download_new=args.download_new, profiler=profiler)
+        elif args.command == 'retry-failed':
+            retry_failed(cfg, album_ids=args.album, profiler=profiler)
+        elif args.command == 'worker':
+            worker(cfg, processes=args.processes, profiler=profiler, profile_mode=args.profile)
+        elif args.command == 'serve':
+            serve(cfg, profiler=profiler)
+        else:
+            download(cfg, profiler=profiler)
+    finally:
+        report = reporter.close()
+        if report:
+            console.log(f'[blue]运行报告已写入 {report}[/blue]')
+        profile_dir = profiler.close()
+        if profile_dir:
+            console.log(f'[blue]性能分析结果已写入 {profile_dir}[/blue]')
 
 
 if __name__ == '__main__':
@@ -1,23 +1,107 @@
+import os
+import threading
+import time
+import zipfile
 from pathlib import Path
-from typing import Optional
+from typing import Optional, Dict, List
 
+import xmltodict
 from cbz.comic import ComicInfo
-from cbz.constants import PageType, Format
+from cbz.constants import PageType, Format, XML_NAME
 from cbz.page import PageInfo
 
+from .metrics import metrics
+from .transcode import TranscodeSettings
+from .utils import PART_SUFFIX
+
+
+class CbzWriter:
+    """
+    增量写入 CBZ：页面可按任意顺序加入，但按页序写入 zip（有的阅读器按条目顺序而不是文件名显示），
+    前面的页还没到时后面的页暂存在内存中（数量见 buffered，由调用方控制提交窗口）；
+    finish 时写入 ComicInfo.xml，并把临时文件原子替换为目标文件
+    """
+
+    def __init__(self, cbz_path: Path, total_pages: int):
+        self.cbz_path = cbz_path
+        self.total_pages = total_pages
+        self.tmp_path = cbz_path.with_name(cbz_path.name + '.tmp')
+        self._pages: Dict[int, PageInfo] = {}
+        # 等待前面的页面写入的页
+        self._waiting: Dict[int, PageInfo] = {}
+        self._next = 0
+        self._lock = threading.Lock()
+        self._zf = zipfile.ZipFile(self.tmp_path, 'w', zipfile.ZIP_STORED)
+
+    def _page_type(self, index: int) -> PageType:
+        if index == 0:
+            return PageType.FRONT_COVER
+        if index == self.total_pages - 1:
+            return PageType.BACK_COVER
+        return PageType.STORY
+
+    def add_page(self, index: int, data: bytes, name: str = '') -> None:
+        """
+        加入第 index 页（从 0 开始），之前的页都已加入时连同暂存的后续页一起写入
+        """
+        page = PageInfo.loads(data, type=self._page_type(index), name=name)
+        with self._lock:
+            self._waiting[index] = page
+            while self._next in self._waiting:
+                self._write(self._next, self._waiting.pop(self._next))
+                self._next += 1
+        metrics.inc('cbz_pages_total')
+        metrics.inc('cbz_bytes_total', len(data))
+
+    @property
+    def buffered(self) -> int:
+        return len(self._waiting)
+
+    def _write(self, index: int, page: PageInfo) -> None:
+        self._zf.writestr(f"page-{index + 1:03d}{page.suffix}", page.content)
+        self._pages[index] = CbzWriter._page_meta(page)
+
+    def add_file(self, index: int, path: Path) -> None:
+        self.add_page(index, path.read_bytes(), name=path.name)
+
+    def finish(self, title: str, series: Optional[str], number: Optional[float],
+               authors: Optional[str] = None, tags: Optional[str] = None, summary: Optional[str] = None,
+               album_id: Optional[str] = None, scan_information: Optional[str] = None) -> None:
+        with self._lock:
+            # 有缺页时剩下的页仍按页序写入
+            for index in sorted(self._waiting):
+                self._write(index, self._waiting.pop(index))
+        pages = [self._pages[i] for i in sorted(self._pages)]
+        comic = CbzWriter._build_comic(pages, title, series, number, authors, tags, summary, album_id)
+        if scan_information:
+            comic.scan_information = scan_information
+        try:
+            with self._lock:
+                self._zf.writestr(XML_NAME, CbzWriter.comic_info_xml(comic))
+                self._zf.close()
+            os.replace(self.tmp_path, self.cbz_path)
+        except BaseException:
+            self.abort()
+            raise
+        metrics.inc('cbz_written_total')
+
+    def abort(self) -> None:
+        with self._lock:
+            try:
+                self._zf.close()
+            finally:
+                self.tmp_path.unlink(missing_ok=True)
 
-class CbzPacker:
     @staticmethod
-    def pack_images_to_cbz(images_folder: Path, cbz_path: Path, title: str, series: Optional[str],
-                           number: Optional[float], authors: Optional[str] = None,
-                           tags: Optional[str] = None, summary: Optional[str] = None,
-                           album_id: Optional[str] = None) -> None:
-        paths = sorted([p for p in images_folder.iterdir() if p.is_file()])
-        pages = []
-        for i, p in enumerate(paths):
-            pt = PageType.FRONT_COVER if i == 0 else PageType.BACK_COVER if i == len(paths) - 1 else PageType.STORY
-            pages.append(PageInfo.load(path=p, type=pt))
+    def _page_meta(page: PageInfo) -> PageInfo:
+        # 只保留 ComicInfo.xml 需要的页面元数据，丢弃图片内容
+        return PageInfo(type=page.type, image_size=page.image_size, image_width=page.image_width,
+                        image_height=page.image_height, suffix=page.suffix, name=page.name)
 
+    @staticmethod
+    def _build_comic(pages, title: str, series: Optional[str], number: Optional[float],
+                     authors: Optional[str], tags: Optional[str], summary: Optional[str],
+                     album_id: Optional[str]) -> ComicInfo:
         kwargs = {
             'title': title,
             'series': series or title,
@@ -32,5 +116,46 @@ class CbzPacker:
             comic.tags = tags
         if summary:
             comic.notes = summary
-        cbz_bytes = comic.pack()
-        cbz_path.write_bytes(cbz_bytes)
+        return comic
+
+    @staticmethod
+    def comic_info_xml(comic: ComicInfo) -> bytes:
+        # 与 cbz 库 ComicInfo.pack() 生成的 ComicInfo.xml 保持一致
+        xml_content = xmltodict.unparse({"ComicInfo": comic.get_info()}, pretty=True)
+        return xml_content.replace("></Page>", " />").encode("utf-8")
+
+
+class CbzPacker:
+    @staticmethod
+    def image_files(images_folder: Path) -> List[Path]:
+        """
+        章节目录中的图片文件（按文件名排序），忽略未下载完成的 .part 文件
+        """
+        return sorted(p for p in images_folder.iterdir() if p.is_file() and p.suffix != PART_SUFFIX)
+
+    @staticmethod
+    def pack_images_to_cbz(images_folder: Path, cbz_path: Path, title: str, series: Optional[str],
+                           number: Optional[float], authors: Optional[str] = None,
+                           tags: Optional[str] = None, summary: Optional[str] = None,
+                           album_id: Optional[str] = None,
+                           transcode: Optional[TranscodeSettings] = None) -> None:
+        started = time.perf_counter()
+        paths = CbzPacker.image_files(images_folder)
+        writer = CbzWriter(cbz_path, total_pages=len(paths))
+        encoded = 0
+        try:
+            for i, p in enumerate(paths):
+                if transcode is not None:
+                    with metrics.timer('transcode_seconds'):
+                        data, changed = transcode.apply_checked(p.read_bytes())
+                    encoded += changed
+                    writer.add_page(i, data, name=p.name)
+                else:
+                    writer.add_file(i, p)
+        except BaseException:
+            writer.abort()
+            raise
+        writer.finish(title=title, series=series, number=number, authors=authors, tags=tags,
+                      summary=summary, album_id=album_id,
+                      scan_information=transcode.scan_information(encoded, len(paths)) if transcode is not None else None)
+        metrics.observe('pack_seconds', time.perf_counter() - started)
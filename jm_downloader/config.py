@@ -8,10 +8,55 @@ from typing import List, Optional, Dict, Any
 class DownloaderConfig:
     out_dir: Path = Path("./downloads")
     retries: int = 3
+    image_workers: int = 4
+    # 图片解密进程数，0 表示 CPU 核数
+    descramble_workers: int = 0
     delete_after_pack: bool = False
+    # staged: 先保存原图到 originals/ 再打包; direct: 图片下载后直接写入 CBZ
+    pack_mode: str = "staged"
     extract_title: bool = False
+    # 启用后图片按内容哈希存放在 out_dir/store，章节目录中是指向它的硬链接，重复图片只保存/下载一次
+    image_store: bool = False
+    # 打包前转码：webp / avif / jpeg，留空表示保留原图；max_dim 为长边像素上限（0 不缩放）；workers 0 表示 CPU 核数
+    transcode_format: str = ""
+    transcode_quality: int = 80
+    transcode_max_dim: int = 0
+    transcode_workers: int = 0
     session_timeout: int = 20
+    # 每个 host 同时进行的请求数上限，0 表示跟随 image_workers
+    http_max_per_host: int = 0
+    # API 请求每秒上限，0 表示不限速
+    api_rate: float = 5.0
     save_db: Path = Path("./downloads_db.sqlite")
+    # 本子元数据缓存有效期（秒），0 表示数据库缓存永不过期
+    metadata_ttl: int = 0
+    # check-update: 并发数、每秒请求数、同一作者的最小检查间隔（小时）、每位作者最多翻页数
+    check_workers: int = 4
+    check_rate: float = 2.0
+    check_interval_hours: float = 12
+    check_max_pages: int = 5
+    # 同步的收藏夹 id，'0' 为全部收藏
+    favorite_folder: str = '0'
+    # 全量同步收藏夹时并发获取分页的线程数
+    favorite_workers: int = 4
+    # 运行结束时把指标写入 out_dir/reports/ 下的 JSON 报告
+    run_report: bool = True
+    # Prometheus textfile 路径（供 node_exporter 采集），运行期间每 metrics_interval 秒刷新一次；留空不导出
+    metrics_textfile: Optional[Path] = None
+    metrics_interval: float = 15
+    # worker 认领任务的租约（秒），进程崩溃后任务在租约到期后被其他 worker 接手
+    worker_lease: float = 300
+    # 剩余任务都被其他 worker 持有时，间隔多久再尝试认领（秒）
+    worker_poll: float = 5
+    # serve 常驻模式：同步收藏夹 / 检查作者更新的间隔（秒，0 为不运行），实际间隔在 ±serve_jitter 比例内随机
+    serve_favorites_interval: float = 600
+    serve_check_interval: float = 3600
+    serve_jitter: float = 0.1
+    # 下载失败的本子在 serve_retry_delay 秒后重新加入队列，每次失败间隔翻倍（最长 1 天），0 为不重试
+    serve_retry_delay: float = 300
+    # 状态接口监听地址，端口为 0 时不启动
+    serve_host: str = '127.0.0.1'
+    serve_port: int = 8765
     jm_option_file: Optional[Path] = None
     username: Optional[str] = None
     password: Optional[str] = None
@@ -26,6 +71,58 @@ class DownloaderConfig:
             with open(self.save_db, "w", encoding="utf-8") as f:
                 json.dump({}, f)
 
+    @property
+    def reports_dir(self) -> Path:
+        return self.out_dir / "reports"
+
+    @classmethod
+    def from_dict(cls, cfg_data: Dict[str, Any], **overrides) -> 'DownloaderConfig':
+        """
+        由 YAML 配置（load_config_from_yaml 的结果）构造配置，overrides 为命令行等需要覆盖的字段
+        """
+        kwargs = dict(
+            out_dir=Path(cfg_data.get('out_dir', './downloads')),
+            retries=int(cfg_data.get('retries', 3)),
+            image_workers=int(cfg_data.get('image_workers', 4)),
+            descramble_workers=int(cfg_data.get('descramble_workers', 0)),
+            http_max_per_host=int(cfg_data.get('http_max_per_host', 0)),
+            api_rate=float(cfg_data.get('api_rate', 5.0)),
+            delete_after_pack=bool(cfg_data.get('delete_after_pack', False)),
+            pack_mode=str(cfg_data.get('pack_mode', 'staged')),
+            extract_title=bool(cfg_data.get('extract_title', False)),
+            image_store=bool(cfg_data.get('image_store', False)),
+            transcode_format=str(cfg_data.get('transcode_format') or ''),
+            transcode_quality=int(cfg_data.get('transcode_quality', 80)),
+            transcode_max_dim=int(cfg_data.get('transcode_max_dim', 0)),
+            transcode_workers=int(cfg_data.get('transcode_workers', 0)),
+            jm_option_file=Path(cfg_data['jm_option_file']) if cfg_data.get('jm_option_file') else None,
+            username=cfg_data.get('username'),
+            password=cfg_data.get('password'),
+            download_favorites=bool(cfg_data.get('download_favorites', True)),
+            album_ids=[str(a) for a in cfg_data.get('album_ids') or []],
+            save_db=Path(cfg_data.get('save_db', './downloads_db.sqlite')),
+            metadata_ttl=int(cfg_data.get('metadata_ttl', 0)),
+            check_workers=int(cfg_data.get('check_workers', 4)),
+            check_rate=float(cfg_data.get('check_rate', 2.0)),
+            check_interval_hours=float(cfg_data.get('check_interval_hours', 12)),
+            check_max_pages=int(cfg_data.get('check_max_pages', 5)),
+            favorite_folder=str(cfg_data.get('favorite_folder', '0')),
+            favorite_workers=int(cfg_data.get('favorite_workers', 4)),
+            run_report=bool(cfg_data.get('run_report', True)),
+            metrics_textfile=Path(cfg_data['metrics_textfile']) if cfg_data.get('metrics_textfile') else None,
+            metrics_interval=float(cfg_data.get('metrics_interval', 15)),
+            worker_lease=float(cfg_data.get('worker_lease', 300)),
+            worker_poll=float(cfg_data.get('worker_poll', 5)),
+            serve_favorites_interval=float(cfg_data.get('serve_favorites_interval', 600)),
+            serve_check_interval=float(cfg_data.get('serve_check_interval', 3600)),
+            serve_jitter=float(cfg_data.get('serve_jitter', 0.1)),
+            serve_retry_delay=float(cfg_data.get('serve_retry_delay', 300)),
+            serve_host=str(cfg_data.get('serve_host', '127.0.0.1')),
+            serve_port=int(cfg_data.get('serve_port', 8765))
+        )
+        kwargs.update(overrides)
+        return cls(**kwargs)
+
 
 def load_config_from_yaml(path: str) -> Dict[str, Any]:
     import yaml, pathlib
@@ -0,0 +1,260 @@
+import json
+import random
+import signal
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Callable, Deque, Dict, List, Optional, Set, Tuple
+
+from rich.console import Console
+
+from .metrics import metrics
+
+console = Console()
+
+# 失败重试的最长间隔（秒）
+RETRY_MAX_DELAY = 86400
+
+
+@dataclass
+class Schedule:
+    """
+    定时任务：fn 返回发现的新本子 id，interval <= 0 时不运行
+    """
+    name: str
+    interval: float
+    fn: Callable[[], List[str]]
+    next_run: float = 0.0
+    runs: int = 0
+    failures: int = 0
+    last_run: Optional[float] = None
+    last_seconds: Optional[float] = None
+    last_found: int = 0
+    last_error: Optional[str] = None
+
+    def to_dict(self) -> dict:
+        return {
+            'interval': self.interval,
+            'next_run': self.next_run if self.interval > 0 else None,
+            'runs': self.runs,
+            'failures': self.failures,
+            'last_run': self.last_run,
+            'last_seconds': self.last_seconds,
+            'last_found': self.last_found,
+            'last_error': self.last_error,
+        }
+
+
+class StatusServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, addr, daemon: 'Daemon'):
+        super().__init__(addr, StatusHandler)
+        self.daemon = daemon
+
+
+class StatusHandler(BaseHTTPRequestHandler):
+    server: StatusServer
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def do_GET(self):
+        path = self.path.split('?', 1)[0]
+        if path in ('/', '/status'):
+            body = json.dumps(self.server.daemon.status(), indent=2, ensure_ascii=False).encode()
+            return self._send(200, body, 'application/json; charset=utf-8')
+        if path == '/metrics':
+            return self._send(200, metrics.to_prometheus().encode(), 'text/plain; version=0.0.4; charset=utf-8')
+        return self._send(404, b'not found', 'text/plain')
+
+    def _send(self, code: int, body: bytes, ctype: str):
+        self.send_response(code)
+        self.send_header('Content-Type', ctype)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class Daemon:
+    """
+    常驻运行：复用同一个下载器（客户端、登录态、连接池、数据库连接），
+    按各自的间隔（加上随机抖动，避免总在同一时刻请求）运行定时任务，
+    把发现的新本子放进下载队列，空闲时逐个下载。
+    下载失败的本子在 retry_delay 秒后重新入队，连续失败时间隔翻倍（最长 RETRY_MAX_DELAY），retry_delay <= 0 时不重试。
+    status_port > 0 时在 status_host 上提供 /status（JSON）和 /metrics（Prometheus）
+    """
+
+    def __init__(self, downloader, schedules: List[Schedule], jitter: float = 0.1, retry_delay: float = 300,
+                 status_host: str = '127.0.0.1', status_port: int = 0):
+        self.downloader = downloader
+        self.db = downloader.db
+        self.schedules = schedules
+        self.jitter = max(0.0, min(jitter, 0.9))
+        self.retry_delay = retry_delay
+        self.status_host = status_host
+        self.status_port = status_port
+        self.started_at = time.time()
+        self.current: Optional[str] = None
+        self.completed = 0
+        self.failed = 0
+        self._queue: Deque[str] = deque()
+        self._queued: Set[str] = set()
+        # album_id -> (连续失败次数, 下次重试时间)
+        self._retries: Dict[str, Tuple[int, float]] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._server: Optional[StatusServer] = None
+
+    def enqueue(self, album_ids: List[str]) -> int:
+        """
+        加入下载队列，跳过已在队列中和已完成的本子，返回实际加入的数量
+        """
+        ids = [str(a) for a in dict.fromkeys(album_ids)]
+        books = self.db.get_books(ids) if ids else {}
+        added = 0
+        with self._lock:
+            for aid in ids:
+                # 等待重试的本子按退避时间重新入队，这里不提前加入
+                if aid in self._queued or aid == self.current or aid in self._retries \
+                        or (books.get(aid) or {}).get('download_status') == 1:
+                    continue
+                self._queue.append(aid)
+                self._queued.add(aid)
+                added += 1
+            metrics.set('serve_queue_length', len(self._queue))
+        return added
+
+    def stop(self):
+        self._stop.set()
+
+    def status(self) -> dict:
+        with self._lock:
+            queue = list(self._queue)
+            retries = {aid: {'failures': n, 'next_retry': due} for aid, (n, due) in self._retries.items()}
+        return {
+            'started_at': self.started_at,
+            'uptime_seconds': round(time.time() - self.started_at, 1),
+            'current': self.current,
+            'queue_length': len(queue),
+            'queue': queue[:50],
+            'completed': self.completed,
+            'failed': self.failed,
+            'retrying': retries,
+            'schedules': {s.name: s.to_dict() for s in self.schedules},
+        }
+
+    def run(self):
+        self._start_status_server()
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, lambda *_: self.stop())
+        console.log('[blue]常驻模式已启动：' + '，'.join(
+            f'{s.name} 每 {s.interval:g} 秒' if s.interval > 0 else f'{s.name} 已关闭' for s in self.schedules)
+                    + '[/blue]')
+        try:
+            while not self._stop.is_set():
+                self._run_due()
+                self._requeue_due_retries()
+                aid = self._pop()
+                if aid is not None:
+                    self._download(aid)
+                    continue
+                self._stop.wait(self._seconds_until_due())
+        finally:
+            if self._server is not None:
+                self._server.shutdown()
+                self._server.server_close()
+            console.log(f'[blue]常驻模式退出：完成 {self.completed} 本，失败 {self.failed} 本[/blue]')
+
+    def _start_status_server(self):
+        if self.status_port <= 0:
+            return
+        self._server = StatusServer((self.status_host, self.status_port), self)
+        threading.Thread(target=self._server.serve_forever, name='jm-status', daemon=True).start()
+        console.log(f'[blue]状态接口: http://{self.status_host}:{self.status_port}/status[/blue]')
+
+    def _next_delay(self, interval: float) -> float:
+        return interval * (1 + random.uniform(-self.jitter, self.jitter))
+
+    def _seconds_until_due(self) -> Optional[float]:
+        due = [s.next_run for s in self.schedules if s.interval > 0]
+        with self._lock:
+            due.extend(t for _, t in self._retries.values())
+        if not due:
+            return None
+        return max(0.0, min(due) - time.time())
+
+    def _run_due(self):
+        for s in self.schedules:
+            if self._stop.is_set():
+                return
+            if s.interval <= 0 or time.time() < s.next_run:
+                continue
+            started = time.perf_counter()
+            try:
+                found = s.fn() or []
+                s.last_found = self.enqueue(found)
+                s.last_error = None
+                result = 'ok'
+                if s.last_found:
+                    console.log(f'[green]{s.name}: {s.last_found} 个新本子加入下载队列[/green]')
+            except Exception as e:
+                s.failures += 1
+                s.last_error = str(e)
+                result = 'error'
+                console.log(f'[red]{s.name} 执行失败: {e}[/red]')
+            s.runs += 1
+            s.last_run = time.time()
+            s.last_seconds = round(time.perf_counter() - started, 3)
+            s.next_run = s.last_run + self._next_delay(s.interval)
+            metrics.inc('serve_schedule_runs_total', schedule=s.name, result=result)
+            metrics.observe('serve_schedule_seconds', s.last_seconds, schedule=s.name)
+
+    def _requeue_due_retries(self):
+        now = time.time()
+        with self._lock:
+            for aid, (_, due) in self._retries.items():
+                if due <= now and aid not in self._queued:
+                    self._queue.append(aid)
+                    self._queued.add(aid)
+            metrics.set('serve_queue_length', len(self._queue))
+
+    def _pop(self) -> Optional[str]:
+        with self._lock:
+            if not self._queue:
+                return None
+            aid = self._queue.popleft()
+            self._queued.discard(aid)
+            self.current = aid
+            metrics.set('serve_queue_length', len(self._queue))
+            return aid
+
+    def _download(self, aid: str):
+        try:
+            ok = self.downloader.download_album(aid)
+        except Exception as e:
+            console.log(f'[red]下载本子 {aid} 失败: {e}[/red]')
+            ok = False
+        finally:
+            self.current = None
+        if ok:
+            self.completed += 1
+            with self._lock:
+                if self._retries.pop(aid, None) is not None:
+                    metrics.set('serve_retry_pending', len(self._retries))
+        else:
+            self.failed += 1
+            self._schedule_retry(aid)
+        metrics.inc('serve_albums_total', result='completed' if ok else 'failed')
+
+    def _schedule_retry(self, aid: str):
+        if self.retry_delay <= 0:
+            return
+        with self._lock:
+            failures = self._retries.get(aid, (0, 0.0))[0] + 1
+            delay = min(self.retry_delay * 2 ** (failures - 1), RETRY_MAX_DELAY)
+            self._retries[aid] = (failures, time.time() + delay)
+            metrics.set('serve_retry_pending', len(self._retries))
+        console.log(f'[yellow]本子 {aid} 第 {failures} 次下载失败，{delay:g} 秒后重试[/yellow]')
@@ -1,23 +1,298 @@
+import atexit
 import json
+import logging
+import queue
 import sqlite3
+import threading
 import time
+import weakref
+from concurrent.futures import Future
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Dict, Optional, List, Set, Any
+from typing import Dict, Optional, List, Set, Any, Tuple
+
+from .metrics import metrics
+
+log = logging.getLogger('jm_downloader')
+
+
+_STOP = object()
+
+
+class _ReaderHolder:
+    """
+    放在线程局部变量中的只读连接；线程结束、局部变量被回收时关闭连接
+    """
+    __slots__ = ('conn', '__weakref__')
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+
+
+def _close_reader(conn: sqlite3.Connection, readers: Set[sqlite3.Connection], lock: threading.Lock):
+    with lock:
+        readers.discard(conn)
+    conn.close()
+
+# 任务状态
+TASK_PENDING = 'pending'
+TASK_RUNNING = 'running'
+TASK_DONE = 'done'
+TASK_FAILED = 'failed'
+
+
+class DBWriteError(sqlite3.Error):
+    """
+    写线程中有写操作或事务提交失败（由 JmDB.flush 抛出）
+    """
+
+
+class _Read:
+    """
+    需要读到本线程尚未提交的写入时，交给写线程在同一连接（同一事务）里执行的查询
+    """
+    __slots__ = ('sql', 'params', 'future')
+
+    def __init__(self, sql: str, params: tuple):
+        self.sql = sql
+        self.params = params
+        self.future: Future = Future()
+
+
+class _DBWriter(threading.Thread):
+    """
+    唯一的写线程：拥有独立连接，把排队的写操作合并进同一个事务，
+    积累到 batch_size 个或距首个写操作超过 flush_interval 秒时提交。
+    每个提交单元有递增的序号，committed_seq 之前的单元都已提交（或已失败）
+    """
+
+    def __init__(self, connect, batch_size: int, flush_interval: float):
+        super().__init__(name='jm-db-writer', daemon=True)
+        self._connect = connect
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.queue: queue.Queue = queue.Queue()
+        self._pending = 0
+        self._pending_lock = threading.Lock()
+        self._seq = 0
+        self.committed_seq = 0
+        self._failures: List[str] = []
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def submit(self, unit: List[tuple]) -> Tuple[int, Future]:
+        future: Future = Future()
+        # 序号与入队顺序必须一致
+        with self._pending_lock:
+            self._pending += 1
+            self._seq += 1
+            seq = self._seq
+            self.queue.put((seq, unit, future))
+        return seq, future
+
+    def read(self, sql: str, params: tuple) -> List[sqlite3.Row]:
+        item = _Read(sql, params)
+        self.queue.put(item)
+        return item.future.result()
+
+    def flush(self):
+        done = threading.Event()
+        self.queue.put(done)
+        done.wait()
+
+    def take_failures(self) -> List[str]:
+        with self._pending_lock:
+            failures, self._failures = self._failures, []
+        return failures
+
+    def _fail(self, future: Future, error: Exception):
+        with self._pending_lock:
+            self._failures.append(str(error))
+        if not future.done():
+            future.set_exception(error)
+
+    def run(self):
+        conn = self._connect()
+        conn.isolation_level = None
+        in_tx = False
+        futures: List[Future] = []
+        last_seq = 0
+        first_at = 0.0
+
+        def commit():
+            nonlocal in_tx
+            if in_tx:
+                started = time.perf_counter()
+                try:
+                    conn.execute("COMMIT")
+                    error = None
+                except sqlite3.Error as e:
+                    log.error(f"[db] 提交事务失败，{len(futures)} 个写操作丢失: {e}")
+                    conn.execute("ROLLBACK")
+                    error = e
+                metrics.observe('db_commit_seconds', time.perf_counter() - started)
+                metrics.inc('db_write_units_total', len(futures))
+                for future in futures:
+                    if error is not None:
+                        self._fail(future, DBWriteError(f'提交事务失败: {error}'))
+                    elif not future.done():
+                        future.set_result(None)
+            self.committed_seq = last_seq
+            with self._pending_lock:
+                self._pending -= len(futures)
+            in_tx = False
+            futures.clear()
+
+        while True:
+            timeout = max(0.0, first_at + self.flush_interval - time.monotonic()) if in_tx else None
+            try:
+                item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                commit()
+                continue
+            if item is _STOP:
+                commit()
+                conn.close()
+                return
+            if isinstance(item, threading.Event):
+                commit()
+                item.set()
+                continue
+            if isinstance(item, _Read):
+                try:
+                    item.future.set_result(conn.execute(item.sql, item.params).fetchall())
+                except Exception as e:
+                    item.future.set_exception(e)
+                continue
+            seq, unit, future = item
+            if not in_tx:
+                conn.execute("BEGIN")
+                in_tx = True
+                first_at = time.monotonic()
+            # 每个提交单元放在 savepoint 中，失败时只回滚该单元
+            conn.execute("SAVEPOINT unit")
+            try:
+                for sql, params in unit:
+                    conn.execute(sql, params)
+                conn.execute("RELEASE unit")
+            except sqlite3.Error as e:
+                log.error(f"[db] 写入失败，已回滚该操作: {e}")
+                conn.execute("ROLLBACK TO unit")
+                conn.execute("RELEASE unit")
+                self._fail(future, DBWriteError(f'写入失败: {e}'))
+            futures.append(future)
+            last_seq = seq
+            if len(futures) >= self.batch_size:
+                commit()
 
 
 class JmDB:
-    def __init__(self, path: Path):
+    def __init__(self, path: Path, batch_size: int = 200, flush_interval: float = 2.0):
         self.path = Path(path).with_suffix('.sqlite')
+        # 每个线程各自的只读连接
+        self._local = threading.local()
+        self._readers: Set[sqlite3.Connection] = set()
+        self._readers_lock = threading.Lock()
+        self._closed = False
+        # 多进程认领任务时需要立即生效的写操作，不经过写线程
+        self._sync_conn: Optional[sqlite3.Connection] = None
+        self._sync_lock = threading.Lock()
         self._init_db()
+        self._writer = _DBWriter(self._connect, batch_size, flush_interval)
+        self._writer.start()
+        # 进程退出时把尚未提交的写操作落盘
+        atexit.register(self.close)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _reader(self) -> sqlite3.Connection:
+        holder = getattr(self._local, 'reader', None)
+        if holder is None:
+            conn = self._connect()
+            holder = self._local.reader = _ReaderHolder(conn)
+            with self._readers_lock:
+                self._readers.add(conn)
+            # 流水线阶段线程每个本子都会新建，线程结束时就关闭它的连接，避免文件句柄越积越多
+            weakref.finalize(holder, _close_reader, conn, self._readers, self._readers_lock)
+        return holder.conn
+
+    def _query(self, sql: str, params: tuple = ()) -> List[sqlite3.Row]:
+        # 本线程还有未提交的写操作时，交给写线程排在这些写操作之后执行，能读到它们又不必提前提交；
+        # 其他线程未提交的写入不保证可见，需要时先调用 flush()
+        if getattr(self._local, 'last_seq', 0) > self._writer.committed_seq:
+            return self._writer.read(sql, params)
+        return self._reader().execute(sql, params).fetchall()
+
+    def _submit(self, unit: List[tuple]) -> Future:
+        seq, future = self._writer.submit(unit)
+        self._local.last_seq = seq
+        return future
+
+    def _execute(self, sql: str, params: tuple = ()) -> Optional[Future]:
+        """
+        排队写入，返回在提交后完成（失败时带异常）的 Future；事务块内返回 None
+        """
+        tx = getattr(self._local, 'tx', None)
+        if tx is not None:
+            tx.append((sql, params))
+            return None
+        return self._submit([(sql, params)])
+
+    @contextmanager
+    def transaction(self):
+        """
+        在 with 块内的写操作作为一个整体提交；块内抛出异常则全部丢弃。
+        注意块内的读操作看不到块内尚未提交的写入
+        """
+        if getattr(self._local, 'tx', None) is not None:
+            yield self
+            return
+        self._local.tx = []
+        try:
+            yield self
+            unit = self._local.tx
+        finally:
+            self._local.tx = None
+        if unit:
+            self._submit(unit)
+
+    def flush(self):
+        """
+        提交排队中的写操作；自上次 flush 以来有写入或提交失败时抛出 DBWriteError
+        """
+        self._writer.flush()
+        failures = self._writer.take_failures()
+        if failures:
+            raise DBWriteError(f'{len(failures)} 个数据库写操作失败: {failures[0]}')
+
+    def _write_now(self, sql: str, params: tuple = ()) -> List[sqlite3.Row]:
+        """
+        立即执行并提交一条写语句（先提交本进程排队中的写操作），用于进程间需要原子性的操作
+        """
+        if self._writer.pending:
+            self._writer.flush()
+        with self._sync_lock:
+            if self._sync_conn is None:
+                self._sync_conn = self._connect()
+                self._sync_conn.isolation_level = None
+            return self._sync_conn.execute(sql, params).fetchall()
 
     def _init_db(self):
+        conn = None
         try:
-            self.conn = sqlite3.connect(self.path, check_same_thread=False)
-            self.conn.row_factory = sqlite3.Row
-            self.cursor = self.conn.cursor()
+            conn = self._connect()
+            cursor = conn.cursor()
+            # WAL 模式下读写互不阻塞，synchronous=NORMAL 时只在 checkpoint 时 fsync
+            cursor.execute("PRAGMA journal_mode=WAL")
 
             # KV
-            self.cursor.execute('''
+            cursor.execute('''
                                 CREATE TABLE IF NOT EXISTS kv_store
                                 (
                                     key
@@ -30,7 +305,7 @@ class JmDB:
                                 ''')
 
             # 本子缓存
-            self.cursor.execute('''
+            cursor.execute('''
                                 CREATE TABLE IF NOT EXISTS books
                                 (
                                     id
@@ -55,12 +330,12 @@ class JmDB:
                                 ''')
 
             try:
-                self.cursor.execute("SELECT download_status FROM books LIMIT 1")
+                cursor.execute("SELECT download_status FROM books LIMIT 1")
             except sqlite3.OperationalError:
-                self.cursor.execute("ALTER TABLE books ADD COLUMN download_status INTEGER DEFAULT 0")
+                cursor.execute("ALTER TABLE books ADD COLUMN download_status INTEGER DEFAULT 0")
 
             # cbz状态存储
-            self.cursor.execute('''
+            cursor.execute('''
                                 CREATE TABLE IF NOT EXISTS packed
                                 (
                                     album_id
@@ -77,10 +352,120 @@ class JmDB:
                                 )
                                     )
                                 ''')
-            self.conn.commit()
+
+            # 作者更新检查水位线：已见过的最大本子 id 与上次检查时间
+            cursor.execute('''
+                           CREATE TABLE IF NOT EXISTS author_watermarks
+                           (
+                               author TEXT PRIMARY KEY,
+                               max_album_id INTEGER,
+                               checked_at REAL
+                           )
+                           ''')
+
+            # 内容寻址图片库：(本子, 章节, 页码) -> 图片内容哈希
+            cursor.execute('''
+                           CREATE TABLE IF NOT EXISTS page_hashes
+                           (
+                               album_id TEXT NOT NULL,
+                               photo_id TEXT NOT NULL,
+                               page INTEGER NOT NULL,
+                               hash TEXT NOT NULL,
+                               PRIMARY KEY (album_id, photo_id, page)
+                           )
+                           ''')
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_page_hashes_hash ON page_hashes (hash)")
+
+            # 作者/标签索引表，由 save_book 维护
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'book_authors'")
+            need_index_migration = cursor.fetchone() is None
+            for kind in ('author', 'tag'):
+                cursor.execute(f'''
+                               CREATE TABLE IF NOT EXISTS {kind}s
+                               (
+                                   id INTEGER PRIMARY KEY AUTOINCREMENT,
+                                   name TEXT NOT NULL UNIQUE
+                               )
+                               ''')
+                cursor.execute(f'''
+                               CREATE TABLE IF NOT EXISTS book_{kind}s
+                               (
+                                   book_id TEXT NOT NULL,
+                                   {kind}_id INTEGER NOT NULL,
+                                   PRIMARY KEY (book_id, {kind}_id)
+                               )
+                               ''')
+                cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_book_{kind}s_{kind} ON book_{kind}s ({kind}_id)")
+            if need_index_migration:
+                cursor.execute("SELECT id, author, tags FROM books")
+                for row in cursor.fetchall():
+                    for sql, params in JmDB._index_statements(row['id'], row['author'], row['tags']):
+                        cursor.execute(sql, params)
+
+            # 下载任务：本子 (photo_id='', page=0) -> 章节 (page=0) -> 页面 (page>=1)
+            cursor.execute('''
+                           CREATE TABLE IF NOT EXISTS tasks
+                           (
+                               album_id TEXT NOT NULL,
+                               photo_id TEXT NOT NULL DEFAULT '',
+                               page INTEGER NOT NULL DEFAULT 0,
+                               kind TEXT NOT NULL,
+                               state TEXT NOT NULL DEFAULT 'pending',
+                               attempts INTEGER NOT NULL DEFAULT 0,
+                               last_error TEXT,
+                               info TEXT,
+                               updated_at REAL,
+                               PRIMARY KEY (album_id, photo_id, page)
+                           )
+                           ''')
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_tasks_kind_state ON tasks (kind, state)")
+            # worker 认领任务的租约：持有者与到期时间，到期未续约的任务可被其他进程重新认领
+            try:
+                cursor.execute("SELECT lease_owner FROM tasks LIMIT 1")
+            except sqlite3.OperationalError:
+                cursor.execute("ALTER TABLE tasks ADD COLUMN lease_owner TEXT")
+                cursor.execute("ALTER TABLE tasks ADD COLUMN lease_expires REAL")
+
+            # 收藏夹：position 0 为最新收藏，removed_at 非空表示已取消收藏
+            cursor.execute('''
+                           CREATE TABLE IF NOT EXISTS favorites
+                           (
+                               folder_id TEXT NOT NULL DEFAULT '0',
+                               album_id TEXT NOT NULL,
+                               position INTEGER NOT NULL,
+                               first_seen REAL,
+                               last_seen REAL,
+                               removed_at REAL,
+                               PRIMARY KEY (folder_id, album_id)
+                           )
+                           ''')
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_favorites_position ON favorites (folder_id, position)")
+            # 旧版本把整个收藏列表以 JSON 存在 kv_store 中，迁移到 favorites 表
+            cursor.execute("SELECT value FROM kv_store WHERE key = 'fav_list'")
+            row = cursor.fetchone()
+            if row is not None:
+                try:
+                    old_list = json.loads(row['value']) or []
+                except ValueError:
+                    old_list = []
+                now = time.time()
+                cursor.executemany('''
+                    INSERT OR IGNORE INTO favorites (folder_id, album_id, position, first_seen, last_seen)
+                    VALUES ('0', ?, ?, ?, ?)
+                ''', [(str(aid), pos, now, now) for pos, aid in enumerate(dict.fromkeys(old_list))])
+                cursor.execute("DELETE FROM kv_store WHERE key IN ('fav_list', 'fav_latest_id')")
+
+            # 章节打包清单（文件数/大小/mtime/元数据哈希），用于增量重打包
+            try:
+                cursor.execute("SELECT manifest FROM packed LIMIT 1")
+            except sqlite3.OperationalError:
+                cursor.execute("ALTER TABLE packed ADD COLUMN manifest TEXT")
+            conn.commit()
+            conn.close()
 
         except sqlite3.DatabaseError:
-            self.conn.close()
+            if conn is not None:
+                conn.close()
             new_name = self.path.with_suffix('.sqlite.bak')
             print(
                 f"[ERROR] Database file {self.path} is invalid or corrupt. Renaming to {new_name} and creating a fresh DB.")
@@ -91,45 +476,117 @@ class JmDB:
             self._init_db()
 
     def close(self):
-        self.conn.close()
+        if self._closed:
+            return
+        self._closed = True
+        self._writer.queue.put(_STOP)
+        self._writer.join()
+        failures = self._writer.take_failures()
+        if failures:
+            log.error(f"[db] 关闭前有 {len(failures)} 个写操作失败: {failures[0]}")
+        with self._readers_lock:
+            readers = list(self._readers)
+            self._readers.clear()
+        for conn in readers:
+            conn.close()
+        with self._sync_lock:
+            if self._sync_conn is not None:
+                self._sync_conn.close()
+                self._sync_conn = None
+        atexit.unregister(self.close)
 
     # KV
     def get_kv(self, key: str, default=None):
-        self.cursor.execute("SELECT value FROM kv_store WHERE key = ?", (key,))
-        row = self.cursor.fetchone()
-        return row['value'] if row else default
+        rows = self._query("SELECT value FROM kv_store WHERE key = ?", (key,))
+        return rows[0]['value'] if rows else default
 
     def set_kv(self, key: str, value: str):
-        self.cursor.execute("INSERT OR REPLACE INTO kv_store (key, value) VALUES (?, ?)", (key, value))
-        self.conn.commit()
+        self._execute("INSERT OR REPLACE INTO kv_store (key, value) VALUES (?, ?)", (key, value))
 
     # 收藏
-    def get_fav_latest_id(self) -> Optional[str]:
-        return self.get_kv("fav_latest_id")
+    def get_favorites(self, folder_id: str = '0') -> List[str]:
+        """
+        当前仍在收藏夹中的本子，按收藏时间从新到旧
+        """
+        rows = self._query('''
+            SELECT album_id FROM favorites WHERE folder_id = ? AND removed_at IS NULL ORDER BY position
+        ''', (str(folder_id),))
+        return [row['album_id'] for row in rows]
 
-    def set_fav_latest_id(self, aid: str):
-        self.set_kv("fav_latest_id", str(aid))
+    def add_favorites(self, folder_id: str, album_ids: List[str]):
+        """
+        新收藏的本子插到最前面（album_ids 从新到旧），其余本子的位置整体后移
+        """
+        if not album_ids:
+            return
+        now = time.time()
+        folder_id = str(folder_id)
+        with self.transaction():
+            self._execute('''
+                UPDATE favorites SET position = position + ? WHERE folder_id = ? AND removed_at IS NULL
+            ''', (len(album_ids), folder_id))
+            for pos, aid in enumerate(album_ids):
+                self._upsert_favorite(folder_id, str(aid), pos, now)
 
-    def get_fav_list(self) -> List[str]:
-        val = self.get_kv("fav_list")
-        if val:
-            try:
-                return json.loads(val)
-            except:
-                pass
-        return []
+    def replace_favorites(self, folder_id: str, album_ids: List[str]) -> tuple:
+        """
+        用完整的在线收藏列表（从新到旧）更新收藏表，只写入新增、位置变化和被移除的本子。
+        返回 (新增列表, 移除列表)
+        """
+        now = time.time()
+        folder_id = str(folder_id)
+        current = {aid: pos for pos, aid in enumerate(self.get_favorites(folder_id))}
+        online = set(album_ids)
+        added = [aid for aid in album_ids if aid not in current]
+        removed = [aid for aid in current if aid not in online]
+        with self.transaction():
+            for aid in removed:
+                self._execute('''
+                    UPDATE favorites SET removed_at = ? WHERE folder_id = ? AND album_id = ?
+                ''', (now, folder_id, aid))
+            for pos, aid in enumerate(album_ids):
+                if current.get(aid) != pos:
+                    self._upsert_favorite(folder_id, aid, pos, now)
+            self._touch_favorites(folder_id, now)
+        return added, removed
+
+    def touch_favorites(self, folder_id: str = '0'):
+        self._touch_favorites(str(folder_id), time.time())
 
-    def set_fav_list(self, aids: List[str]):
-        self.set_kv("fav_list", json.dumps(aids))
+    def _touch_favorites(self, folder_id: str, now: float):
+        self._execute('''
+            UPDATE favorites SET last_seen = ? WHERE folder_id = ? AND removed_at IS NULL
+        ''', (now, folder_id))
+
+    def _upsert_favorite(self, folder_id: str, album_id: str, position: int, now: float):
+        self._execute('''
+            INSERT INTO favorites (folder_id, album_id, position, first_seen, last_seen)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (folder_id, album_id) DO UPDATE SET
+                position = excluded.position, last_seen = excluded.last_seen, removed_at = NULL
+        ''', (folder_id, album_id, position, now, now))
 
     # 本子
     def get_book(self, aid: str) -> Optional[Dict[str, Any]]:
-        self.cursor.execute("SELECT * FROM books WHERE id = ?", (str(aid),))
-        row = self.cursor.fetchone()
-        if row:
-            return dict(row)
+        rows = self._query("SELECT * FROM books WHERE id = ?", (str(aid),))
+        if rows:
+            return dict(rows[0])
         return None
 
+    def get_books(self, aids: List[str]) -> Dict[str, Dict[str, Any]]:
+        ids = list(dict.fromkeys(str(a) for a in aids))
+        books = {}
+        # SQLite 单条语句的参数个数有限制，分批查询
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            placeholders = ','.join('?' * len(chunk))
+            for row in self._query(f"SELECT * FROM books WHERE id IN ({placeholders})", tuple(chunk)):
+                books[row['id']] = dict(row)
+        return books
+
+    def get_all_books(self) -> Dict[str, Dict[str, Any]]:
+        return {row['id']: dict(row) for row in self._query("SELECT * FROM books")}
+
     def is_album_completed(self, aid: str) -> bool:
         row = self.get_book(aid)
         if row and row.get('download_status') == 1:
@@ -137,8 +594,7 @@ class JmDB:
         return False
 
     def mark_album_completed(self, aid: str):
-        self.cursor.execute("UPDATE books SET download_status = 1 WHERE id = ?", (str(aid),))
-        self.conn.commit()
+        self._execute("UPDATE books SET download_status = 1 WHERE id = ?", (str(aid),))
 
     def save_book(self, album_resp):
         """
@@ -167,33 +623,295 @@ class JmDB:
 
         desc = getattr(album_resp, 'description', '') or getattr(album_resp, 'summary', '')
 
-        self.cursor.execute('''
-            INSERT OR REPLACE INTO books (id, title, author, tags, description, updated_at)
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', (aid, title, author_str, tags_str, str(desc), time.time()))
-        self.conn.commit()
+        with self.transaction():
+            self._execute('''
+                INSERT OR REPLACE INTO books (id, title, author, tags, description, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (aid, title, author_str, tags_str, str(desc), time.time()))
+            for sql, params in JmDB._index_statements(aid, author_str, tags_str):
+                self._execute(sql, params)
+
+    @staticmethod
+    def _split_names(value: Optional[str]) -> List[str]:
+        names = []
+        for p in (value or '').split(','):
+            p = p.strip()
+            if p and p.lower() not in ('unknown', 'none') and p not in names:
+                names.append(p)
+        return names
+
+    @staticmethod
+    def _index_statements(aid: str, author_str: Optional[str], tags_str: Optional[str]) -> List[tuple]:
+        """
+        重建某本子在 book_authors / book_tags 中的关联
+        """
+        statements = []
+        for kind, value in (('author', author_str), ('tag', tags_str)):
+            statements.append((f"DELETE FROM book_{kind}s WHERE book_id = ?", (aid,)))
+            for name in JmDB._split_names(value):
+                statements.append((f"INSERT OR IGNORE INTO {kind}s (name) VALUES (?)", (name,)))
+                statements.append((f'''
+                    INSERT OR IGNORE INTO book_{kind}s (book_id, {kind}_id)
+                    SELECT ?, id FROM {kind}s WHERE name = ?
+                ''', (aid, name)))
+        return statements
 
     def get_all_authors(self) -> Set[str]:
-        self.cursor.execute("SELECT author FROM books")
-        authors = set()
-        for row in self.cursor.fetchall():
-            a_str = row['author']
-            if a_str:
-                parts = a_str.split(',')
-                for p in parts:
-                    p = p.strip()
-                    if p and p.lower() != 'unknown' and p.lower() != 'none':
-                        authors.add(p)
-        return authors
+        rows = self._query('''
+            SELECT a.name FROM authors a
+            WHERE EXISTS (SELECT 1 FROM book_authors ba WHERE ba.author_id = a.id)
+        ''')
+        return {row['name'] for row in rows}
+
+    def get_books_by_author(self, author: str) -> List[Dict[str, Any]]:
+        rows = self._query('''
+            SELECT b.* FROM books b
+            JOIN book_authors ba ON ba.book_id = b.id
+            JOIN authors a ON a.id = ba.author_id
+            WHERE a.name = ?
+        ''', (author,))
+        return [dict(row) for row in rows]
+
+    def get_books_by_tag(self, tag: str) -> List[Dict[str, Any]]:
+        rows = self._query('''
+            SELECT b.* FROM books b
+            JOIN book_tags bt ON bt.book_id = b.id
+            JOIN tags t ON t.id = bt.tag_id
+            WHERE t.name = ?
+        ''', (tag,))
+        return [dict(row) for row in rows]
 
     # Packed Status
-    def mark_packed(self, album_id: str, photo_id: str):
-        self.cursor.execute('''
-            INSERT OR REPLACE INTO packed (album_id, photo_id, packed_at)
-            VALUES (?, ?, ?)
-        ''', (str(album_id), str(photo_id), time.time()))
-        self.conn.commit()
+    def mark_packed(self, album_id: str, photo_id: str, manifest: Optional[str] = None) -> Optional[Future]:
+        return self._execute('''
+            INSERT OR REPLACE INTO packed (album_id, photo_id, packed_at, manifest)
+            VALUES (?, ?, ?, ?)
+        ''', (str(album_id), str(photo_id), time.time(), manifest))
 
     def is_packed(self, album_id: str, photo_id: str) -> bool:
-        self.cursor.execute("SELECT 1 FROM packed WHERE album_id = ? AND photo_id = ?", (str(album_id), str(photo_id)))
-        return self.cursor.fetchone() is not None
+        rows = self._query("SELECT 1 FROM packed WHERE album_id = ? AND photo_id = ?",
+                           (str(album_id), str(photo_id)))
+        return bool(rows)
+
+    def get_pack_manifests(self) -> Dict[tuple, str]:
+        rows = self._query("SELECT album_id, photo_id, manifest FROM packed WHERE manifest IS NOT NULL")
+        return {(row['album_id'], row['photo_id']): row['manifest'] for row in rows}
+
+    # 图片库页面哈希
+    def get_page_hashes(self, album_id: str, photo_id: str) -> Dict[int, str]:
+        rows = self._query("SELECT page, hash FROM page_hashes WHERE album_id = ? AND photo_id = ?",
+                           (str(album_id), str(photo_id)))
+        return {row['page']: row['hash'] for row in rows}
+
+    def set_page_hash(self, album_id: str, photo_id: str, page: int, digest: str):
+        self._execute('''
+            INSERT OR REPLACE INTO page_hashes (album_id, photo_id, page, hash)
+            VALUES (?, ?, ?, ?)
+        ''', (str(album_id), str(photo_id), int(page), digest))
+
+    # 下载任务
+    def plan_album(self, album_id: str, chapters: List[tuple]):
+        """
+        登记本子及其章节 [(photo_id, 序号)]，已有的任务保持原状态；本子任务置为进行中
+        """
+        now = time.time()
+        aid = str(album_id)
+        with self.transaction():
+            self._execute(f'''
+                INSERT INTO tasks (album_id, photo_id, page, kind, state, updated_at)
+                VALUES (?, '', 0, 'album', '{TASK_RUNNING}', ?)
+                ON CONFLICT (album_id, photo_id, page) DO UPDATE SET state = '{TASK_RUNNING}', updated_at = excluded.updated_at
+                WHERE state != '{TASK_DONE}'
+            ''', (aid, now))
+            for photo_id, index in chapters:
+                self._execute('''
+                    INSERT OR IGNORE INTO tasks (album_id, photo_id, page, kind, info, updated_at)
+                    VALUES (?, ?, 0, 'chapter', ?, ?)
+                ''', (aid, str(photo_id), json.dumps({'index': index}), now))
+
+    def plan_pages(self, album_id: str, photo_id: str, pages: int):
+        now = time.time()
+        with self.transaction():
+            for page in range(1, pages + 1):
+                self._execute('''
+                    INSERT OR IGNORE INTO tasks (album_id, photo_id, page, kind, updated_at)
+                    VALUES (?, ?, ?, 'page', ?)
+                ''', (str(album_id), str(photo_id), page, now))
+
+    def finish_task(self, album_id: str, photo_id: str = '', page: int = 0, state: str = TASK_DONE,
+                    attempts: int = 1, error: Optional[str] = None):
+        # 写入结果即不再持有租约
+        self._execute('''
+            UPDATE tasks SET state = ?, attempts = attempts + ?, last_error = ?, updated_at = ?,
+                lease_owner = NULL, lease_expires = NULL
+            WHERE album_id = ? AND photo_id = ? AND page = ?
+        ''', (state, attempts, error, time.time(), str(album_id), str(photo_id), int(page)))
+
+    def get_chapter_states(self, album_id: str) -> Dict[str, str]:
+        rows = self._query("SELECT photo_id, state FROM tasks WHERE album_id = ? AND kind = 'chapter'",
+                           (str(album_id),))
+        return {row['photo_id']: row['state'] for row in rows}
+
+    def get_page_states(self, album_id: str, photo_id: str) -> Dict[int, str]:
+        rows = self._query("SELECT page, state FROM tasks WHERE album_id = ? AND photo_id = ? AND kind = 'page'",
+                           (str(album_id), str(photo_id)))
+        return {row['page']: row['state'] for row in rows}
+
+    def enqueue_albums(self, album_ids: List[str]) -> int:
+        """
+        把本子加入任务队列，返回实际加入的数量。已存在的任务不受影响，
+        但没有租约的进行中任务（download 中断后留下的）会重新置为待处理
+        """
+        now = time.time()
+        added = 0
+        ids = [str(a) for a in album_ids]
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            rows = self._write_now(f'''
+                INSERT INTO tasks (album_id, photo_id, page, kind, state, updated_at)
+                VALUES {','.join(f"(?, '', 0, 'album', '{TASK_PENDING}', ?)" for _ in chunk)}
+                ON CONFLICT (album_id, photo_id, page) DO UPDATE SET state = '{TASK_PENDING}', updated_at = excluded.updated_at
+                WHERE state = '{TASK_RUNNING}' AND lease_owner IS NULL
+                RETURNING 1
+            ''', tuple(v for aid in chunk for v in (aid, now)))
+            added += len(rows)
+        return added
+
+    def claim_task(self, kind: str, owner: str, lease_seconds: float) -> Optional[Dict[str, Any]]:
+        """
+        原子地认领一个待处理或租约已过期的任务，返回任务行；没有可认领的任务时返回 None。
+        没有租约的进行中任务只有在本子已没有待处理/进行中的章节时才可认领：
+        worker 登记完章节的本子就处于这种状态等待章节完成，而章节都已结束还没收尾的是中断留下的
+        """
+        now = time.time()
+        rows = self._write_now(f'''
+            UPDATE tasks SET state = '{TASK_RUNNING}', lease_owner = ?, lease_expires = ?, updated_at = ?
+            WHERE rowid = (
+                SELECT rowid FROM tasks t
+                WHERE kind = ? AND (
+                    state = '{TASK_PENDING}'
+                    OR (state = '{TASK_RUNNING}' AND lease_expires < ?)
+                    OR (state = '{TASK_RUNNING}' AND lease_expires IS NULL AND NOT EXISTS (
+                        SELECT 1 FROM tasks c WHERE c.album_id = t.album_id AND c.kind = 'chapter'
+                            AND c.state IN ('{TASK_PENDING}', '{TASK_RUNNING}')))
+                )
+                ORDER BY updated_at, album_id, photo_id LIMIT 1
+            )
+            RETURNING *
+        ''', (owner, now + lease_seconds, now, kind, now))
+        return dict(rows[0]) if rows else None
+
+    def claim_chapters(self, album_id: str, owner: str, lease_seconds: float) -> Set[str]:
+        """
+        原子地认领本子中未完成、也没有被其他进程持有（租约未过期）的章节，返回认领到的 photo_id
+        """
+        now = time.time()
+        rows = self._write_now(f'''
+            UPDATE tasks SET state = '{TASK_RUNNING}', lease_owner = ?, lease_expires = ?, updated_at = ?
+            WHERE album_id = ? AND kind = 'chapter' AND state != '{TASK_DONE}'
+              AND NOT (state = '{TASK_RUNNING}' AND lease_owner IS NOT NULL AND lease_owner != ? AND lease_expires >= ?)
+            RETURNING photo_id
+        ''', (owner, now + lease_seconds, now, str(album_id), owner, now))
+        return {row['photo_id'] for row in rows}
+
+    @contextmanager
+    def hold_leases(self, owner: str, lease_seconds: float):
+        """
+        with 块内每 lease_seconds/3 秒为 owner 持有的任务续约
+        """
+        stop = threading.Event()
+
+        def heartbeat():
+            while not stop.wait(lease_seconds / 3):
+                try:
+                    self.renew_leases(owner, lease_seconds)
+                except Exception as e:
+                    log.error(f"[db] 续约失败: {e}")
+
+        thread = threading.Thread(target=heartbeat, name='jm-lease', daemon=True)
+        thread.start()
+        try:
+            yield self
+        finally:
+            stop.set()
+            thread.join()
+
+    def renew_leases(self, owner: str, lease_seconds: float) -> int:
+        rows = self._write_now(f'''
+            UPDATE tasks SET lease_expires = ? WHERE lease_owner = ? AND state = '{TASK_RUNNING}' RETURNING 1
+        ''', (time.time() + lease_seconds, owner))
+        return len(rows)
+
+    def release_task(self, album_id: str, photo_id: str, page: int, owner: str,
+                     fallback_state: str = TASK_FAILED, error: Optional[str] = None):
+        """
+        释放租约；处理过程中没有写入结果（仍为 running）的任务改为 fallback_state
+        """
+        self._write_now(f'''
+            UPDATE tasks SET lease_owner = NULL, lease_expires = NULL, updated_at = ?,
+                state = CASE WHEN state = '{TASK_RUNNING}' THEN ? ELSE state END,
+                last_error = CASE WHEN state = '{TASK_RUNNING}' AND ? IS NOT NULL THEN ? ELSE last_error END
+            WHERE album_id = ? AND photo_id = ? AND page = ? AND lease_owner = ?
+        ''', (time.time(), fallback_state, error, error, str(album_id), str(photo_id), int(page), owner))
+
+    def release_owner(self, owner: str) -> int:
+        """
+        进程退出时把仍持有的任务放回队列
+        """
+        rows = self._write_now(f'''
+            UPDATE tasks SET state = '{TASK_PENDING}', lease_owner = NULL, lease_expires = NULL
+            WHERE lease_owner = ? AND state = '{TASK_RUNNING}' RETURNING 1
+        ''', (owner,))
+        return len(rows)
+
+    def count_open_tasks(self) -> int:
+        """
+        待处理或正被某个进程持有的本子/章节任务数，为 0 表示队列已处理完
+        """
+        rows = self._query(f'''
+            SELECT COUNT(*) AS n FROM tasks
+            WHERE kind IN ('album', 'chapter')
+              AND (state = '{TASK_PENDING}' OR (state = '{TASK_RUNNING}' AND lease_expires IS NOT NULL))
+        ''')
+        return rows[0]['n']
+
+    def get_unfinished_albums(self) -> List[str]:
+        """
+        已登记但未完成（进行中、失败或中断）的本子，按最近更新时间排序
+        """
+        rows = self._query(f'''
+            SELECT album_id FROM tasks WHERE kind = 'album' AND state != '{TASK_DONE}' ORDER BY updated_at DESC
+        ''')
+        return [row['album_id'] for row in rows]
+
+    def get_failed_tasks(self, album_ids: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        sql = f"SELECT * FROM tasks WHERE state = '{TASK_FAILED}'"
+        params: tuple = ()
+        if album_ids:
+            sql += f" AND album_id IN ({','.join('?' * len(album_ids))})"
+            params = tuple(str(a) for a in album_ids)
+        return [dict(row) for row in self._query(sql + " ORDER BY album_id, photo_id, page", params)]
+
+    def reset_failed_tasks(self, album_ids: Optional[List[str]] = None) -> List[str]:
+        """
+        把失败的任务重新置为待处理（保留尝试次数和最后的错误），返回涉及的本子
+        """
+        failed = self.get_failed_tasks(album_ids)
+        with self.transaction():
+            for row in failed:
+                self._execute(f'''
+                    UPDATE tasks SET state = '{TASK_PENDING}', updated_at = ?
+                    WHERE album_id = ? AND photo_id = ? AND page = ?
+                ''', (time.time(), row['album_id'], row['photo_id'], row['page']))
+        return list(dict.fromkeys(row['album_id'] for row in failed))
+
+    # 作者更新水位线
+    def get_author_watermarks(self) -> Dict[str, Dict[str, Any]]:
+        rows = self._query("SELECT * FROM author_watermarks")
+        return {row['author']: dict(row) for row in rows}
+
+    def set_author_watermark(self, author: str, max_album_id: Optional[int], checked_at: Optional[float] = None):
+        self._execute('''
+            INSERT OR REPLACE INTO author_watermarks (author, max_album_id, checked_at)
+            VALUES (?, ?, ?)
+        ''', (author, max_album_id, checked_at if checked_at is not None else time.time()))
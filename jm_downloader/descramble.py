@@ -0,0 +1,50 @@
+import math
+from io import BytesIO
+
+from jmcomic import JmImageTool
+from PIL import Image
+
+
+def scramble_num(img) -> int:
+    """
+    图片被切分打乱的段数，0 表示无需解密
+    """
+    scramble_id = getattr(img, 'scramble_id', None)
+    if scramble_id is None or getattr(img, 'img_file_suffix', '').lower() == '.gif':
+        return 0
+    return JmImageTool.get_num_by_detail(img)
+
+
+def row_blocks(h: int, num: int):
+    """
+    与 JmImageTool.decode_and_save 相同的分段规则，依次给出 (源起始行, 目标起始行, 行数)
+    """
+    over = h % num
+    for i in range(num):
+        move = math.floor(h / num)
+        y_src = h - (move * (i + 1)) - over
+        y_dst = move * i
+        if i == 0:
+            move += over
+        else:
+            y_dst += over
+        yield y_src, y_dst, move
+
+
+def descramble_bytes(data: bytes, num: int, suffix: str) -> bytes:
+    """
+    在内存中还原被打乱的图片并返回编码后的数据，num 为 0 时原样返回（不解码）。
+    只在子进程中调用，避免解码/编码占用下载线程的 GIL
+    """
+    if num == 0:
+        return data
+    img_src = Image.open(BytesIO(data))
+    fmt = Image.registered_extensions().get(suffix.lower(), img_src.format or 'JPEG')
+    w, h = img_src.size
+    img_decode = Image.new("RGB", (w, h))
+    # 每一段都是连续的整行，crop/paste 在 C 层按块拷贝，比 tobytes 后按字节区间重排再 frombytes 少两次整图拷贝
+    for y_src, y_dst, move in row_blocks(h, num):
+        img_decode.paste(img_src.crop((0, y_src, w, y_src + move)), (0, y_dst))
+    buf = BytesIO()
+    img_decode.save(buf, format=fmt)
+    return buf.getvalue()
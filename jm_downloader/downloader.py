@@ -1,20 +1,33 @@
 import logging
-import random
+import multiprocessing
+import os
 import re
+import itertools
 import shutil
+import socket
+import threading
 import time
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor, FIRST_COMPLETED, as_completed, wait
+from dataclasses import dataclass, field
 from pathlib import Path
-from typing import List
+from typing import List, Optional, Dict, Any, Set
 
 import jmcomic
-import requests
-from jmcomic import JmOption, JmApiClient, ResponseUnexpectedException
+from jmcomic import JmOption, JmApiClient, JmModuleConfig, ResponseUnexpectedException
 from rich.console import Console
 from rich.progress import Progress, BarColumn, TextColumn, TimeElapsedColumn, TimeRemainingColumn, SpinnerColumn
 
-from .cbz_packer import CbzPacker
-from .db import JmDB
-from .utils import clean_title_for_filename
+from .cbz_packer import CbzPacker, CbzWriter
+from .db import JmDB, DBWriteError, TASK_DONE, TASK_FAILED, TASK_PENDING, TASK_RUNNING
+from .descramble import descramble_bytes, scramble_num
+from .governor import RequestGovernor, backoff_delay
+from .http_pool import HttpPool
+from .image_store import ImageStore
+from .metrics import metrics
+from .pipeline import Pipeline
+from .profiling import NullProfiler
+from .transcode import TranscodeSettings
+from .utils import clean_title_for_filename, is_image_bytes_complete, is_image_file_complete, PART_SUFFIX
 
 console = Console()
 log = logging.getLogger('jm_downloader')
@@ -22,30 +35,113 @@ log = logging.getLogger('jm_downloader')
 original_req_api = JmApiClient.req_api
 
 
+_relogin_lock = threading.Lock()
+# client.login 内部也走 req_api：登录过程中的请求再次触发登录时直接放弃，不在锁上等待自己
+_login_state = threading.local()
+
+
+def _login(client, username, password):
+    _login_state.active = True
+    try:
+        client.login(username, password)
+    finally:
+        _login_state.active = False
+
+# 需要登录态的接口，首次请求前才登录
+AUTH_ENDPOINTS = ('/favorite', '/daily', '/daily_chk')
+
+# 增量同步收藏夹时最多逐页往后找的页数，超过则并发全量同步
+FAV_INCREMENTAL_PAGES = 5
+
+
+def login_once(client) -> bool:
+    """
+    延迟登录：第一个需要登录态的请求触发登录，并发请求只登录一次，失败后不再自动尝试
+    """
+    if not getattr(client, '_login_pending', False) or getattr(_login_state, 'active', False):
+        return True
+    with _relogin_lock:
+        if not client._login_pending:
+            return True
+        client._login_pending = False
+        try:
+            with metrics.timer('login_seconds'):
+                _login(client, client._username, client._password_for_relogin)
+        except Exception as e:
+            console.log(f'[red]登录失败: {e}[/red]')
+            metrics.inc('login_total', result='failed')
+            return False
+        client._login_gen = getattr(client, '_login_gen', 0) + 1
+        console.log('[green]登录成功[/green]')
+        metrics.inc('login_total', result='ok')
+        return True
+
+
+def relogin_single_flight(client, seen_gen: int) -> bool:
+    """
+    并发请求同时遇到 401 时只由一个线程重新登录，其余线程等待它完成后直接重试
+    """
+    if getattr(_login_state, 'active', False):
+        return False
+    with _relogin_lock:
+        if getattr(client, '_login_gen', 0) != seen_gen:
+            return True
+
+        username = getattr(client, '_username', None)
+        password = getattr(client, '_password_for_relogin', None)
+        if not (username and password):
+            console.log(
+                f"[red][Auto-Relogin] 无法重试登录 (username:{username},password:{password})，请检查账号密码。[/red]")
+            metrics.inc('relogin_total', result='no_credentials')
+            return False
+        try:
+            with metrics.timer('relogin_seconds'):
+                _login(client, username, password)
+        except Exception as login_e:
+            console.log(f"[red][Auto-Relogin] 重新登录失败: {login_e}[/red]")
+            metrics.inc('relogin_total', result='failed')
+            return False
+        client._login_gen = seen_gen + 1
+        client._login_pending = False
+        metrics.inc('relogin_total', result='ok')
+        console.log(f"[green][Auto-Relogin] 重新登录成功，正在重新请求...[/green]")
+        return True
+
+
+def _timed_req_api(self, url, endpoint: str, *args, **kwargs):
+    started = time.perf_counter()
+    result = 'error'
+    try:
+        resp = original_req_api(self, url, *args, **kwargs)
+        result = 'ok'
+        return resp
+    finally:
+        metrics.observe('api_seconds', time.perf_counter() - started, endpoint=endpoint)
+        metrics.inc('api_requests_total', endpoint=endpoint, result=result)
+
+
 def req_api_with_auto_relogin(self, url, *args, **kwargs):
+    # 按接口路径统计，去掉查询参数避免标签数量失控
+    endpoint = str(url).split('?', 1)[0]
+    if endpoint in AUTH_ENDPOINTS:
+        login_once(self)
+    governor = getattr(self, '_governor', None)
+    if governor is not None:
+        governor.throttle_api()
+    seen_gen = getattr(self, '_login_gen', 0)
     try:
-        return original_req_api(self, url, *args, **kwargs)
+        return _timed_req_api(self, url, endpoint, *args, **kwargs)
     except ResponseUnexpectedException as e:
         error_msg = str(e)
-        if '401' in error_msg or '請先登入會員' in error_msg:
+        # 登录请求本身失败不触发重新登录
+        if endpoint != '/login' and ('401' in error_msg or '請先登入會員' in error_msg):
             console.log(f"[yellow][Auto-Relogin] 检测到登录失败 (401)，尝试重新登录...[/yellow]")
-
-            username = getattr(self, '_username', None)
-            password = getattr(self, '_password_for_relogin', None)
-            time.sleep(random.randint(1, 3))
-            if username and password:
-                try:
-                    self.login(username, password)
-                    console.log(f"[green][Auto-Relogin] 重新登录成功，正在重新请求...[/green]")
-                    time.sleep(random.randint(1, 3))
-                    return original_req_api(self, url, *args, **kwargs)
-                except Exception as login_e:
-                    console.log(f"[red][Auto-Relogin] 重新登录失败: {login_e}[/red]")
-                    raise e
-            else:
-                console.log(
-                    f"[red][Auto-Relogin] 无法重试登录 (username:{username},password:{password})，请检查账号密码。[/red]")
+            metrics.inc('api_unauthorized_total', endpoint=endpoint)
+            if not relogin_single_flight(self, seen_gen):
                 raise e
+            if governor is not None:
+                governor.throttle_api()
+            return _timed_req_api(self, url, endpoint, *args, **kwargs)
         else:
             raise e
 
@@ -61,91 +157,209 @@ jmcomic.JmModuleConfig.EXECUTOR_LOG = rich_logging_executor
 JmApiClient.req_api = req_api_with_auto_relogin
 
 
+@dataclass
+class AlbumContext:
+    album_id: str
+    cleaned_title: str
+    series: str
+    originals_base: Path
+    cbz_base: Path
+    authors: Optional[str] = None
+    tags: Optional[str] = None
+    summary: Optional[str] = None
+    failed: bool = False
+
+
+@dataclass
+class ChapterJob:
+    album: AlbumContext
+    photo_id: str
+    chap_num: int
+    file_chapter_name: str
+    display_title: str
+    photo_folder: Path
+    cbz_target: Path
+    image_list: list = field(default_factory=list)
+    # pack_mode=direct 或启用转码时图片直接写入的 CBZ，打包阶段只需收尾
+    writer: Optional[CbzWriter] = None
+    # 页序号 -> 进程池中的转码任务
+    transcoding: Dict[int, Future] = field(default_factory=dict)
+    # 实际重新编码的页数（转码后更大而保留原图的不算）
+    transcoded: int = 0
+    # 任务表中已完成的页码（从 1 开始）
+    done_pages: Set[int] = field(default_factory=set)
+
+    @property
+    def task(self) -> tuple:
+        return self.album.album_id, self.photo_id, 0
+
+    def page_task(self, page: int) -> tuple:
+        return self.album.album_id, self.photo_id, page
+
+
 class JmFavDownloader:
-    def __init__(self, cfg):
+    def __init__(self, cfg, profiler=None):
         self.cfg = cfg
+        self.profiler = profiler or NullProfiler()
         cfg.ensure_dirs()
         self.db = JmDB(cfg.save_db)
+        # API 令牌桶限速 + 全局 AIMD 并发控制，上限留出元数据/主线程的名额
+        self.governor = RequestGovernor(cfg.api_rate, max_concurrency=max(1, cfg.image_workers) + 2)
+        # 客户端与备用下载路径共用一个连接池，大小跟随下载并发数
+        self.http = HttpPool(max_per_host=cfg.http_max_per_host or cfg.image_workers,
+                             timeout=cfg.session_timeout, governor=self.governor)
+        # 创建客户端时 jmcomic 会请求域名列表和 cookies，推迟到第一次真正需要访问网络时
+        self._client = None
+        self._client_lock = threading.Lock()
+        # 图片线程常驻，线程内的 curl 句柄和 keep-alive 连接可以跨章节复用
+        self._image_pool = ThreadPoolExecutor(max_workers=max(1, cfg.image_workers),
+                                              thread_name_prefix='jm-image')
+        # 解密（解码/重排/编码）是 CPU 密集的，交给进程池；用 spawn 避免在多线程进程中 fork
+        self._descramble_pool = ProcessPoolExecutor(max_workers=cfg.descramble_workers or None,
+                                                    mp_context=multiprocessing.get_context('spawn'))
+        self.transcode = TranscodeSettings.from_config(cfg)
+        self._transcode_pool = ProcessPoolExecutor(max_workers=cfg.transcode_workers or None,
+                                                   mp_context=multiprocessing.get_context('spawn')) \
+            if self.transcode else None
+        self._album_cache: Dict[str, Any] = {}
+        # 在任务表中认领章节时使用的持有者标识，同时运行的 worker 不会处理本进程正在下载的章节
+        self.task_owner = f'{socket.gethostname()}:{os.getpid()}'
+        self.store = ImageStore(cfg.out_dir / 'store') if cfg.image_store else None
+
+    def close(self):
+        """
+        关闭线程池/进程池、连接池和数据库。在 multiprocessing 子进程中必须显式调用，
+        否则子进程退出时会一直等待尚未关闭的进程池
+        """
+        self._image_pool.shutdown(wait=True)
+        self._descramble_pool.shutdown(wait=True)
+        if self._transcode_pool is not None:
+            self._transcode_pool.shutdown(wait=True)
+        self.http.close()
+        self.db.close()
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    self._client = self._new_client()
+        return self._client
+
+    def _new_client(self):
+        cfg = self.cfg
         if cfg.jm_option_file:
             option = jmcomic.create_option_by_file(str(cfg.jm_option_file))
         else:
             option = JmOption.default()
-        self.client = option.new_jm_client()
+        client = option.new_jm_client()
+        client._governor = self.governor
         if cfg.username and cfg.password:
-            try:
-                self.client.login(cfg.username, cfg.password)
-                self.client._username = cfg.username
-                self.client._password_for_relogin = cfg.password
-                console.log('[green]登录成功[/green]')
-            except Exception as e:
-                console.log(f'[red]登录失败: {e}[/red]')
-        self.session = requests.Session()
-        self.session.headers.update({'User-Agent': 'jm_fav_downloader_modular/1.0'})
-        self.session_timeout = cfg.session_timeout
+            # 不在这里登录，由第一个需要登录态的请求触发（见 login_once），其余请求遇到 401 时也会自动登录
+            client._username = cfg.username
+            client._password_for_relogin = cfg.password
+            client._login_pending = True
+        self.http.install(client)
+        return client
 
     def get_favorites_album_ids(self) -> List[str]:
         if not self.cfg.download_favorites:
             return []
-
+        with self.profiler.stage('favorites'):
+            return self._sync_favorites()
+
+    def _favorite_page(self, page_no: int):
+        page = self.client.favorite_folder(page=page_no, folder_id=self.cfg.favorite_folder)
+        metrics.inc('favorite_pages_total')
+        return page
+
+    def _sync_favorites(self) -> List[str]:
+        """
+        先增量同步：从第一页往后取，遇到已知的收藏为止，在线总数与本地数量 + 新增数一致、
+        且已取到的页面顺序与本地记录一致时只插入新增部分；
+        首次同步、数量或顺序对不上（有取消收藏或重新收藏）时并发获取所有页做全量对比
+        """
         console.log('[blue]正在检查收藏夹更新...[/blue]')
-
-        cached_list = self.db.get_fav_list() or []
-        cached_latest_id = self.db.get_fav_latest_id()
-
-        stop_marker_ids = set(cached_list[:3])
-
-        new_album_ids = []
-        latest_online_id = None
-        reached_cache = False
+        folder = self.cfg.favorite_folder
+        cached_list = self.db.get_favorites(folder)
+        known = set(cached_list)
 
         with Progress(SpinnerColumn(), TextColumn('[progress.description]{task.description}'), console=console) as prog:
             task = prog.add_task('获取收藏中...', total=None)
             try:
-                for page in self.client.favorite_folder_gen():
-                    for aid, title in page.iter_id_title():
-                        aid_str = str(aid)
-
-                        if latest_online_id is None:
-                            latest_online_id = aid_str
-                            if latest_online_id == cached_latest_id:
-                                reached_cache = True
-                                break
-
-                        if aid_str in stop_marker_ids:
+                first = self._favorite_page(1)
+                total = int(first.total or 0)
+                new_album_ids = []
+                seen = set()
+                pages = {1: first}
+                page, page_no = first, 1
+                reached_cache = False
+                while known:
+                    for aid, _ in page.iter_id_title():
+                        aid = str(aid)
+                        if aid in known:
                             reached_cache = True
                             break
-
-                        if aid_str not in new_album_ids:
-                            new_album_ids.append(aid_str)
-
+                        if aid not in seen:
+                            seen.add(aid)
+                            new_album_ids.append(aid)
                     prog.update(task, description=f'已收集新收藏: {len(new_album_ids)} 本')
-
-                    if reached_cache:
+                    # 新增超过几页时不再逐页往后找，改为全量同步（已取到的页会复用）
+                    if reached_cache or page_no >= page.page_count or page_no >= FAV_INCREMENTAL_PAGES:
                         break
+                    page_no += 1
+                    page = pages[page_no] = self._favorite_page(page_no)
+
+                # 重新收藏已知的本子时数量不变但会移到最前面，用已取到的页面核对顺序
+                fetched = list(dict.fromkeys(str(aid) for n in sorted(pages) for aid, _ in pages[n].iter_id_title()))
+                expected = new_album_ids + cached_list
+                if reached_cache and len(known) + len(new_album_ids) == total \
+                        and fetched == expected[:len(fetched)]:
+                    if new_album_ids:
+                        console.log(f'[blue]发现新收藏，新增了 {len(new_album_ids)} 本[/blue]')
+                        self.db.add_favorites(folder, new_album_ids)
+                    else:
+                        console.log(f'[green]收藏夹无变化（共 {total} 本），使用缓存列表[/green]')
+                    self.db.touch_favorites(folder)
+                    return new_album_ids + cached_list
 
+                if known:
+                    console.log(f'[blue]收藏夹共 {total} 本，数量或顺序与本地记录对不上，全量同步 {first.page_count} 页...[/blue]')
+                else:
+                    console.log(f'[blue]首次同步收藏夹：共 {total} 本，{first.page_count} 页[/blue]')
+                online_ids = self._fetch_all_favorites(pages, prog, task)
             except Exception as e:
                 console.log(f'[red]获取收藏夹失败: {e}[/red]')
                 return cached_list
 
-        if not latest_online_id:
+        if not online_ids:
             console.log('[yellow]收藏夹为空 or 获取失败[/yellow]')
             return cached_list
 
-        if len(new_album_ids) == 0:
-            console.log(f'[green]收藏夹无变化 (最新ID: {latest_online_id})，使用缓存列表[/green]')
-            return cached_list
-
-        console.log(f'[blue]发现新收藏，新增了 {len(new_album_ids)} 本，正在与本地缓存合并...[/blue]')
-
-        final_album_ids = new_album_ids.copy()
-        for aid in cached_list:
-            if aid not in final_album_ids:
-                final_album_ids.append(aid)
-
-        self.db.set_fav_latest_id(latest_online_id)
-        self.db.set_fav_list(final_album_ids)
-
-        return final_album_ids
+        added, removed = self.db.replace_favorites(folder, online_ids)
+        console.log(f'[blue]收藏夹同步完成：共 {len(online_ids)} 本，新增 {len(added)} 本，移除 {len(removed)} 本[/blue]')
+        if removed:
+            shown = ', '.join(removed[:20]) + (' ...' if len(removed) > 20 else '')
+            console.log(f'[yellow]已取消收藏: {shown}[/yellow]')
+        return online_ids
+
+    def _fetch_all_favorites(self, pages: Dict[int, Any], prog: Progress, task) -> List[str]:
+        """
+        并发获取 pages 中还没有的页（受全局限速约束），任何一页失败都放弃本次全量同步，避免把没取到的收藏当成已移除
+        """
+        page_count = max(1, pages[1].page_count)
+        missing = [n for n in range(1, page_count + 1) if n not in pages]
+        prog.update(task, total=page_count, completed=len(pages),
+                    description=f'获取收藏夹 {len(pages)}/{page_count} 页')
+        if missing:
+            with ThreadPoolExecutor(max_workers=max(1, self.cfg.favorite_workers),
+                                    thread_name_prefix='jm-fav') as pool:
+                futures = {pool.submit(self._in_stage, 'favorites', self._favorite_page, n): n for n in missing}
+                for fut in as_completed(futures):
+                    pages[futures[fut]] = fut.result()
+                    prog.update(task, advance=1, description=f'获取收藏夹 {len(pages)}/{page_count} 页')
+        # 翻页期间收藏夹有变化时相邻页可能重复，按首次出现去重
+        return list(dict.fromkeys(str(aid) for n in sorted(pages) for aid, _ in pages[n].iter_id_title()))
 
     def download_album_list(self, album_ids: List[str]):
         if not album_ids:
@@ -154,183 +368,595 @@ class JmFavDownloader:
         from rich.table import Table
         table = Table('序号', 'album_id', 'title', '状态')
 
-        for i, aid in enumerate(album_ids, 1):
-            if self.db.is_album_completed(aid):
-                cached_book = self.db.get_book(aid)
-                title = cached_book['title'] if cached_book else str(aid)
+        # 一次查询取回所有本子的缓存与完成状态
+        books = self.db.get_books(album_ids)
 
-                table.add_row(str(i), str(aid), title, "[green]已完成 (跳过)[/green]")
+        for i, aid in enumerate(album_ids, 1):
+            cached_book = books.get(str(aid))
+            if cached_book and cached_book.get('download_status') == 1:
+                table.add_row(str(i), str(aid), cached_book['title'], "[green]已完成 (跳过)[/green]")
                 continue
 
-            cached_book = self.db.get_book(aid)
-            if cached_book:
+            if cached_book and self._is_book_fresh(cached_book):
                 raw = cached_book['title']
             else:
-                try:
-                    album = self.client.get_album_detail(aid)
-                    raw = getattr(album, 'title', str(aid))
-                    self.db.save_book(album)  # Save to cache
-                except Exception:
-                    raw = str(aid)
+                album = self._get_album_detail(aid)
+                raw = getattr(album, 'title', str(aid)) if album else str(aid)
 
             cleaned = clean_title_for_filename(raw, extract_brackets=self.cfg.extract_title)
             table.add_row(str(i), str(aid), cleaned)
         console.print(table)
         for aid in album_ids:
-            if self.db.is_album_completed(aid):
-                console.log(f"[green]本子 {aid} 已标记为完成，跳过下载[/green]")
-                continue
-
+            self.download_album(aid, books.get(str(aid)) or {})
+
+    def download_album(self, aid, cached_book: Optional[dict] = None) -> bool:
+        """
+        下载单个本子，已标记完成的跳过；返回本子是否已完成
+        """
+        if cached_book is None:
+            cached_book = self.db.get_book(str(aid)) or {}
+        if cached_book.get('download_status') == 1:
+            console.log(f"[green]本子 {aid} 已标记为完成，跳过下载[/green]")
+            return True
+
+        try:
+            album = self._get_album_detail(aid, raise_error=True)
+        except Exception as e:
+            console.log(f'[red]获取本子 {aid} 详情失败: {e}[/red]')
+            return False
+        try:
+            self._download_album(album)
+        finally:
+            # 常驻运行（serve）时详情缓存不能无限增长，下载完的本子不再需要
+            self._album_cache.pop(str(aid), None)
+        return self.db.is_album_completed(str(aid))
+
+    def _is_book_fresh(self, book) -> bool:
+        ttl = self.cfg.metadata_ttl
+        if ttl <= 0:
+            return True
+        return time.time() - (book.get('updated_at') or 0) < ttl
+
+    def _get_album_detail(self, aid, raise_error: bool = False):
+        """
+        同一次运行中每个本子最多请求一次详情，并写入数据库缓存
+        """
+        aid = str(aid)
+        album = self._album_cache.get(aid)
+        if album is not None:
+            return album
+        try:
+            with metrics.timer('album_detail_seconds'), self.profiler.stage('album_detail'):
+                album = self.client.get_album_detail(aid)
+        except Exception:
+            metrics.inc('album_detail_total', result='error')
+            if raise_error:
+                raise
+            return None
+        metrics.inc('album_detail_total', result='ok')
+        self.db.save_book(album)
+        self._album_cache[aid] = album
+        return album
+
+    def _with_retries(self, fetch, img_url, task: Optional[tuple] = None):
+        """
+        task 为 (album_id, photo_id, page) 时把结果、尝试次数和最后的错误记入任务表
+        """
+        error = None
+        for attempt in range(1, self.cfg.retries + 1):
             try:
-                cached_book = self.db.get_book(aid)
-                if cached_book:
-                    album = self.client.get_album_detail(aid)
-                    self.db.save_book(album)
-                else:
-                    album = self.client.get_album_detail(aid)
-                    self.db.save_book(album)
+                result = fetch()
             except Exception as e:
-                console.log(f'[red]获取本子 {aid} 详情失败: {e}[/red]')
+                error = e
+                console.log(f"[yellow]图片下载失败 ({attempt}/{self.cfg.retries}): {e}[/yellow]")
+                if attempt < self.cfg.retries:
+                    metrics.inc('image_retries_total')
+                    time.sleep(backoff_delay(attempt))
                 continue
-            self._download_album(album)
-
-    def _download_album(self, album):
+            if task is not None:
+                self.db.finish_task(*task, state=TASK_DONE, attempts=attempt)
+            return result
+        console.log(f"[red]图片多次失败，标记本章失败: {img_url}[/red]")
+        metrics.inc('image_failures_total')
+        if task is not None:
+            self.db.finish_task(*task, state=TASK_FAILED, attempts=self.cfg.retries, error=str(error))
+        return None
+
+    def _get_jm_image_bytes(self, img) -> bytes:
+        img_url = getattr(img, 'img_url', None)
+        with metrics.timer('image_fetch_seconds', path='client'):
+            resp = self.client.get_jm_image(img.download_url)
+            resp.require_success()
+        metrics.inc('image_bytes_total', len(resp.content), path='client')
+        num = scramble_num(img)
+        if num == 0:
+            return resp.content
+        suffix = Path(img_url).suffix if img_url else '.jpg'
+        with metrics.timer('descramble_seconds'):
+            return self._descramble_pool.submit(descramble_bytes, resp.content, num, suffix).result()
+
+    def _download_image(self, img, out_path: Path, task: Optional[tuple] = None) -> bool:
+        """
+        先写入 .part 文件，校验完整后再原子重命名为目标文件；
+        备用路径写入单独的 .raw.part（原始字节，与主路径解混淆后的数据不能拼接），中断后下次尝试时用 Range 续传
+        """
+        img_url = getattr(img, 'img_url', None)
+        part_path = out_path.with_name(out_path.name + PART_SUFFIX)
+        raw_part_path = out_path.with_name(out_path.name + '.raw' + PART_SUFFIX)
+
+        def fetch():
+            try:
+                part_path.write_bytes(self._get_jm_image_bytes(img))
+                path = part_path
+            except Exception:
+                part_path.unlink(missing_ok=True)
+                with metrics.timer('image_fetch_seconds', path='fallback'):
+                    size = self.http.download_to(img_url, raw_part_path, resume=True,
+                                                 headers=JmModuleConfig.new_html_headers())
+                metrics.inc('image_bytes_total', size, path='fallback')
+                path = raw_part_path
+            if not is_image_file_complete(path):
+                path.unlink(missing_ok=True)
+                raise IOError(f'图片不完整: {img_url}')
+            os.replace(path, out_path)
+            # 主路径成功时，之前备用路径留下的部分文件已经没用了
+            raw_part_path.unlink(missing_ok=True)
+            return True
+
+        return bool(self._with_retries(fetch, img_url, task))
+
+    def _fetch_image_bytes(self, img) -> Optional[bytes]:
+        """
+        direct 模式用：页面只存在于未完成的 CBZ 中，中断后整章重新获取，所以不登记页面任务
+        """
+        img_url = getattr(img, 'img_url', None)
+
+        def fetch():
+            try:
+                data = self._get_jm_image_bytes(img)
+            except Exception:
+                with metrics.timer('image_fetch_seconds', path='fallback'):
+                    data = self.http.fetch_bytes(img_url, headers=JmModuleConfig.new_html_headers())
+                metrics.inc('image_bytes_total', len(data), path='fallback')
+            if not is_image_bytes_complete(data):
+                raise IOError(f'图片不完整: {img_url}')
+            return data
+
+        return self._with_retries(fetch, img_url)
+
+    def _download_page(self, job: 'ChapterJob', page: int, img, out_path: Path, digest: Optional[str]) -> bool:
+        """
+        启用图片库时，已知哈希的页面直接从库中链接过来，新下载的页面收入库中并记录哈希
+        """
+        task = job.page_task(page)
+        if self.store is None:
+            return self._download_image(img, out_path, task)
+        if self.store.has(digest):
+            self.store.link_to(digest, out_path)
+            metrics.inc('store_hits_total')
+            self.db.finish_task(*task, state=TASK_DONE, attempts=0)
+            return True
+        if not self._download_image(img, out_path, task):
+            return False
+        self.db.set_page_hash(job.album.album_id, job.photo_id, page, self.store.put_file(out_path))
+        return True
+
+    def _fetch_page_bytes(self, job: 'ChapterJob', page: int, img, digest: Optional[str]) -> Optional[bytes]:
+        if self.store is None:
+            return self._fetch_image_bytes(img)
+        if self.store.has(digest):
+            metrics.inc('store_hits_total')
+            return self.store.read(digest)
+        data = self._fetch_image_bytes(img)
+        if data is not None:
+            self.db.set_page_hash(job.album.album_id, job.photo_id, page, self.store.put_bytes(data))
+        return data
+
+    def _in_stage(self, stage: str, fn, *args):
+        # 图片、收藏夹分页等任务在线程池中执行，性能分析要在干活的线程里开启
+        with self.profiler.stage(stage):
+            return fn(*args)
+
+    def _page_hashes(self, job: 'ChapterJob') -> Dict[int, str]:
+        if self.store is None:
+            return {}
+        return self.db.get_page_hashes(job.album.album_id, job.photo_id)
+
+    def _album_context(self, album) -> AlbumContext:
         album_id = str(getattr(album, 'album_id', getattr(album, 'id', None) or 'unknown'))
         raw_album_title = getattr(album, 'title', f'album_{album_id}')
         cleaned_album_title = clean_title_for_filename(raw_album_title, extract_brackets=self.cfg.extract_title)
         originals_base = self.cfg.out_dir / 'originals' / cleaned_album_title
         cbz_base = self.cfg.out_dir / 'cbz' / cleaned_album_title
-        originals_base.mkdir(parents=True, exist_ok=True)
+        if self.cfg.pack_mode != 'direct':
+            originals_base.mkdir(parents=True, exist_ok=True)
         cbz_base.mkdir(parents=True, exist_ok=True)
-        console.rule(f'处理本子: {cleaned_album_title} ({album_id})')
+        authors_str, tags_str, summary = self._album_meta(album)
+        return AlbumContext(
+            album_id=album_id,
+            cleaned_title=cleaned_album_title,
+            series=clean_title_for_filename(raw_album_title, extract_brackets=self.cfg.extract_title, max_len=999),
+            originals_base=originals_base,
+            cbz_base=cbz_base,
+            authors=authors_str,
+            tags=tags_str,
+            summary=summary,
+        )
+
+    def _run_chapters(self, ctx: AlbumContext, items) -> List[BaseException]:
+        """
+        用流水线处理 [(序号, photo_summary)]，返回各阶段抛出的异常
+        """
+        with Progress(
+                TextColumn("[progress.description]{task.description}"),
+                BarColumn(),
+                "[progress.percentage]{task.percentage:>3.0f}%",
+                TimeElapsedColumn(),
+                TimeRemainingColumn(),
+                console=console
+        ) as pr:
+            # 元数据 -> 图片下载 -> (转码) -> 打包 -> 入库/清理，各阶段独立线程，
+            # 第 N 章打包时第 N+1 章已经在下载
+            pipeline = (Pipeline()
+                        .add_stage('metadata', lambda item: self._stage_fetch_chapter(ctx, *item))
+                        .add_stage('images', lambda job: self._stage_fetch_images(job, pr)))
+            if self.transcode is not None:
+                pipeline.add_stage('transcode', self._stage_transcode)
+            pipeline.add_stage('pack', self._stage_pack).add_stage('commit', self._stage_commit)
+            with pipeline:
+                for idx, photo_summary in items:
+                    pipeline.submit((idx, photo_summary))
+        return pipeline.errors
+
+    def _download_album(self, album):
+        ctx = self._album_context(album)
+        album_id = ctx.album_id
+        console.rule(f'处理本子: {ctx.cleaned_title} ({album_id})')
         all_photos = list(album)
         total_photos = len(all_photos)
 
-        album_failed = False
+        # 登记任务后认领未完成的章节，已完成的章节不再请求章节详情；
+        # 认领带租约，同时运行的 worker 不会重复处理，本进程中断后租约到期由 worker 接手
+        self.db.plan_album(album_id, [(str(p.photo_id), idx) for idx, p in enumerate(all_photos, start=1)])
+        done = sum(1 for s in self.db.get_chapter_states(album_id).values() if s == TASK_DONE)
+        lease = self.cfg.worker_lease
+        try:
+            with self.db.hold_leases(self.task_owner, lease):
+                held = self.db.claim_chapters(album_id, self.task_owner, lease)
+                todo = [(idx, p) for idx, p in enumerate(all_photos, start=1) if str(p.photo_id) in held]
+                busy = total_photos - done - len(todo)
+                if done:
+                    console.log(f'[blue]任务表中已完成 {done}/{total_photos} 章，继续剩余章节[/blue]')
+                if busy > 0:
+                    console.log(f'[yellow]{busy} 章正由其他进程处理，本次跳过[/yellow]')
+                errors = list(self._run_chapters(ctx, todo))
+        finally:
+            # 异常中断时没写入结果的章节放回队列
+            self.db.release_owner(self.task_owner)
+        if errors:
+            ctx.failed = True
+        # 确认各章节的打包/任务记录确实写入了数据库，否则本子不能算完成
+        try:
+            self.db.flush()
+        except DBWriteError as e:
+            console.log(f'[red]本子 {album_id} 的数据库写入失败: {e}[/red]')
+            errors.append(e)
+            ctx.failed = True
+        if not ctx.failed and busy > 0:
+            states = self.db.get_chapter_states(album_id).values()
+            if any(s in (TASK_PENDING, TASK_RUNNING) for s in states):
+                # 本子由最后完成章节的 worker 收尾
+                return
+            ctx.failed = any(s != TASK_DONE for s in states)
+
+        metrics.inc('albums_total', result='failed' if ctx.failed else 'completed')
+        if ctx.failed:
+            error = f'{len(errors)} 个任务处理异常' if errors else '部分章节失败'
+            self.db.finish_task(album_id, state=TASK_FAILED, error=error)
+        else:
+            self.db.finish_task(album_id, state=TASK_DONE)
+        if not ctx.failed and total_photos > 0:
+            self.db.mark_album_completed(album_id)
+            console.log(f"[bold green]本子 {album_id} 全部章节处理完毕，标记为完成[/bold green]")
 
-        for idx, photo_summary in enumerate(all_photos, start=1):
-            try:
-                photo = self.client.get_photo_detail(photo_summary.photo_id, False)
-            except Exception:
-                photo = photo_summary
-            try:
-                chap_num = int(getattr(photo, 'sort', getattr(photo, 'index', None) or idx))
-            except Exception:
-                chap_num = idx
-            raw_photo_title = getattr(photo, 'title', '') or ''
-            is_custom_title = False
-            cleaned_photo_title = ''
-            if raw_photo_title:
-                if not re.match(r'^(chapter_|chapter|photo_|photo)', raw_photo_title, flags=re.I):
-                    is_custom_title = True
-                    cleaned_photo_title = clean_title_for_filename(raw_photo_title,
-                                                                   extract_brackets=self.cfg.extract_title)
-            file_chapter_name = f'第{chap_num}话'
-            if is_custom_title and chap_num > 1:
-                display_title = f"{file_chapter_name} - {cleaned_photo_title}"
-            else:
-                display_title = file_chapter_name
-            photo_folder = originals_base / f"{file_chapter_name}"
-            photo_folder.mkdir(parents=True, exist_ok=True)
-            photo_id = str(getattr(photo, 'photo_id', getattr(photo, 'id', None) or f"{album_id}_{chap_num}"))
-            if self.db.is_packed(album_id, photo_id):
-                console.log(f"[blue]已打包，跳过: {cleaned_album_title} / {display_title}[/blue]")
-                continue
-            image_list = list(photo)
-            if not image_list:
-                console.log(f"[yellow]无图片，跳过: {display_title}[/yellow]")
+    @staticmethod
+    def _album_meta(album):
+        authors_str = None
+        tags_str = None
+        summary = None
+        try:
+            authors_raw = getattr(album, 'author', None) or getattr(album, 'authors', None)
+            author_list = []
+            if authors_raw:
+                if isinstance(authors_raw, str):
+                    author_list = [clean_title_for_filename(a.strip(), extract_brackets=True) for a in
+                                   [authors_raw]]
+                elif isinstance(authors_raw, list):
+                    author_list = [clean_title_for_filename(a, extract_brackets=True) for a in authors_raw]
+
+            # Filter unknown
+            valid_authors = []
+            for a in author_list:
+                if a and a.lower() not in ('unknown', 'none', '未知', 'default_author'):
+                    valid_authors.append(a)
+            if valid_authors:
+                authors_str = ','.join(valid_authors)
+
+            tags = getattr(album, 'tags', None)
+            if tags:
+                if isinstance(tags, list):
+                    tags_str = ','.join(tags)
+                else:
+                    tags_str = str(tags)
+
+            summary = getattr(album, 'description', None) or getattr(album, 'summary', None)
+        except Exception:
+            pass
+        return authors_str, tags_str, summary
+
+    def _stage_fetch_chapter(self, ctx: 'AlbumContext', idx: int, photo_summary) -> Optional['ChapterJob']:
+        try:
+            return self._fetch_chapter(ctx, idx, photo_summary)
+        except Exception as e:
+            # 章节任务记为失败，retry-failed 才能找到它；异常继续抛出，由流水线把本子记为失败
+            photo_id = str(photo_summary.photo_id)
+            console.log(f"[red]获取章节 {photo_id} 失败: {e}[/red]")
+            metrics.inc('chapters_total', result='metadata_failed')
+            self.db.finish_task(ctx.album_id, photo_id, state=TASK_FAILED, error=f'获取章节失败: {e}')
+            raise
+
+    def _fetch_chapter(self, ctx: 'AlbumContext', idx: int, photo_summary) -> Optional['ChapterJob']:
+        try:
+            photo = self.client.get_photo_detail(photo_summary.photo_id, False)
+        except Exception:
+            photo = photo_summary
+        try:
+            chap_num = int(getattr(photo, 'sort', getattr(photo, 'index', None) or idx))
+        except Exception:
+            chap_num = idx
+        raw_photo_title = getattr(photo, 'title', '') or ''
+        is_custom_title = False
+        cleaned_photo_title = ''
+        if raw_photo_title:
+            if not re.match(r'^(chapter_|chapter|photo_|photo)', raw_photo_title, flags=re.I):
+                is_custom_title = True
+                cleaned_photo_title = clean_title_for_filename(raw_photo_title,
+                                                               extract_brackets=self.cfg.extract_title)
+        file_chapter_name = f'第{chap_num}话'
+        if is_custom_title and chap_num > 1:
+            display_title = f"{file_chapter_name} - {cleaned_photo_title}"
+        else:
+            display_title = file_chapter_name
+        photo_folder = ctx.originals_base / f"{file_chapter_name}"
+        photo_id = str(getattr(photo, 'photo_id', getattr(photo, 'id', None) or f"{ctx.album_id}_{chap_num}"))
+        if self.db.is_packed(ctx.album_id, photo_id):
+            console.log(f"[blue]已打包，跳过: {ctx.cleaned_title} / {display_title}[/blue]")
+            metrics.inc('chapters_total', result='skipped')
+            self.db.finish_task(ctx.album_id, photo_id, state=TASK_DONE, attempts=0)
+            return None
+        image_list = list(photo)
+        if not image_list:
+            console.log(f"[yellow]无图片，跳过: {display_title}[/yellow]")
+            self.db.finish_task(ctx.album_id, photo_id, state=TASK_DONE, attempts=0)
+            return None
+        # direct 模式下页面只存在于未完成的 CBZ 中，中断后需要整章重新获取，不登记页面任务
+        done_pages = set()
+        if self.cfg.pack_mode != 'direct':
+            self.db.plan_pages(ctx.album_id, photo_id, len(image_list))
+            done_pages = {page for page, state in self.db.get_page_states(ctx.album_id, photo_id).items()
+                          if state == TASK_DONE}
+        return ChapterJob(
+            album=ctx,
+            photo_id=photo_id,
+            chap_num=chap_num,
+            file_chapter_name=file_chapter_name,
+            display_title=display_title,
+            photo_folder=photo_folder,
+            cbz_target=ctx.cbz_base / f"{file_chapter_name}.cbz",
+            image_list=image_list,
+            done_pages=done_pages,
+        )
+
+    def _stage_fetch_images(self, job: 'ChapterJob', pr: Progress) -> Optional['ChapterJob']:
+        task = pr.add_task(f"{job.album.cleaned_title} / {job.file_chapter_name}", total=len(job.image_list))
+        if self.cfg.pack_mode == 'direct':
+            failed = not self._fetch_images_direct(job, pr, task)
+        else:
+            failed = not self._fetch_images_staged(job, pr, task)
+            if not failed:
+                found = len(CbzPacker.image_files(job.photo_folder))
+                if found != len(job.image_list):
+                    console.log(f"[red]原图数量 {found} 与章节页数 {len(job.image_list)} 不符，跳过 CBZ 打包: "
+                                f"{job.file_chapter_name}[/red]")
+                    metrics.inc('chapters_total', result='download_failed')
+                    self.db.finish_task(*job.task, state=TASK_FAILED,
+                                        error=f'原图数量 {found} 与页数 {len(job.image_list)} 不符')
+                    job.album.failed = True
+                    return None
+        if failed:
+            console.log(f"[red]章节下载存在失败，跳过 CBZ 打包: {job.file_chapter_name}[/red]")
+            metrics.inc('chapters_total', result='download_failed')
+            self.db.finish_task(*job.task, state=TASK_FAILED, error='部分图片下载失败')
+            job.album.failed = True
+            return None
+        return job
+
+    def _fetch_images_staged(self, job: 'ChapterJob', pr: Progress, task) -> bool:
+        job.photo_folder.mkdir(parents=True, exist_ok=True)
+        hashes = self._page_hashes(job)
+        ok = True
+        futures = []
+        for i_img, img in enumerate(job.image_list, start=1):
+            img_url = getattr(img, 'img_url', None)
+            suffix = Path(img_url).suffix if img_url else '.jpg'
+            out_name = f"{i_img:04d}{suffix}"
+            out_path = job.photo_folder / out_name
+            if i_img in job.done_pages and out_path.exists():
+                # 任务表记录已完成且文件还在的页面不再校验内容
+                pr.update(task, advance=1)
                 continue
-            with Progress(
-                    TextColumn("[progress.description]{task.description}"),
-                    BarColumn(),
-                    "[progress.percentage]{task.percentage:>3.0f}%",
-                    TimeElapsedColumn(),
-                    TimeRemainingColumn(),
-                    console=console
-            ) as pr:
-                task_desc = f"{cleaned_album_title} / {file_chapter_name}"
-                task = pr.add_task(task_desc, total=len(image_list))
-                failed = False
-                for i_img, img in enumerate(image_list, start=1):
-                    img_url = getattr(img, 'img_url', None)
-                    suffix = Path(img_url).suffix if img_url else '.jpg'
-                    out_name = f"{i_img:04d}{suffix}"
-                    out_path = photo_folder / out_name
-                    if out_path.exists():
-                        pr.update(task, advance=1)
-                        continue
-                    ok = False
-                    for attempt in range(1, self.cfg.retries + 1):
-                        try:
-                            try:
-                                self.client.download_by_image_detail(img, str(out_path))
-                            except Exception:
-                                resp = self.session.get(img_url, timeout=self.session_timeout)
-                                resp.raise_for_status()
-                                out_path.write_bytes(resp.content)
-                            ok = True
-                            break
-                        except Exception as e:
-                            console.log(f"[yellow]图片下载失败 ({attempt}/{self.cfg.retries}): {e}[/yellow]")
-                            import time;
-                            time.sleep(0.5)
-                    if not ok:
-                        console.log(f"[red]图片多次失败，标记本章失败: {img_url}[/red]")
-                        failed = True
+            if out_path.exists():
+                if is_image_file_complete(out_path):
+                    metrics.inc('images_skipped_total')
                     pr.update(task, advance=1)
-            cbz_target = cbz_base / f"{file_chapter_name}.cbz"
-            if failed:
-                console.log(f"[red]章节下载存在失败，跳过 CBZ 打包: {file_chapter_name}[/red]")
-                album_failed = True
-                continue
-            authors_str = None
-            tags_str = None
-            summary = None
-            try:
-                authors_raw = getattr(album, 'author', None) or getattr(album, 'authors', None)
-                author_list = []
-                if authors_raw:
-                    if isinstance(authors_raw, str):
-                        author_list = [clean_title_for_filename(a.strip(), extract_brackets=True) for a in
-                                       [authors_raw]]
-                    elif isinstance(authors_raw, list):
-                        author_list = [clean_title_for_filename(a, extract_brackets=True) for a in authors_raw]
-
-                # Filter unknown
-                valid_authors = []
-                for a in author_list:
-                    if a and a.lower() not in ('unknown', 'none', '未知', 'default_author'):
-                        valid_authors.append(a)
-                if valid_authors:
-                    authors_str = ','.join(valid_authors)
-
-                tags = getattr(album, 'tags', None)
-                if tags:
-                    if isinstance(tags, list):
-                        tags_str = ','.join(tags)
+                    continue
+                console.log(f"[yellow]图片不完整，重新下载: {out_path}[/yellow]")
+                out_path.unlink(missing_ok=True)
+            futures.append(self._image_pool.submit(self._in_stage, 'images', self._download_page,
+                                                   job, i_img, img, out_path, hashes.get(i_img)))
+        # 进度条只在本阶段线程推进，避免图片线程同时刷新 rich
+        for fut in as_completed(futures):
+            if not fut.result():
+                ok = False
+            pr.update(task, advance=1)
+        return ok
+
+    def _fetch_images_direct(self, job: 'ChapterJob', pr: Progress, task) -> bool:
+        # 图片不落地到 originals/，下载完成即写入 CBZ；
+        # 下载和转码都只保持有限的页面在途，避免整章图片同时堆在内存和进程池队列里
+        writer = CbzWriter(job.cbz_target, total_pages=len(job.image_list))
+        hashes = self._page_hashes(job)
+        # 在途、等待转码和在 writer 中等待前面页的页面合计不超过 window
+        window = max(1, self.cfg.image_workers) * 2
+        total = len(job.image_list)
+        submitted = 0
+        futures: Dict[Future, int] = {}
+
+        def refill():
+            nonlocal submitted
+            budget = window - len(futures) - len(job.transcoding) - writer.buffered
+            while budget > 0 and submitted < total:
+                i = submitted
+                futures[self._image_pool.submit(self._in_stage, 'images', self._fetch_page_bytes,
+                                                job, i + 1, job.image_list[i], hashes.get(i + 1))] = i
+                submitted += 1
+                budget -= 1
+
+        ok = True
+        refill()
+        while futures:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for fut in done:
+                index = futures.pop(fut)
+                data = fut.result()
+                pr.update(task, advance=1)
+                if data is None or not ok:
+                    ok = False
+                    continue
+                try:
+                    if self.transcode is not None:
+                        # 转码在进程池中进行，在途的转码达到上限时先把完成的写入 CBZ，剩下的由转码阶段收尾
+                        self._collect_transcoded(job, writer, self._transcode_window)
+                        job.transcoding[index] = self._transcode_pool.submit(self.transcode.apply_checked, data)
                     else:
-                        tags_str = str(tags)
-
-                summary = getattr(album, 'description', None) or getattr(album, 'summary', None)
-            except Exception:
-                pass
-            cbz_title = f"{display_title}"
-            cbz_series = clean_title_for_filename(raw_album_title, extract_brackets=self.cfg.extract_title, max_len=999)
-
-            try:
-                CbzPacker.pack_images_to_cbz(images_folder=photo_folder, cbz_path=cbz_target,
-                                             title=cbz_title, series=cbz_series, number=chap_num,
-                                             authors=authors_str, tags=tags_str, summary=summary,
-                                             album_id=album_id)
-                console.log(f"[green]打包完成: {cbz_target}[/green]")
-                self.db.mark_packed(album_id, photo_id)
-                if self.cfg.delete_after_pack:
-                    shutil.rmtree(photo_folder, ignore_errors=True)
-                    console.log(f"[grey]已删除原图文件夹: {photo_folder}[/grey]")
-            except Exception as e:
-                console.log(f"[red]CBZ 打包失败: {e}[/red]")
-                album_failed = True
-
-        if not album_failed and total_photos > 0:
-            self.db.mark_album_completed(album_id)
-            console.log(f"[bold green]本子 {album_id} 全部章节处理完毕，标记为完成[/bold green]")
+                        writer.add_page(index, data)
+                except Exception as e:
+                    console.log(f"[red]转码或写入 CBZ 失败: {job.file_chapter_name}: {e}[/red]")
+                    ok = False
+            # 已有页面失败时整章作废，不再提交剩下的页面
+            if ok:
+                refill()
+                if not futures and submitted < total:
+                    # 窗口被等待转码的页面占满，先把转码结果写入 CBZ 腾出位置
+                    self._collect_transcoded(job, writer, 1)
+                    refill()
+        if not ok:
+            for pending in job.transcoding.values():
+                pending.cancel()
+            job.transcoding.clear()
+            writer.abort()
+            return False
+        job.writer = writer
+        return True
+
+    @property
+    def _transcode_window(self) -> int:
+        return (self.cfg.transcode_workers or os.cpu_count() or 1) * 2
+
+    @staticmethod
+    def _collect_transcoded(job: 'ChapterJob', writer: CbzWriter, limit: int):
+        """
+        把已完成的转码结果写入 CBZ；在途的转码任务不少于 limit 时等到有任务完成
+        """
+        while job.transcoding:
+            finished = [i for i, fut in job.transcoding.items() if fut.done()]
+            if not finished:
+                if len(job.transcoding) < limit:
+                    return
+                wait(job.transcoding.values(), return_when=FIRST_COMPLETED)
+                continue
+            for i in finished:
+                data, encoded = job.transcoding.pop(i).result()
+                metrics.inc('transcode_bytes_total', len(data))
+                writer.add_page(i, data)
+                job.transcoded += encoded
+            if len(job.transcoding) < limit:
+                return
+
+    def _stage_transcode(self, job: 'ChapterJob') -> Optional['ChapterJob']:
+        pages = iter(())
+        if job.writer is None:
+            # staged 模式：originals/ 中保留原图，转码后的页面写入新的 CBZ；
+            # 只保持有限的页面在进程池中，完成一页再读入下一页，避免整章原图同时驻留内存
+            job.writer = CbzWriter(job.cbz_target, total_pages=len(job.image_list))
+            pages = enumerate(CbzPacker.image_files(job.photo_folder))
+        window = self._transcode_window
+        futures = {fut: i for i, fut in job.transcoding.items()}
+        job.transcoding.clear()
+
+        def refill():
+            for i, path in itertools.islice(pages, max(0, window - len(futures) - job.writer.buffered)):
+                futures[self._transcode_pool.submit(self.transcode.apply_checked, path.read_bytes())] = i
+
+        try:
+            refill()
+            while futures:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    data, encoded = fut.result()
+                    metrics.inc('transcode_bytes_total', len(data))
+                    job.writer.add_page(futures.pop(fut), data)
+                    job.transcoded += encoded
+                refill()
+        except Exception as e:
+            console.log(f"[red]图片转码失败: {job.file_chapter_name}: {e}[/red]")
+            metrics.inc('chapters_total', result='transcode_failed')
+            self.db.finish_task(*job.task, state=TASK_FAILED, error=f'转码失败: {e}')
+            for fut in futures:
+                fut.cancel()
+            job.writer.abort()
+            job.album.failed = True
+            return None
+        return job
+
+    def _stage_pack(self, job: 'ChapterJob') -> Optional['ChapterJob']:
+        with self.profiler.stage('pack'):
+            return self._pack_chapter(job)
+
+    def _pack_chapter(self, job: 'ChapterJob') -> Optional['ChapterJob']:
+        ctx = job.album
+        meta = dict(title=job.display_title, series=ctx.series, number=job.chap_num,
+                    authors=ctx.authors, tags=ctx.tags, summary=ctx.summary, album_id=ctx.album_id)
+        try:
+            if job.writer is not None:
+                scan = self.transcode.scan_information(job.transcoded, len(job.image_list)) if self.transcode else None
+                job.writer.finish(**meta, scan_information=scan)
+            else:
+                CbzPacker.pack_images_to_cbz(images_folder=job.photo_folder, cbz_path=job.cbz_target, **meta)
+            console.log(f"[green]打包完成: {job.cbz_target}[/green]")
+        except Exception as e:
+            console.log(f"[red]CBZ 打包失败: {e}[/red]")
+            metrics.inc('chapters_total', result='pack_failed')
+            self.db.finish_task(*job.task, state=TASK_FAILED, error=f'打包失败: {e}')
+            ctx.failed = True
+            return None
+        return job
+
+    def _stage_commit(self, job: 'ChapterJob') -> None:
+        with self.db.transaction():
+            self.db.mark_packed(job.album.album_id, job.photo_id)
+            self.db.finish_task(*job.task, state=TASK_DONE)
+        metrics.inc('chapters_total', result='packed')
+        if self.cfg.delete_after_pack and self.cfg.pack_mode != 'direct':
+            shutil.rmtree(job.photo_folder, ignore_errors=True)
+            console.log(f"[grey]已删除原图文件夹: {job.photo_folder}[/grey]")
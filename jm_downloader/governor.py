@@ -0,0 +1,103 @@
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+from .utils import RateLimiter
+
+OK = 'ok'
+THROTTLED = 'throttled'
+ERROR = 'error'
+
+
+def classify_status(status_code: Optional[int]) -> str:
+    if status_code is None:
+        return OK
+    if status_code == 429 or status_code == 503:
+        return THROTTLED
+    if status_code >= 500:
+        return ERROR
+    return OK
+
+
+class AimdLimiter:
+    """
+    AIMD 并发控制：请求成功时上限缓慢加一（每轮约 +1），
+    遇到限流或错误时上限减半，两次减半之间至少间隔 cooldown 秒
+    """
+
+    def __init__(self, max_limit: int, min_limit: int = 1, decrease: float = 0.5, cooldown: float = 1.0):
+        self.max_limit = max(1, max_limit)
+        self.min_limit = max(1, min(min_limit, self.max_limit))
+        self.decrease = decrease
+        self.cooldown = cooldown
+        self.limit = float(self.max_limit)
+        self._in_flight = 0
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while self._in_flight >= int(self.limit):
+                self._cond.wait()
+            self._in_flight += 1
+
+    def release(self, outcome: str = OK):
+        with self._cond:
+            self._in_flight -= 1
+            if outcome == OK:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            else:
+                now = time.monotonic()
+                if now - self._last_decrease >= self.cooldown:
+                    self.limit = max(self.min_limit, self.limit * self.decrease)
+                    self._last_decrease = now
+            self._cond.notify_all()
+
+
+class RequestCall:
+    def __init__(self):
+        self.outcome = OK
+        self.observed = False
+
+    def observe(self, status_code: Optional[int]):
+        self.outcome = classify_status(status_code)
+        self.observed = True
+
+
+class RequestGovernor:
+    """
+    全局请求调度：API 请求经过令牌桶限速，所有请求共享一个 AIMD 并发上限
+    """
+
+    def __init__(self, api_rate: float, max_concurrency: int, min_concurrency: int = 1):
+        self.api_bucket = RateLimiter(api_rate, burst=max(1, int(api_rate)))
+        self.concurrency = AimdLimiter(max_concurrency, min_concurrency)
+
+    def throttle_api(self):
+        self.api_bucket.acquire()
+
+    @contextmanager
+    def request(self):
+        """
+        占用一个并发名额，调用方通过 call.observe(status_code) 汇报结果
+        """
+        call = RequestCall()
+        self.concurrency.acquire()
+        try:
+            yield call
+        except BaseException:
+            # 已拿到响应状态码的（如 404 触发的 raise_for_status）按状态码计，其余视为网络错误
+            if not call.observed:
+                call.outcome = ERROR
+            raise
+        finally:
+            self.concurrency.release(call.outcome)
+
+
+def backoff_delay(attempt: int, base: float = 0.5, cap: float = 30.0) -> float:
+    """
+    指数退避加随机抖动（full jitter）
+    """
+    return random.uniform(0, min(cap, base * (2 ** (attempt - 1))))
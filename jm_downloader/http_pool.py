@@ -0,0 +1,148 @@
+import logging
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+
+from common import CurlCffiPostman
+from curl_cffi import requests as curl_requests
+
+from .governor import RequestGovernor, RequestCall
+from .metrics import metrics
+
+log = logging.getLogger('jm_downloader')
+
+
+class HttpPool:
+    """
+    jmcomic 客户端与备用下载路径共用的 HTTP 连接池。
+    curl_cffi 的 Session 在每个线程里复用自己的 curl 句柄，因此只要下载线程是长期存在的，
+    keep-alive 连接就不会在每次请求后被丢弃；同时按 host 限制同时进行的请求数。
+    """
+
+    def __init__(self, max_per_host: int, timeout: float = 20, chunk_size: int = 64 * 1024,
+                 governor: Optional[RequestGovernor] = None):
+        self.governor = governor
+        self.max_per_host = max(1, max_per_host)
+        self.timeout = timeout
+        self.chunk_size = chunk_size
+        self.session = curl_requests.Session()
+        self._hosts: Dict[str, threading.BoundedSemaphore] = {}
+        self._hosts_lock = threading.Lock()
+
+    def _host_slot(self, url: str) -> threading.BoundedSemaphore:
+        host = urlsplit(url).netloc
+        with self._hosts_lock:
+            slot = self._hosts.get(host)
+            if slot is None:
+                slot = self._hosts[host] = threading.BoundedSemaphore(self.max_per_host)
+            return slot
+
+    @contextmanager
+    def _gate(self, url: str):
+        if self.governor is None:
+            with self._host_slot(url):
+                yield RequestCall()
+            return
+        with self.governor.request() as call, self._host_slot(url):
+            try:
+                yield call
+            finally:
+                metrics.inc('http_requests_total', outcome=call.outcome if call.observed else 'network_error')
+        metrics.set('http_concurrency_limit', self.governor.concurrency.limit)
+
+    def get(self, url, **kwargs):
+        with self._gate(url) as call:
+            resp = self.session.get(url, **kwargs)
+            call.observe(resp.status_code)
+            return resp
+
+    def post(self, url, **kwargs):
+        with self._gate(url) as call:
+            resp = self.session.post(url, **kwargs)
+            call.observe(resp.status_code)
+            return resp
+
+    @contextmanager
+    def stream(self, url, accept=(), **kwargs):
+        # 流式响应在读完之前一直占用该 host 的名额；accept 中的状态码不视为错误
+        kwargs.setdefault('timeout', self.timeout)
+        with self._gate(url) as call:
+            resp = self.session.get(url, stream=True, **kwargs)
+            call.observe(resp.status_code)
+            try:
+                if resp.status_code not in accept:
+                    resp.raise_for_status()
+                yield resp
+            finally:
+                resp.close()
+
+    def download_to(self, url: str, path: Path, resume: bool = False, **kwargs) -> int:
+        """
+        分块写入文件，返回文件的总字节数。
+        resume 为 True 且文件已存在时用 Range 请求续传；服务端不支持 Range 时从头下载。
+        响应带 Content-Length 而实际长度不足时抛出 IOError，已写入的部分保留以便下次续传
+        """
+        offset = path.stat().st_size if resume and path.exists() else 0
+        headers = dict(kwargs.pop('headers', None) or {})
+        if offset:
+            headers['Range'] = f'bytes={offset}-'
+        with self.stream(url, accept=(416,) if offset else (), headers=headers, **kwargs) as resp:
+            if resp.status_code == 416:
+                # 请求范围超出文件长度：本地文件已经下载完整（或已损坏，交给完整性检查判断）
+                return offset
+            if resp.status_code != 206:
+                offset = 0
+            expected = resp.headers.get('Content-Length')
+            if resp.headers.get('Content-Encoding'):
+                expected = None
+            written = 0
+            with open(path, 'ab' if offset else 'wb') as f:
+                for chunk in resp.iter_content(chunk_size=self.chunk_size):
+                    f.write(chunk)
+                    written += len(chunk)
+        if expected is not None and written < int(expected):
+            raise IOError(f'下载不完整: {written}/{expected} 字节 {url}')
+        return offset + written
+
+    def fetch_bytes(self, url: str, **kwargs) -> bytes:
+        buf = bytearray()
+        with self.stream(url, **kwargs) as resp:
+            for chunk in resp.iter_content(chunk_size=self.chunk_size):
+                buf.extend(chunk)
+        return bytes(buf)
+
+    def install(self, client) -> bool:
+        """
+        把 jmcomic 客户端默认的 curl_cffi postman（每次请求新建连接）替换为走本连接池的 postman
+        """
+        postman = client.postman
+        if type(postman) is not CurlCffiPostman:
+            log.info(f'[http] 客户端使用 {type(postman).__name__}，不接入共享连接池')
+            return False
+        client.postman = PooledCurlPostman(postman.meta_data, self)
+        return True
+
+    def close(self):
+        self.session.close()
+
+
+class PooledCurlPostman(CurlCffiPostman):
+    """
+    与 CurlCffiPostman 的请求参数合并逻辑（headers、cookies、impersonate 等）完全一致，
+    只是请求经由共享的 HttpPool 发出
+    """
+
+    def __init__(self, kwargs, pool: HttpPool) -> None:
+        super().__init__(kwargs)
+        self.pool = pool
+
+    def __get__(self):
+        return self.pool.get
+
+    def __post__(self):
+        return self.pool.post
+
+    def copy(self):
+        return self.__class__(self.meta_data.copy(), self.pool)
@@ -0,0 +1,91 @@
+import hashlib
+import os
+import shutil
+import uuid
+from pathlib import Path
+from typing import Optional
+
+from .utils import PART_SUFFIX
+
+
+class ImageStore:
+    """
+    内容寻址图片库：图片按 sha256 存放在 <root>/<前两位>/<哈希>，
+    章节目录中的图片是指向库内文件的硬链接（跨文件系统时退化为复制），
+    相同内容的图片在磁盘上只保存一份
+    """
+
+    def __init__(self, root: Path, chunk_size: int = 1024 * 1024):
+        self.root = root
+        self.chunk_size = chunk_size
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def object_path(self, digest: str) -> Path:
+        return self.root / digest[:2] / digest
+
+    def has(self, digest: Optional[str]) -> bool:
+        return bool(digest) and self.object_path(digest).exists()
+
+    def hash_file(self, path: Path) -> str:
+        h = hashlib.sha256()
+        with open(path, 'rb') as f:
+            while True:
+                chunk = f.read(self.chunk_size)
+                if not chunk:
+                    break
+                h.update(chunk)
+        return h.hexdigest()
+
+    def put_file(self, path: Path) -> str:
+        """
+        把已下载完成的图片收入库中并返回哈希；库中已有相同内容时，path 被替换为指向库内文件的链接
+        """
+        digest = self.hash_file(path)
+        obj = self.object_path(digest)
+        if not obj.exists():
+            obj.parent.mkdir(parents=True, exist_ok=True)
+            try:
+                os.link(path, obj)
+                return digest
+            except FileExistsError:
+                pass
+            except OSError:
+                self._publish(obj, lambda tmp: shutil.copyfile(path, tmp))
+                return digest
+        self.link_to(digest, path)
+        return digest
+
+    def put_bytes(self, data: bytes) -> str:
+        digest = hashlib.sha256(data).hexdigest()
+        obj = self.object_path(digest)
+        if not obj.exists():
+            obj.parent.mkdir(parents=True, exist_ok=True)
+            self._publish(obj, lambda tmp: tmp.write_bytes(data))
+        return digest
+
+    def read(self, digest: str) -> bytes:
+        return self.object_path(digest).read_bytes()
+
+    def link_to(self, digest: str, dest: Path) -> None:
+        """
+        在 dest 处放置库内图片（原子替换已存在的文件）
+        """
+        obj = self.object_path(digest)
+
+        def make(tmp: Path):
+            try:
+                os.link(obj, tmp)
+            except OSError:
+                shutil.copyfile(obj, tmp)
+
+        self._publish(dest, make)
+
+    @staticmethod
+    def _publish(target: Path, write) -> None:
+        # 先写到同目录的临时文件再重命名，避免其它线程读到半个文件
+        tmp = target.with_name(f'{target.name}.{uuid.uuid4().hex[:8]}{PART_SUFFIX}')
+        try:
+            write(tmp)
+            os.replace(tmp, target)
+        finally:
+            tmp.unlink(missing_ok=True)
@@ -0,0 +1,218 @@
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+# 延迟直方图的桶上界（秒）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_Key = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+
+def _key(name: str, labels: Dict[str, object]) -> _Key:
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_key(key: _Key) -> str:
+    name, labels = key
+    if not labels:
+        return name
+    inner = ','.join(f'{k}="{v}"' for k, v in labels)
+    return f'{name}{{{inner}}}'
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float:
+        """
+        按桶估算分位数（取所在桶的上界）
+        """
+        if self.count == 0:
+            return 0.0
+        target = q * self.count
+        seen = 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if seen >= target:
+                return self.buckets[i] if i < len(self.buckets) else float('inf')
+        return float('inf')
+
+    def to_dict(self) -> dict:
+        # 落在最后一个桶（+Inf）的分位数在 JSON 中记为 null
+        p50, p99 = (q if q != float('inf') else None for q in (self.quantile(0.5), self.quantile(0.99)))
+        return {
+            'count': self.count,
+            'sum': round(self.sum, 6),
+            'p50': p50,
+            'p99': p99,
+            'buckets': {str(b): c for b, c in zip(list(self.buckets) + ['+Inf'], self.counts)},
+        }
+
+
+class Metrics:
+    """
+    线程安全的计数器 / 数值 / 直方图集合，名称和标签沿用 Prometheus 的命名习惯
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[_Key, float] = {}
+        self._gauges: Dict[_Key, float] = {}
+        self._histograms: Dict[_Key, Histogram] = {}
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels):
+        with self._lock:
+            self._gauges[_key(name, labels)] = value
+
+    def observe(self, name: str, seconds: float, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = self._histograms[key] = Histogram()
+            hist.observe(seconds)
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._histograms.clear()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                'counters': {_format_key(k): v for k, v in sorted(self._counters.items())},
+                'gauges': {_format_key(k): v for k, v in sorted(self._gauges.items())},
+                'histograms': {_format_key(k): h.to_dict() for k, h in sorted(self._histograms.items())},
+            }
+
+    def to_prometheus(self, prefix: str = 'jm_') -> str:
+        lines = []
+        with self._lock:
+            for kind, items in (('counter', self._counters), ('gauge', self._gauges)):
+                typed = set()
+                for (name, labels), value in sorted(items.items()):
+                    if name not in typed:
+                        lines.append(f'# TYPE {prefix}{name} {kind}')
+                        typed.add(name)
+                    lines.append(f'{_format_key((prefix + name, labels))} {value}')
+            typed = set()
+            for (name, labels), hist in sorted(self._histograms.items()):
+                full = prefix + name
+                if name not in typed:
+                    lines.append(f'# TYPE {full} histogram')
+                    typed.add(name)
+                cumulative = 0
+                for bound, c in zip(list(hist.buckets) + ['+Inf'], hist.counts):
+                    cumulative += c
+                    lines.append(f"{_format_key((full + '_bucket', labels + (('le', str(bound)),)))} {cumulative}")
+                lines.append(f"{_format_key((full + '_sum', labels))} {hist.sum}")
+                lines.append(f"{_format_key((full + '_count', labels))} {hist.count}")
+        return '\n'.join(lines) + '\n'
+
+
+# 进程内共享的指标集合
+metrics = Metrics()
+
+
+def _write_atomic(path: Path, text: str):
+    # node exporter 的 textfile collector 要求原子替换，避免读到半个文件
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f'.{path.name}.{os.getpid()}.tmp')
+    tmp.write_text(text, encoding='utf-8')
+    os.replace(tmp, path)
+
+
+class RunReporter:
+    """
+    运行期间按间隔把指标写入 Prometheus textfile，结束时写出 JSON 运行报告
+    """
+
+    def __init__(self, command: str, report_dir: Optional[Path] = None, textfile: Optional[Path] = None,
+                 interval: float = 15, registry: Metrics = metrics):
+        self.command = command
+        self.report_dir = report_dir
+        self.textfile = textfile
+        self.interval = interval
+        self.registry = registry
+        self.started_at = time.time()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._closed = False
+
+    @classmethod
+    def from_config(cls, cfg, command: str) -> 'RunReporter':
+        return cls(command,
+                   report_dir=cfg.reports_dir if cfg.run_report else None,
+                   textfile=cfg.metrics_textfile,
+                   interval=cfg.metrics_interval)
+
+    def start(self) -> 'RunReporter':
+        if self.textfile is not None and self.interval > 0:
+            self._thread = threading.Thread(target=self._loop, name='jm-metrics', daemon=True)
+            self._thread.start()
+        return self
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            self.write_textfile()
+
+    def write_textfile(self):
+        if self.textfile is not None:
+            self.registry.set('last_export_timestamp_seconds', time.time())
+            _write_atomic(self.textfile, self.registry.to_prometheus())
+
+    def close(self) -> Optional[Path]:
+        if self._closed:
+            return None
+        self._closed = True
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.write_textfile()
+        if self.report_dir is None:
+            return None
+        finished = time.time()
+        report = {
+            'command': self.command,
+            'started_at': self.started_at,
+            'finished_at': finished,
+            'duration_seconds': round(finished - self.started_at, 3),
+            **self.registry.snapshot(),
+        }
+        path = self.report_dir / f"run-{time.strftime('%Y%m%d-%H%M%S', time.localtime(self.started_at))}-{self.command}.json"
+        _write_atomic(path, json.dumps(report, indent=2, ensure_ascii=False))
+        return path
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,94 @@
+import logging
+import queue
+import threading
+import time
+from typing import Any, Callable, List, Optional
+
+from .metrics import metrics
+
+log = logging.getLogger('jm_downloader')
+
+_STOP = object()
+
+
+class Stage:
+    """
+    流水线中的一个阶段：独立线程从有界队列中取任务，处理后交给下一阶段。
+    handler 返回 None 表示该任务在本阶段结束（例如已打包跳过）。
+    """
+
+    def __init__(self, name: str, handler: Callable[[Any], Any], maxsize: int = 2):
+        self.name = name
+        self.handler = handler
+        self.inbox: queue.Queue = queue.Queue(maxsize=max(1, maxsize))
+        self.next: Optional['Stage'] = None
+        self.errors: List[BaseException] = []
+        self._thread = threading.Thread(target=self._run, name=f'jm-stage-{name}', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def join(self):
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            item = self.inbox.get()
+            if item is _STOP:
+                if self.next:
+                    self.next.inbox.put(_STOP)
+                return
+            started = time.perf_counter()
+            try:
+                result = self.handler(item)
+            except Exception as e:
+                log.exception(f'[pipeline] 阶段 {self.name} 处理失败: {e}')
+                self.errors.append(e)
+                metrics.inc('stage_items_total', stage=self.name, result='error')
+                continue
+            finally:
+                metrics.observe('stage_seconds', time.perf_counter() - started, stage=self.name)
+            # 最后一个阶段没有下游，返回 None 也算正常完成
+            passed = result is not None or self.next is None
+            metrics.inc('stage_items_total', stage=self.name, result='ok' if passed else 'dropped')
+            if result is not None and self.next:
+                self.next.inbox.put(result)
+
+
+class Pipeline:
+    """
+    由若干 Stage 串联的流水线，阶段之间用有界队列连接，
+    上游阶段在下游繁忙时会被阻塞，从而限制同时在途的任务数量。
+    """
+
+    def __init__(self):
+        self.stages: List[Stage] = []
+
+    def add_stage(self, name: str, handler: Callable[[Any], Any], maxsize: int = 2) -> 'Pipeline':
+        stage = Stage(name, handler, maxsize)
+        if self.stages:
+            self.stages[-1].next = stage
+        self.stages.append(stage)
+        return self
+
+    @property
+    def errors(self) -> List[BaseException]:
+        return [e for stage in self.stages for e in stage.errors]
+
+    def __enter__(self):
+        for stage in self.stages:
+            stage.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        # 异常退出（如 Ctrl+C）时不等待各阶段排空，交给守护线程随进程结束
+        if exc_type is None:
+            self.close()
+
+    def submit(self, item):
+        self.stages[0].inbox.put(item)
+
+    def close(self):
+        self.stages[0].inbox.put(_STOP)
+        for stage in self.stages:
+            stage.join()
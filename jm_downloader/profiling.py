@@ -0,0 +1,179 @@
+import cProfile
+import os
+import pstats
+import re
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+from typing import Dict, Optional
+
+PROFILE_MODES = ('cpu', 'memory')
+
+_NULL = nullcontext()
+
+# 模块导入和 tracemalloc 自身的分配与各阶段无关，报告中排除
+_MEMORY_FILTERS = (
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+    tracemalloc.Filter(False, tracemalloc.__file__),
+)
+
+
+def _safe_name(stage: str) -> str:
+    return re.sub(r'[^\w.-]+', '_', stage)
+
+
+class NullProfiler:
+    """
+    未开启性能分析时使用，stage() 直接返回同一个空上下文，开销可以忽略
+    """
+    mode = None
+    run_dir = None
+
+    def stage(self, name: str):
+        return _NULL
+
+    def dump(self):
+        pass
+
+    def close(self):
+        return None
+
+
+class Profiler:
+    """
+    按阶段（收藏同步、本子详情、图片、打包等）划分的性能分析。
+
+    cpu: 每个阶段一个 cProfile 统计。cProfile 只记录开启它的线程，因此阶段范围要包住真正干活的代码
+    （例如图片阶段包住线程池中的单页任务），同一线程内嵌套的范围只计最外层；
+    memory: tracemalloc 记录分配，每个阶段结束时（每阶段至多每 snapshot_interval 秒一次）保存快照，
+    报告列出相对开始时增长最多的分配位置。
+    结果写入 run_dir，文件名带上进程号以便多个子进程写入同一目录
+    """
+
+    def __init__(self, mode: str, run_dir: Path, top: int = 40, snapshot_interval: float = 2.0,
+                 trace_frames: int = 16):
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"不支持的 profile 模式: {mode}（可选 {', '.join(PROFILE_MODES)}）")
+        self.mode = mode
+        self.run_dir = Path(run_dir)
+        self.run_dir.mkdir(parents=True, exist_ok=True)
+        self.top = top
+        self.snapshot_interval = snapshot_interval
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._stats: Dict[str, pstats.Stats] = {}
+        self._calls: Dict[str, int] = {}
+        self._seconds: Dict[str, float] = {}
+        self._snapshots: Dict[str, tracemalloc.Snapshot] = {}
+        self._snapshot_at: Dict[str, float] = {}
+        self._peaks: Dict[str, int] = {}
+        self._baseline: Optional[tracemalloc.Snapshot] = None
+        self._closed = False
+        if mode == 'memory':
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(trace_frames)
+            self._baseline = tracemalloc.take_snapshot().filter_traces(_MEMORY_FILTERS)
+
+    @classmethod
+    def create(cls, mode: Optional[str], base_dir: Path, command: str):
+        if not mode:
+            return NullProfiler()
+        run_dir = Path(base_dir) / f"{time.strftime('%Y%m%d-%H%M%S')}-{command}-{mode}-{os.getpid()}"
+        return cls(mode, run_dir)
+
+    @contextmanager
+    def stage(self, name: str):
+        # 同一线程内已处于某个阶段时不再重复开启
+        if getattr(self._local, 'active', False):
+            yield
+            return
+        self._local.active = True
+        started = time.perf_counter()
+        try:
+            if self.mode == 'cpu':
+                with self._cpu(name):
+                    yield
+            else:
+                yield
+                self._memory(name)
+        finally:
+            self._local.active = False
+            with self._lock:
+                self._calls[name] = self._calls.get(name, 0) + 1
+                self._seconds[name] = self._seconds.get(name, 0.0) + time.perf_counter() - started
+
+    @contextmanager
+    def _cpu(self, name: str):
+        prof = cProfile.Profile()
+        try:
+            prof.enable()
+        except ValueError:
+            # Python 3.12 起同一时刻只能有一个 cProfile 在运行，并发的范围只能跳过
+            yield
+            return
+        try:
+            yield
+        finally:
+            prof.disable()
+            with self._lock:
+                stats = self._stats.get(name)
+                if stats is None:
+                    self._stats[name] = pstats.Stats(prof)
+                else:
+                    stats.add(prof)
+
+    def _memory(self, name: str):
+        current, _ = tracemalloc.get_traced_memory()
+        now = time.monotonic()
+        with self._lock:
+            self._peaks[name] = max(self._peaks.get(name, 0), current)
+            if now - self._snapshot_at.get(name, 0.0) < self.snapshot_interval:
+                return
+            self._snapshot_at[name] = now
+        snapshot = tracemalloc.take_snapshot().filter_traces(_MEMORY_FILTERS)
+        with self._lock:
+            self._snapshots[name] = snapshot
+
+    def dump(self):
+        """
+        把目前为止的结果写入 run_dir（可多次调用，后一次覆盖前一次）
+        """
+        suffix = f'-{os.getpid()}'
+        with self._lock:
+            summary = [f'{"阶段":<16}{"次数":>8}{"耗时(s)":>12}']
+            for name in sorted(self._calls):
+                summary.append(f'{name:<16}{self._calls[name]:>8}{self._seconds[name]:>12.3f}')
+            stats = dict(self._stats)
+            snapshots = dict(self._snapshots)
+            peaks = dict(self._peaks)
+        (self.run_dir / f'summary{suffix}.txt').write_text('\n'.join(summary) + '\n', encoding='utf-8')
+        for name, st in stats.items():
+            base = self.run_dir / f'{_safe_name(name)}{suffix}'
+            st.dump_stats(str(base.with_suffix('.pstats')))
+            with open(base.with_suffix('.txt'), 'w', encoding='utf-8') as f:
+                pstats.Stats(str(base.with_suffix('.pstats')), stream=f) \
+                    .strip_dirs().sort_stats('cumulative').print_stats(self.top)
+        for name, snapshot in snapshots.items():
+            lines = [f'阶段 {name}：范围结束时已分配内存最高 {peaks.get(name, 0) / 1024 / 1024:.1f} MiB',
+                     f'相对开始时增长最多的 {self.top} 处分配：']
+            for diff in snapshot.compare_to(self._baseline, 'lineno')[:self.top]:
+                lines.append(str(diff))
+            lines.append('')
+            lines.append(f'按调用栈汇总的前 {min(self.top, 10)} 处分配：')
+            for stat in snapshot.statistics('traceback')[:min(self.top, 10)]:
+                lines.append(f'{stat.size / 1024:.1f} KiB, {stat.count} 块')
+                lines.extend(f'    {line}' for line in stat.traceback.format())
+            (self.run_dir / f'memory-{_safe_name(name)}{suffix}.txt').write_text('\n'.join(lines) + '\n',
+                                                                                  encoding='utf-8')
+
+    def close(self) -> Optional[Path]:
+        if self._closed:
+            return None
+        self._closed = True
+        self.dump()
+        if self.mode == 'memory':
+            tracemalloc.stop()
+        return self.run_dir
@@ -0,0 +1,89 @@
+from dataclasses import dataclass
+from io import BytesIO
+from typing import Optional, Tuple
+
+from PIL import Image
+
+# transcode_format 配置值 -> PIL 编码器名称
+TRANSCODE_FORMATS = {
+    'webp': 'WEBP',
+    'avif': 'AVIF',
+    'jpeg': 'JPEG',
+    'jpg': 'JPEG',
+}
+
+
+def transcode_bytes(data: bytes, fmt: str, quality: int, max_dim: int = 0) -> bytes:
+    """
+    把图片重新编码为 fmt，长边超过 max_dim（大于 0 时）则等比缩小；
+    动图保持原样，未缩放且重新编码后反而更大的图片也保留原始数据
+    """
+    img = Image.open(BytesIO(data))
+    if getattr(img, 'is_animated', False):
+        return data
+    target = TRANSCODE_FORMATS[fmt.lower()]
+    resized = False
+    if max_dim > 0 and max(img.size) > max_dim:
+        img.thumbnail((max_dim, max_dim), Image.LANCZOS)
+        resized = True
+    has_alpha = img.mode in ('RGBA', 'LA', 'PA') or 'transparency' in img.info
+    if target == 'JPEG' or not has_alpha:
+        if img.mode not in ('RGB', 'L'):
+            img = img.convert('RGB')
+    elif img.mode != 'RGBA':
+        img = img.convert('RGBA')
+    buf = BytesIO()
+    img.save(buf, format=target, quality=quality)
+    out = buf.getvalue()
+    if not resized and len(out) >= len(data):
+        return data
+    return out
+
+
+@dataclass(frozen=True)
+class TranscodeSettings:
+    """
+    转码参数，可直接传给子进程
+    """
+    format: str
+    quality: int = 80
+    max_dim: int = 0
+
+    @classmethod
+    def from_config(cls, cfg) -> Optional['TranscodeSettings']:
+        fmt = (cfg.transcode_format or '').lower()
+        if not fmt:
+            return None
+        if fmt not in TRANSCODE_FORMATS:
+            raise ValueError(f"不支持的 transcode_format: {cfg.transcode_format}（可选 {', '.join(TRANSCODE_FORMATS)}）")
+        return cls(format=fmt, quality=cfg.transcode_quality, max_dim=cfg.transcode_max_dim)
+
+    @property
+    def label(self) -> str:
+        """
+        写入 ComicInfo.xml 的 ScanInformation，记录页面的编码方式
+        """
+        label = f"{TRANSCODE_FORMATS[self.format]} q{self.quality}"
+        if self.max_dim > 0:
+            label += f" max{self.max_dim}px"
+        return label
+
+    def apply(self, data: bytes) -> bytes:
+        return transcode_bytes(data, self.format, self.quality, self.max_dim)
+
+    def apply_checked(self, data: bytes) -> Tuple[bytes, bool]:
+        """
+        返回 (数据, 是否重新编码)，保留了原始数据的页面为 False
+        """
+        out = self.apply(data)
+        return out, out is not data
+
+    def scan_information(self, encoded: int, total: int) -> Optional[str]:
+        """
+        有页面被重新编码时才返回 ScanInformation，只有部分页面重新编码时注明页数
+        """
+        if encoded <= 0:
+            return None
+        if encoded < total:
+            return f"{self.label} ({encoded}/{total} 页)"
+        return self.label
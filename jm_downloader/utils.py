@@ -1,5 +1,7 @@
 import logging
 import re
+import threading
+import time
 
 from rich.logging import RichHandler
 
@@ -82,6 +84,78 @@ def clean_title_for_filename(title: str, extract_brackets: bool = True, max_len:
     return t or "untitled"
 
 
+class RateLimiter:
+    """
+    线程安全的令牌桶限速器，rate 为每秒允许的请求数，burst 为可累积的突发量
+    """
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+# 下载中的图片先写入 <name>.part，完成后才重命名为正式文件
+PART_SUFFIX = '.part'
+
+_IMAGE_HEAD_BYTES = 16
+_IMAGE_TAIL_BYTES = 64
+
+
+def image_data_complete(head: bytes, tail: bytes, size: int) -> bool:
+    """
+    根据文件头识别格式，检查结尾标记是否存在（JPEG 的 EOI、PNG 的 IEND、GIF 的 trailer、WebP 的 RIFF 长度）；
+    无法识别的格式只要求非空
+    """
+    if size <= 0:
+        return False
+    if head.startswith(b'\xff\xd8'):
+        # JPEG 熵编码段中的 0xFF 都会被填充为 FF00，结尾附近出现 FFD9 即为 EOI
+        return b'\xff\xd9' in tail
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return tail.endswith(b'IEND\xaeB`\x82')
+    if head[:6] in (b'GIF87a', b'GIF89a'):
+        return tail.rstrip(b'\x00').endswith(b'\x3b')
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return int.from_bytes(head[4:8], 'little') + 8 <= size
+    return True
+
+
+def is_image_bytes_complete(data: bytes) -> bool:
+    return image_data_complete(data[:_IMAGE_HEAD_BYTES], data[-_IMAGE_TAIL_BYTES:], len(data))
+
+
+def is_image_file_complete(path) -> bool:
+    """
+    只读取文件头尾几十个字节判断图片是否完整
+    """
+    try:
+        with open(path, 'rb') as f:
+            head = f.read(_IMAGE_HEAD_BYTES)
+            size = f.seek(0, 2)
+            f.seek(max(0, size - _IMAGE_TAIL_BYTES))
+            tail = f.read()
+    except OSError:
+        return False
+    return image_data_complete(head, tail, size)
+
+
 def setup_logging():
     logging.basicConfig(
         level=logging.INFO,
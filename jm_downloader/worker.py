@@ -0,0 +1,128 @@
+import time
+from typing import Any, Dict, Optional
+
+from rich.console import Console
+
+from .db import DBWriteError, TASK_DONE, TASK_FAILED, TASK_PENDING, TASK_RUNNING
+from .metrics import metrics
+
+console = Console()
+
+
+class Worker:
+    """
+    从数据库任务表认领本子/章节并处理，多个进程（共用数据库和输出目录）可以同时运行。
+
+    认领的任务带租约（lease_seconds），心跳线程每 lease_seconds/3 秒续约一次；
+    进程崩溃后租约到期，任务会被其他 worker 重新认领。
+    本子任务只负责获取详情并登记章节，章节任务才真正下载和打包，所以一个大本子的章节也会分散到各个进程
+    """
+
+    def __init__(self, downloader, lease_seconds: float = 300, poll_interval: float = 5):
+        self.downloader = downloader
+        self.db = downloader.db
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.owner = downloader.task_owner
+        self._contexts: Dict[str, Any] = {}
+
+    def run(self) -> int:
+        """
+        处理到队列中没有待处理、也没有被其他进程持有的任务为止，返回处理的任务数
+        """
+        handled = 0
+        try:
+            with self.db.hold_leases(self.owner, self.lease_seconds):
+                while True:
+                    task = self.db.claim_task('chapter', self.owner, self.lease_seconds) \
+                        or self.db.claim_task('album', self.owner, self.lease_seconds)
+                    if task is None:
+                        if not self.db.count_open_tasks():
+                            break
+                        # 剩下的任务都被其他进程持有，等它们完成或租约过期
+                        time.sleep(self.poll_interval)
+                        continue
+                    handled += 1
+                    metrics.inc('worker_tasks_total', kind=task['kind'])
+                    if task['kind'] == 'chapter':
+                        self._process_chapter(task)
+                    else:
+                        self._plan_album(task)
+        finally:
+            released = self.db.release_owner(self.owner)
+            if released:
+                console.log(f'[yellow]{self.owner} 退出，{released} 个未完成的任务已放回队列[/yellow]')
+        console.log(f'[green]{self.owner} 队列已处理完，本进程处理了 {handled} 个任务[/green]')
+        return handled
+
+    def _plan_album(self, task: Dict[str, Any]):
+        album_id = task['album_id']
+        books = self.db.get_books([album_id])
+        if (books.get(album_id) or {}).get('download_status') == 1:
+            self.db.release_task(album_id, '', 0, self.owner, fallback_state=TASK_DONE)
+            return
+        try:
+            album = self.downloader._get_album_detail(album_id, raise_error=True)
+        except Exception as e:
+            console.log(f'[red]获取本子 {album_id} 详情失败: {e}[/red]')
+            self.db.release_task(album_id, '', 0, self.owner, error=f'获取详情失败: {e}')
+            return
+        photos = list(album)
+        if not photos:
+            console.log(f'[yellow]本子 {album_id} 没有章节，跳过[/yellow]')
+            self.db.release_task(album_id, '', 0, self.owner, fallback_state=TASK_DONE)
+            return
+        console.log(f'[blue]登记本子 {album_id}：{len(photos)} 章[/blue]')
+        self.db.plan_album(album_id, [(str(p.photo_id), idx) for idx, p in enumerate(photos, start=1)])
+        # 本子任务保持进行中但不再持有租约，由最后完成的章节收尾
+        self.db.release_task(album_id, '', 0, self.owner, fallback_state=TASK_RUNNING)
+        self._finish_album_if_settled(album_id)
+
+    def _process_chapter(self, task: Dict[str, Any]):
+        album_id, photo_id = task['album_id'], task['photo_id']
+        error: Optional[str] = None
+        try:
+            ctx, idx, summary = self._chapter_item(album_id, photo_id)
+            errors = self.downloader._run_chapters(ctx, [(idx, summary)])
+            if errors:
+                error = f'处理异常: {errors[0]}'
+        except Exception as e:
+            console.log(f'[red]章节 {album_id}/{photo_id} 处理失败: {e}[/red]')
+            error = str(e)
+        # 各阶段已经写入结果的不受影响，没写入的（异常中断）记为失败
+        self.db.release_task(album_id, photo_id, 0, self.owner, error=error or '处理中断')
+        self._finish_album_if_settled(album_id)
+
+    def _chapter_item(self, album_id: str, photo_id: str):
+        album = self.downloader._get_album_detail(album_id, raise_error=True)
+        ctx = self._contexts.get(album_id)
+        if ctx is None:
+            ctx = self._contexts[album_id] = self.downloader._album_context(album)
+        for idx, p in enumerate(album, start=1):
+            if str(p.photo_id) == photo_id:
+                return ctx, idx, p
+        raise LookupError(f'本子 {album_id} 中没有章节 {photo_id}')
+
+    def _finish_album_if_settled(self, album_id: str):
+        """
+        所有章节完成时标记本子完成；没有待处理/进行中的章节但有失败的，本子记为失败
+        """
+        states = self.db.get_chapter_states(album_id).values()
+        if not any(s == TASK_PENDING for s in states):
+            # 本进程不会再认领这个本子的章节，释放缓存的详情和上下文（租约过期被重新认领时会重新获取）
+            self._contexts.pop(album_id, None)
+            self.downloader._album_cache.pop(album_id, None)
+        if not states or any(s in (TASK_PENDING, TASK_RUNNING) for s in states):
+            return
+        if all(s == TASK_DONE for s in states):
+            self.db.finish_task(album_id, state=TASK_DONE)
+            self.db.mark_album_completed(album_id)
+            metrics.inc('albums_total', result='completed')
+            console.log(f'[bold green]本子 {album_id} 全部章节处理完毕，标记为完成[/bold green]')
+        else:
+            self.db.finish_task(album_id, state=TASK_FAILED, error='部分章节失败')
+            metrics.inc('albums_total', result='failed')
+        try:
+            self.db.flush()
+        except DBWriteError as e:
+            console.log(f'[red]本子 {album_id} 的数据库写入失败: {e}[/red]')
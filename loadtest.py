@@ -0,0 +1,523 @@
+import argparse
+import base64
+import hashlib
+import io
+import json
+import multiprocessing
+import random
+import statistics
+import tempfile
+import threading
+import time
+from dataclasses import dataclass, asdict, field
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlsplit, parse_qs
+from urllib.request import urlopen
+
+from PIL import Image
+from rich.console import Console
+from rich.table import Table
+
+console = Console()
+
+# 本子/章节 id 从这里开始分配，大于 421926 时 jmcomic 按 md5 计算分割数，可以覆盖 2~16 段的解密路径
+ALBUM_ID_BASE = 600000
+ALBUM_ID_STEP = 100
+MOCK_SCRAMBLE_ID = 220980
+
+
+@dataclass
+class MockSettings:
+    """
+    模拟服务端的数据规模与故障注入参数
+    """
+    albums: int = 5
+    chapters: int = 3
+    pages: int = 20
+    image_size: Tuple[int, int] = (800, 1200)
+    authors: int = 3
+    latency_ms: float = 30
+    jitter_ms: float = 20
+    # 每个响应的下行带宽（KiB/s），0 表示不限
+    bandwidth_kbps: float = 0
+    # 随机返回 500 的比例
+    error_rate: float = 0.0
+    # 登录态有效期（秒），过期后 API 返回 401，0 表示永不过期
+    session_ttl: float = 0
+    # 服务端每秒最多处理的请求数，超过返回 429，0 表示不限
+    rate_limit: float = 0
+    seed: int = 1
+
+
+class MockCatalog:
+    """
+    按固定随机种子生成的本子、章节、作者与图片；图片按 jmcomic 的规则打乱后返回
+    """
+
+    def __init__(self, s: MockSettings):
+        from jmcomic import JmImageTool
+        self._get_num = JmImageTool.get_num
+        rnd = random.Random(s.seed)
+        self.settings = s
+        self.albums: Dict[str, dict] = {}
+        self.photos: Dict[str, dict] = {}
+        for i in range(s.albums):
+            aid = str(ALBUM_ID_BASE + i * ALBUM_ID_STEP)
+            author = f'mock_author_{rnd.randrange(max(1, s.authors))}'
+            series = []
+            for c in range(s.chapters):
+                pid = str(int(aid) + c)
+                series.append({'id': pid, 'name': f'第{c + 1}話', 'sort': str(c + 1)})
+                self.photos[pid] = {'album_id': aid, 'sort': c + 1}
+            self.albums[aid] = {
+                'id': aid, 'name': f'[{author}] Mock Album {i}', 'author': [author],
+                'tags': ['mock', f'tag{rnd.randrange(10)}'], 'series': series,
+            }
+        self._variants = [Image.effect_noise(s.image_size, 32 + v * 8).convert('RGB') for v in range(4)]
+        self._image_cache: Dict[Tuple[int, int], bytes] = {}
+        self._lock = threading.Lock()
+
+    def brief(self, aid: str) -> dict:
+        a = self.albums[aid]
+        return {'id': aid, 'author': a['author'][0], 'description': '', 'name': a['name'], 'image': '',
+                'latest_ep': None, 'latest_ep_aid': None,
+                'category': {'id': '1', 'title': '同人'}, 'category_sub': {'id': '1', 'title': '同人'}}
+
+    def album_detail(self, aid: str) -> Optional[dict]:
+        a = self.albums.get(aid)
+        if a is None:
+            return None
+        return {**a, 'images': [], 'description': 'mock album', 'total_views': '1', 'likes': '1',
+                'series_id': '0', 'comment_total': '0', 'works': [], 'actors': [], 'related_list': [],
+                'liked': False, 'is_favorite': True, 'total_photos': str(self.settings.pages),
+                'addtime': str(int(time.time()))}
+
+    def photo_detail(self, pid: str) -> Optional[dict]:
+        p = self.photos.get(pid)
+        if p is None:
+            return None
+        a = self.albums[p['album_id']]
+        return {'id': pid, 'series': a['series'], 'tags': 'mock', 'name': f"{a['name']} 第{p['sort']}話",
+                'images': [f'{n:05d}.jpg' for n in range(1, self.settings.pages + 1)],
+                'series_id': p['album_id'], 'is_favorite': False, 'liked': False}
+
+    def image(self, pid: str, name: str) -> Optional[bytes]:
+        if pid not in self.photos:
+            return None
+        stem = name.rsplit('.', 1)[0]
+        variant = int(hashlib.md5(f'{pid}/{stem}'.encode()).hexdigest(), 16) % len(self._variants)
+        num = self._get_num(MOCK_SCRAMBLE_ID, pid, stem)
+        key = (variant, num)
+        with self._lock:
+            data = self._image_cache.get(key)
+        if data is None:
+            data = self._scramble(self._variants[variant], num)
+            with self._lock:
+                self._image_cache[key] = data
+        return data
+
+    @staticmethod
+    def _scramble(img, num: int) -> bytes:
+        # descramble 的逆操作：原图的第 y_dst 段放到 y_src 处
+        from jm_downloader.descramble import row_blocks
+        w, h = img.size
+        out = img
+        if num > 0:
+            out = Image.new('RGB', (w, h))
+            for y_src, y_dst, move in row_blocks(h, num):
+                out.paste(img.crop((0, y_dst, w, y_dst + move)), (0, y_src))
+        buf = io.BytesIO()
+        out.save(buf, 'JPEG', quality=90)
+        return buf.getvalue()
+
+
+class MockStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters: Dict[str, int] = {}
+        self.image_paths: Dict[str, int] = {}
+
+    def inc(self, key: str, n: int = 1):
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + n
+
+    def image_request(self, path: str):
+        with self._lock:
+            self.image_paths[path] = self.image_paths.get(path, 0) + 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            requested = len(self.image_paths)
+            total = sum(self.image_paths.values())
+            return {**self.counters, 'image_unique': requested, 'image_requests': total,
+                    'image_retries': total - requested}
+
+
+def encrypt_data(obj, ts: str) -> str:
+    """
+    JmCryptoTool.decode_resp_data 的逆过程：json -> PKCS7 -> AES-ECB(md5(ts + secret)) -> base64
+    """
+    from Crypto.Cipher import AES
+    from jmcomic import JmMagicConstants
+    raw = json.dumps(obj, ensure_ascii=False).encode('utf-8')
+    pad = 16 - len(raw) % 16
+    raw += bytes([pad]) * pad
+    key = hashlib.md5(f'{ts}{JmMagicConstants.APP_DATA_SECRET}'.encode('utf-8')).hexdigest().encode('utf-8')
+    return base64.b64encode(AES.new(key, AES.MODE_ECB).encrypt(raw)).decode('ascii')
+
+
+class MockJmServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, addr, settings: MockSettings):
+        super().__init__(addr, MockJmHandler)
+        self.settings = settings
+        self.catalog = MockCatalog(settings)
+        self.stats = MockStats()
+        self.sessions: Dict[str, float] = {}
+        self.sessions_lock = threading.Lock()
+        self.rnd = random.Random(settings.seed)
+        self.rnd_lock = threading.Lock()
+        self._bucket_tokens = float(max(1, int(settings.rate_limit)))
+        self._bucket_updated = time.monotonic()
+        self._bucket_lock = threading.Lock()
+
+    def random(self) -> float:
+        with self.rnd_lock:
+            return self.rnd.random()
+
+    def allow_request(self) -> bool:
+        rate = self.settings.rate_limit
+        if rate <= 0:
+            return True
+        with self._bucket_lock:
+            now = time.monotonic()
+            self._bucket_tokens = min(max(1.0, rate), self._bucket_tokens + (now - self._bucket_updated) * rate)
+            self._bucket_updated = now
+            if self._bucket_tokens >= 1:
+                self._bucket_tokens -= 1
+                return True
+            return False
+
+    def new_session(self) -> str:
+        token = hashlib.md5(f'{time.time()}{self.random()}'.encode()).hexdigest()
+        with self.sessions_lock:
+            self.sessions[token] = time.monotonic()
+        return token
+
+    def session_valid(self, token: Optional[str]) -> bool:
+        with self.sessions_lock:
+            issued = self.sessions.get(token) if token else None
+        if issued is None:
+            return False
+        ttl = self.settings.session_ttl
+        return ttl <= 0 or time.monotonic() - issued < ttl
+
+
+class MockJmHandler(BaseHTTPRequestHandler):
+    server: MockJmServer
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def do_GET(self):
+        self._dispatch()
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        self._body = self.rfile.read(length).decode('utf-8') if length else ''
+        self._dispatch()
+
+    def _dispatch(self):
+        srv = self.server
+        s = srv.settings
+        parts = urlsplit(self.path)
+        path, query = parts.path, {k: v[0] for k, v in parse_qs(parts.query).items()}
+        if path == '/__stats':
+            return self._send(200, json.dumps(srv.stats.snapshot()).encode(), 'application/json')
+
+        is_image = path.startswith('/media/photos/')
+        srv.stats.inc('requests')
+        if s.latency_ms or s.jitter_ms:
+            time.sleep(max(0.0, s.latency_ms + (srv.random() * 2 - 1) * s.jitter_ms) / 1000)
+        if is_image:
+            srv.stats.image_request(path)
+        if not srv.allow_request():
+            srv.stats.inc('status_429')
+            return self._send(429, b'{"code": 429, "errorMsg": "Too Many Requests"}', 'application/json')
+        if srv.random() < s.error_rate:
+            srv.stats.inc('status_500')
+            return self._send(500, b'mock internal error', 'text/plain')
+
+        if is_image:
+            _, _, _, pid, name = path.split('/', 4)
+            data = srv.catalog.image(pid, name)
+            if data is None:
+                return self._send(404, b'', 'text/plain')
+            srv.stats.inc('image_bytes', len(data))
+            return self._send(200, data, 'image/jpeg')
+
+        ts = (self.headers.get('tokenparam') or '0,').split(',')[0]
+        if path == '/chapter_view_template':
+            return self._send(200, f'<script>var scramble_id = {MOCK_SCRAMBLE_ID};</script>'.encode(), 'text/html')
+        if path == '/setting':
+            from jmcomic import JmMagicConstants
+            return self._api(ts, {'jm3_version': JmMagicConstants.APP_VERSION})
+        if path == '/login':
+            srv.stats.inc('logins')
+            form = {k: v[0] for k, v in parse_qs(getattr(self, '_body', '')).items()}
+            token = srv.new_session()
+            return self._api(ts, {'uid': '1', 'username': form.get('username', 'mock'), 's': token,
+                                  'message': 'Welcome'}, cookies={'AVS': token})
+
+        if not srv.session_valid(self._cookie('AVS')):
+            srv.stats.inc('status_401')
+            return self._send(401, json.dumps({'code': 401, 'data': [], 'errorMsg': '請先登入會員'},
+                                              ensure_ascii=False).encode(), 'application/json')
+        cat = srv.catalog
+        if path == '/favorite':
+            page = int(query.get('page', 1))
+            ids = list(cat.albums)[(page - 1) * 20: page * 20]
+            return self._api(ts, {'list': [cat.brief(a) for a in ids], 'folder_list': [],
+                                  'total': str(len(cat.albums)), 'count': len(ids)})
+        if path == '/album':
+            return self._api(ts, cat.album_detail(query.get('id', '')) or {'name': None})
+        if path == '/chapter':
+            return self._api(ts, cat.photo_detail(query.get('id', '')) or {'name': None})
+        if path == '/search':
+            q = query.get('search_query', '')
+            hits = [a for a, v in cat.albums.items() if q in v['author'] or q in v['name']]
+            hits.sort(key=int, reverse=True)
+            page = int(query.get('page', 1))
+            return self._api(ts, {'search_query': q, 'total': str(len(hits)),
+                                  'content': [cat.brief(a) for a in hits[(page - 1) * 80: page * 80]]})
+        return self._send(404, b'{"code": 404, "data": []}', 'application/json')
+
+    def _cookie(self, name: str) -> Optional[str]:
+        for part in (self.headers.get('Cookie') or '').split(';'):
+            k, _, v = part.strip().partition('=')
+            if k == name:
+                return v
+        return None
+
+    def _api(self, ts: str, obj, cookies: Optional[Dict[str, str]] = None):
+        body = json.dumps({'code': 200, 'data': encrypt_data(obj, ts)}).encode()
+        self._send(200, body, 'application/json', cookies)
+
+    def _send(self, code: int, body: bytes, ctype: str, cookies: Optional[Dict[str, str]] = None):
+        self.send_response(code)
+        self.send_header('Content-Type', ctype)
+        self.send_header('Content-Length', str(len(body)))
+        for k, v in (cookies or {}).items():
+            self.send_header('Set-Cookie', f'{k}={v}; Path=/')
+        self.end_headers()
+        bw = self.server.settings.bandwidth_kbps
+        if bw <= 0 or self.command == 'HEAD':
+            self.wfile.write(body)
+            return
+        chunk = 16 * 1024
+        for i in range(0, len(body), chunk):
+            self.wfile.write(body[i:i + chunk])
+            time.sleep(min(chunk, len(body) - i) / (bw * 1024))
+
+
+def run_server(settings: MockSettings, port: int, ready=None):
+    server = MockJmServer(('127.0.0.1', port), settings)
+    if ready is not None:
+        ready.put(server.server_address[1])
+    server.serve_forever()
+
+
+def start_server_process(settings: MockSettings, port: int = 0):
+    """
+    在独立进程中运行模拟服务端，避免服务端的图片编码与被测下载器争抢同一个 GIL
+    """
+    ctx = multiprocessing.get_context('spawn')
+    ready = ctx.Queue()
+    proc = ctx.Process(target=run_server, args=(settings, port, ready), daemon=True)
+    proc.start()
+    return proc, ready.get(timeout=60)
+
+
+@dataclass
+class LoadReport:
+    albums: int = 0
+    albums_completed: int = 0
+    images: int = 0
+    failed_images: int = 0
+    seconds: float = 0.0
+    latencies_ms: List[float] = field(default_factory=list)
+    server: dict = field(default_factory=dict)
+    # 下载器自身的指标快照（jm_downloader.metrics）
+    metrics: dict = field(default_factory=dict)
+
+    def summary(self) -> dict:
+        lat = sorted(self.latencies_ms)
+
+        def pct(p):
+            if not lat:
+                return 0.0
+            return lat[min(len(lat) - 1, int(round(p / 100 * (len(lat) - 1))))]
+
+        return {
+            'albums': self.albums,
+            'albums_completed': self.albums_completed,
+            'images': self.images,
+            'failed_images': self.failed_images,
+            'seconds': round(self.seconds, 3),
+            'images_per_sec': round(self.images / max(self.seconds, 1e-9), 2),
+            'latency_p50_ms': round(pct(50), 1),
+            'latency_p99_ms': round(pct(99), 1),
+            'latency_mean_ms': round(statistics.fmean(lat), 1) if lat else 0.0,
+            'server': self.server,
+            'metrics': self.metrics,
+        }
+
+
+def configure_jmcomic(addr: str) -> None:
+    """
+    让 jmcomic 的 API 与图片请求都指向本地模拟服务端
+    """
+    import jmcomic
+    from jmcomic import JmModuleConfig
+    jmcomic.disable_jm_log()
+    JmModuleConfig.PROT = 'http://'
+    JmModuleConfig.DOMAIN_IMAGE_LIST = [addr]
+    JmModuleConfig.DOMAIN_API_LIST = [addr]
+    JmModuleConfig.FLAG_API_CLIENT_AUTO_UPDATE_DOMAIN = False
+    JmModuleConfig.SCRAMBLE_CACHE.clear()
+
+
+def write_option_file(path: Path, addr: str, retry_times: int) -> Path:
+    from jmcomic import JmOption
+    option = JmOption.default()
+    option.client.impl = 'api'
+    option.client.domain = [addr]
+    option.client.retry_times = retry_times
+    option.to_file(str(path))
+    return path
+
+
+def run_load(args, addr: str, workdir: Path) -> LoadReport:
+    from jm_downloader.config import DownloaderConfig
+    from jm_downloader.downloader import JmFavDownloader
+    from jm_downloader.metrics import metrics
+    from jm_downloader.profiling import Profiler
+
+    report = LoadReport()
+    lock = threading.Lock()
+
+    class InstrumentedDownloader(JmFavDownloader):
+        def _timed(self, fn, *a):
+            started = time.perf_counter()
+            result = fn(*a)
+            elapsed = (time.perf_counter() - started) * 1000
+            with lock:
+                report.latencies_ms.append(elapsed)
+                if result:
+                    report.images += 1
+                else:
+                    report.failed_images += 1
+            return result
+
+        def _download_image(self, img, out_path, task=None):
+            return self._timed(super()._download_image, img, out_path, task)
+
+        def _fetch_image_bytes(self, img):
+            return self._timed(super()._fetch_image_bytes, img)
+
+    cfg = DownloaderConfig(
+        out_dir=workdir / 'out',
+        save_db=workdir / 'db.sqlite',
+        retries=args.retries,
+        image_workers=args.workers,
+        api_rate=args.api_rate,
+        pack_mode=args.pack_mode,
+        jm_option_file=write_option_file(workdir / 'option.yml', addr, args.client_retries),
+        username='mock', password='mock',
+    )
+    profiler = Profiler.create(args.profile, Path(args.profile_dir), 'loadtest')
+    downloader = InstrumentedDownloader(cfg, profiler=profiler)
+    try:
+        started = time.perf_counter()
+        album_ids = downloader.get_favorites_album_ids()
+        downloader.download_album_list(album_ids)
+        report.seconds = time.perf_counter() - started
+        report.albums = len(album_ids)
+        report.albums_completed = sum(1 for aid in album_ids if downloader.db.is_album_completed(aid))
+    finally:
+        downloader.close()
+    report.metrics = metrics.snapshot()
+    profile_dir = profiler.close()
+    if profile_dir:
+        console.log(f'[blue]性能分析结果已写入 {profile_dir}[/blue]')
+    with urlopen(f'http://{addr}/__stats') as resp:
+        report.server = json.loads(resp.read())
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='本地模拟 JM 服务端与下载压测')
+    parser.add_argument('command', nargs='?', choices=['run', 'serve'], default='run',
+                        help='run: 启动模拟服务端并压测 (默认); serve: 只启动模拟服务端')
+    parser.add_argument('--port', type=int, default=0, help='模拟服务端端口，0 表示随机')
+    parser.add_argument('--albums', type=int, default=5)
+    parser.add_argument('--chapters', type=int, default=3)
+    parser.add_argument('--pages', type=int, default=20)
+    parser.add_argument('--image-size', type=int, nargs=2, default=[800, 1200], metavar=('W', 'H'))
+    parser.add_argument('--latency-ms', type=float, default=30, help='每个请求的基础延迟')
+    parser.add_argument('--jitter-ms', type=float, default=20, help='延迟的随机抖动范围')
+    parser.add_argument('--bandwidth-kbps', type=float, default=0, help='每个响应的下行带宽 KiB/s，0 不限')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='随机返回 500 的比例')
+    parser.add_argument('--session-ttl', type=float, default=0, help='登录态有效期（秒），过期后返回 401')
+    parser.add_argument('--rate-limit', type=float, default=0, help='服务端每秒请求上限，超过返回 429')
+    parser.add_argument('--workers', type=int, default=4, help='下载器 image_workers')
+    parser.add_argument('--api-rate', type=float, default=0, help='下载器 api_rate')
+    parser.add_argument('--retries', type=int, default=3, help='下载器图片重试次数')
+    parser.add_argument('--client-retries', type=int, default=2, help='jmcomic 客户端自身的重试次数')
+    parser.add_argument('--pack-mode', choices=['staged', 'direct'], default='staged')
+    parser.add_argument('--json', help='把压测结果写入 JSON 文件', default=None)
+    parser.add_argument('--profile', choices=['cpu', 'memory'], default=None,
+                        help='对下载器按阶段进行性能分析: cpu (cProfile) 或 memory (tracemalloc)')
+    parser.add_argument('--profile-dir', default='profiles', help='性能分析结果目录')
+    args = parser.parse_args()
+
+    settings = MockSettings(
+        albums=args.albums, chapters=args.chapters, pages=args.pages, image_size=tuple(args.image_size),
+        latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, bandwidth_kbps=args.bandwidth_kbps,
+        error_rate=args.error_rate, session_ttl=args.session_ttl, rate_limit=args.rate_limit,
+    )
+
+    if args.command == 'serve':
+        console.log(f'[green]模拟服务端监听 127.0.0.1:{args.port or 8000}[/green]')
+        run_server(settings, args.port or 8000)
+        return
+
+    proc, port = start_server_process(settings, args.port)
+    addr = f'127.0.0.1:{port}'
+    console.log(f'[blue]模拟服务端已启动: {addr}，{asdict(settings)}[/blue]')
+    try:
+        configure_jmcomic(addr)
+        with tempfile.TemporaryDirectory(prefix='jm-load-') as tmp:
+            report = run_load(args, addr, Path(tmp))
+    finally:
+        proc.terminate()
+
+    result = report.summary()
+    table = Table('指标', '数值')
+    for k, v in result.items():
+        if k not in ('server', 'metrics'):
+            table.add_row(k, str(v))
+    for k, v in sorted(result['server'].items()):
+        table.add_row(f'server.{k}', str(v))
+    console.print(table)
+    if args.json:
+        Path(args.json).write_text(json.dumps(result, indent=2, ensure_ascii=False), encoding='utf-8')
+        console.log(f'[green]结果已写入 {args.json}[/green]')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,46 +1,103 @@
 import argparse
+import hashlib
+import json
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
 
 from rich.console import Console
 from rich.progress import track
 
-from jm_downloader.cbz_packer import CbzPacker
 from jm_downloader.config import DownloaderConfig, load_config_from_yaml
-from jm_downloader.db import JmDB
-from jm_downloader.utils import setup_logging, clean_title_for_filename
+from jm_downloader.db import JmDB, DBWriteError
+from jm_downloader.metrics import RunReporter, metrics
+from jm_downloader.profiling import PROFILE_MODES, NullProfiler, Profiler
+from jm_downloader.transcode import TranscodeSettings
+from jm_downloader.utils import setup_logging, clean_title_for_filename, PART_SUFFIX
 
 console = Console()
 
+# 打包进程内的性能分析器；子进程由 _init_worker 创建自己的实例，每完成一个章节写一次结果
+_profiler = NullProfiler()
+_dump_each_job = False
 
-def main():
-    parser = argparse.ArgumentParser(description='JM Repacker - Repack existing folders with new metadata')
-    parser.add_argument('--config', '-c', help='YAML 配置文件路径', default=None)
-    args = parser.parse_args()
 
-    # Load Config to get paths
-    cfg_data = load_config_from_yaml(args.config)
-    cfg = DownloaderConfig(
-        out_dir=Path(cfg_data.get('out_dir', './downloads')),
-        retries=int(cfg_data.get('retries', 3)),
-        delete_after_pack=bool(cfg_data.get('delete_after_pack', False)),
-        extract_title=bool(cfg_data.get('extract_title', False)),
-        jm_option_file=Path(cfg_data['jm_option_file']) if cfg_data.get('jm_option_file') else None,
-        username=args.username or cfg_data.get('username'),
-        password=args.password or cfg_data.get('password'),
-        download_favorites=False,
-        album_ids=[],
-        save_db=Path(cfg_data.get('save_db', './downloads_db.sqlite'))
-    )
+def _init_worker(profile_mode, run_dir):
+    global _profiler, _dump_each_job
+    if profile_mode:
+        _profiler = Profiler(profile_mode, run_dir)
+        _dump_each_job = True
 
-    setup_logging()
+
+def chapter_manifest(chap_dir: Path, meta: dict) -> str:
+    """
+    章节清单：图片数量、总大小、文件名/大小/mtime 的摘要以及元数据摘要，任一变化即需要重打包
+    """
+    files = []
+    for entry in os.scandir(chap_dir):
+        if entry.is_file() and not entry.name.endswith(PART_SUFFIX):
+            st = entry.stat()
+            files.append((entry.name, st.st_size, st.st_mtime_ns))
+    files.sort()
+    return json.dumps({
+        'count': len(files),
+        'bytes': sum(f[1] for f in files),
+        'files': hashlib.sha1(json.dumps(files).encode('utf-8')).hexdigest(),
+        'meta': hashlib.sha1(json.dumps(meta, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest(),
+    }, sort_keys=True)
+
+
+def pack_chapter(job: dict):
+    """
+    在子进程中执行的单章节打包任务，只负责打包，数据库写入由主进程统一完成
+    """
+    # cbz 库导入较慢，章节都未变化时不需要加载
+    from jm_downloader.cbz_packer import CbzPacker
+
+    chap_dir = Path(job['chap_dir'])
+    started = time.perf_counter()
+    try:
+        in_bytes = sum(p.stat().st_size for p in CbzPacker.image_files(chap_dir))
+        with _profiler.stage('pack'):
+            CbzPacker.pack_images_to_cbz(
+                images_folder=chap_dir,
+                cbz_path=Path(job['cbz_file']),
+                title=job['title'],
+                series=job['series'],
+                number=job['number'],
+                authors=job['authors'],
+                tags=job['tags'],
+                summary=job['summary'],
+                album_id=job['aid'],
+                transcode=job['transcode']
+            )
+        return job, in_bytes, time.perf_counter() - started, None
+    except Exception as e:
+        return job, 0, time.perf_counter() - started, str(e)
+    finally:
+        if _dump_each_job:
+            _profiler.dump()
+
+
+def repack(cfg: DownloaderConfig, force: bool = False, workers: int = 1, profiler=None):
+    try:
+        transcode = TranscodeSettings.from_config(cfg)
+    except ValueError as e:
+        console.log(f"[red]{e}[/red]")
+        return
     db = JmDB(cfg.save_db)
+    try:
+        _repack(cfg, db, transcode, force, workers, profiler)
+    finally:
+        db.close()
 
+
+def _repack(cfg: DownloaderConfig, db: JmDB, transcode, force: bool, workers: int, profiler):
     console.log("[blue]读取数据库中书籍信息...[/blue]")
-    books = {}
     try:
-        db.cursor.execute("SELECT * FROM books")
-        for row in db.cursor.fetchall():
-            books[row['id']] = dict(row)
+        books = db.get_all_books()
     except Exception as e:
         console.log(f"[red]读取数据库失败: {e}[/red]")
         return
@@ -54,69 +111,153 @@ def main():
         console.log(f"[red]找不到原来的图片目录: {originals_dir}[/red]")
         return
 
+    # 只扫描一次 originals/，后续按目录名直接查表
+    book_dirs = {e.name: Path(e.path) for e in os.scandir(originals_dir) if e.is_dir()}
+    manifests = {} if force else db.get_pack_manifests()
+
     count = 0
+    skipped = 0
+    jobs = []
 
     console.log(f"[blue]开始扫描 {len(books)} 本已记录的书籍...[/blue]")
 
-    for aid, book in track(books.items(), description="Repacking..."):
+    for aid, book in track(books.items(), description="Scanning..."):
         raw_title = book['title']
 
-        candidates = set()
-        candidates.add(clean_title_for_filename(raw_title, extract_brackets=True, max_len=180))
-        candidates.add(clean_title_for_filename(raw_title, extract_brackets=False, max_len=180))
-        candidates.add(clean_title_for_filename(raw_title, extract_brackets=True, max_len=200))
-        candidates.add(clean_title_for_filename(raw_title, extract_brackets=False, max_len=200))
-
-        found_path = None
-        for cand in candidates:
-            p = originals_dir / cand
-            if p.exists() and p.is_dir():
-                found_path = p
-                break
+        candidates = [
+            clean_title_for_filename(raw_title, extract_brackets=True, max_len=180),
+            clean_title_for_filename(raw_title, extract_brackets=False, max_len=180),
+            clean_title_for_filename(raw_title, extract_brackets=True, max_len=200),
+            clean_title_for_filename(raw_title, extract_brackets=False, max_len=200),
+        ]
+        found_path = next((book_dirs[c] for c in candidates if c in book_dirs), None)
 
         if not found_path:
             continue
 
         cbz_base = cfg.out_dir / 'cbz' / found_path.name
         cbz_base.mkdir(parents=True, exist_ok=True)
-        authors_str = book['author']
-        tags_str = book['tags']
-        summary = book['description']
         cbz_series = clean_title_for_filename(raw_title, extract_brackets=cfg.extract_title, max_len=999)
 
-        for chap_dir in found_path.iterdir():
-            if not chap_dir.is_dir():
+        for chap_entry in os.scandir(found_path):
+            if not chap_entry.is_dir():
                 continue
 
-            chap_name = chap_dir.name
+            chap_dir = Path(chap_entry.path)
+            chap_name = chap_entry.name
 
-            import re
             num = 1.0
             m = re.search(r'第(\d+)话', chap_name)
             if m:
                 num = float(m.group(1))
 
-            cbz_file = cbz_base / f"{chap_name}.cbz"
-
-            try:
-                CbzPacker.pack_images_to_cbz(
-                    images_folder=chap_dir,
-                    cbz_path=cbz_file,
-                    title=f"{chap_name} - {cbz_series}",
-                    series=cbz_series,
-                    number=num,
-                    authors=authors_str,
-                    tags=tags_str,
-                    summary=summary,
-                    album_id=aid
-                )
-                db.mark_packed(aid, chap_name)
-            except Exception as e:
-                console.print(f"[red]打包失败 {found_path.name}/{chap_name}: {e}[/red]")
+            job = {
+                'aid': aid,
+                'book_dir': found_path.name,
+                'chap_name': chap_name,
+                'chap_dir': str(chap_dir),
+                'cbz_file': str(cbz_base / f"{chap_name}.cbz"),
+                'title': f"{chap_name} - {cbz_series}",
+                'series': cbz_series,
+                'number': num,
+                'authors': book['author'],
+                'tags': book['tags'],
+                'summary': book['description'],
+                'transcode': transcode,
+            }
+            meta = {k: job[k] for k in ('cbz_file', 'title', 'series', 'number', 'authors', 'tags', 'summary')}
+            if transcode is not None:
+                # 转码参数变化也需要重打包
+                meta['transcode'] = transcode.label
+            job['manifest'] = chapter_manifest(chap_dir, meta)
+            if manifests.get((aid, chap_name)) == job['manifest'] and Path(job['cbz_file']).exists():
+                skipped += 1
+                continue
+            jobs.append(job)
 
         count += 1
 
-    console.log(f"[green]重打包完成，共处理 {count} 本[/green]")
+    console.log(f"[blue]{skipped} 个章节未变化，跳过[/blue]")
+    metrics.inc('repack_chapters_total', skipped, result='unchanged')
+    workers = workers if workers > 0 else (os.cpu_count() or 1)
+    console.log(f"[blue]共 {len(jobs)} 个章节待打包，使用 {workers} 个进程[/blue]")
+
+    started = time.perf_counter()
+    packed = 0
+    failed = 0
+    total_bytes = 0
+    writes = []
+
+    def handle(result):
+        nonlocal packed, failed, total_bytes
+        job, in_bytes, seconds, err = result
+        # 子进程中的指标不会回传，这里按章节汇总
+        metrics.observe('repack_chapter_seconds', seconds)
+        metrics.inc('repack_chapters_total', result='failed' if err else 'packed')
+        if err:
+            failed += 1
+            console.print(f"[red]打包失败 {job['book_dir']}/{job['chap_name']}: {err}[/red]")
+            return
+        # 只在主进程写数据库
+        writes.append((job, db.mark_packed(job['aid'], job['chap_name'], job['manifest'])))
+        packed += 1
+        total_bytes += in_bytes
+        metrics.inc('repack_bytes_total', in_bytes)
+
+    if workers == 1:
+        for job in track(jobs, description="Repacking..."):
+            handle(pack_chapter(job))
+    else:
+        profile_args = (profiler.mode, profiler.run_dir) if profiler is not None else (None, None)
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=profile_args) as pool:
+            futures = [pool.submit(pack_chapter, job) for job in jobs]
+            for fut in track(as_completed(futures), total=len(futures), description="Repacking..."):
+                handle(fut.result())
+
+    # 打包记录写入失败的章节算作失败，下次运行仍会重新打包
+    try:
+        db.flush()
+    except DBWriteError as e:
+        console.log(f"[red]{e}[/red]")
+        lost = [job for job, fut in writes if fut is not None and fut.exception() is not None]
+        for job in lost:
+            console.print(f"[red]打包记录写入失败 {job['book_dir']}/{job['chap_name']}[/red]")
+        metrics.inc('repack_chapters_total', len(lost), result='failed')
+        packed -= len(lost)
+        failed += len(lost)
+
+    elapsed = max(time.perf_counter() - started, 1e-9)
+    console.log(f"[green]重打包完成，共处理 {count} 本，{packed} 章成功，{failed} 章失败[/green]")
+    console.log(f"[green]耗时 {elapsed:.1f}s，{packed / elapsed:.2f} 章/s，"
+                f"{total_bytes / elapsed / 1024 / 1024:.2f} MB/s[/green]")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='JM Repacker - Repack existing folders with new metadata')
+    parser.add_argument('--config', '-c', help='YAML 配置文件路径', default=None)
+    parser.add_argument('--jobs', '-j', type=int, default=1, help='并行打包的进程数 (0 表示 CPU 核数)')
+    parser.add_argument('--force', '-f', action='store_true', help='忽略打包清单，强制重打包所有章节')
+    parser.add_argument('--profile', choices=PROFILE_MODES, default=None,
+                        help='按阶段进行性能分析: cpu (cProfile) 或 memory (tracemalloc)，结果写入 out_dir/profiles/')
+    args = parser.parse_args()
+
+    # Load Config to get paths
+    cfg_data = load_config_from_yaml(args.config)
+    cfg = DownloaderConfig.from_dict(cfg_data, download_favorites=False, album_ids=[])
+
+    setup_logging()
+    reporter = RunReporter.from_config(cfg, 'repack').start()
+    global _profiler
+    _profiler = Profiler.create(args.profile, cfg.out_dir / 'profiles', 'repack')
+    try:
+        repack(cfg, force=args.force, workers=args.jobs, profiler=_profiler)
+    finally:
+        report = reporter.close()
+        if report:
+            console.log(f"[blue]运行报告已写入 {report}[/blue]")
+        profile_dir = _profiler.close()
+        if profile_dir:
+            console.log(f"[blue]性能分析结果已写入 {profile_dir}[/blue]")
 
 
 if __name__ == '__main__':